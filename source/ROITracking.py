@@ -1,121 +1,466 @@
-﻿import cv2
+﻿import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import cv2
 import numpy as np
-from PyQt5.QtCore import QThread, pyqtSignal
+from source.ebma import ebma_search_vectorized
+from source.frame_source import FrameSource
+from source.reacquisition import OrbReacquisition
+from source.roi import cropped_search, roi_block_mask
+from source.stage_timing import StageTimer
+from source.threestepsearch import tss_search_batched
+
+
+# Box colors of the targets, in BGR, the first target keeps the original blue
+TARGET_COLORS = [(255, 0, 0), (0, 200, 0), (0, 0, 255), (0, 200, 255), (255, 0, 255), (255, 255, 0)]
+# Size boxes are resized to, in grayscale, to compare the appearance of a target between frames
+THUMBNAIL_SIZE = (16, 16)
+
+# Every tracker backend creates trackers with the interface of OpenCV's: init(frame, bbox) and
+# update(frame) -> (found, bbox), on BGR frames and (x, y, width, height) boxes. The factory is None when
+# this OpenCV build does not have the tracker.
+TrackerBackend = namedtuple('TrackerBackend', ['label', 'factory'])
+
+
+def _opencv_tracker(name):
+    # KCF and CSRT are only in the contrib build, and in its legacy module in some versions
+    for module in (cv2, getattr(cv2, 'legacy', None)):
+        factory = getattr(module, name, None)
+        if factory is not None:
+            return factory
+    return None
+
+
+class MotionVectorTracker:
+    """
+    Moves the box by the median motion vector of the blocks inside it.
+
+    The blocks of the previous frame are matched into the new one with a block matching algorithm of the
+    project, on the blocks the box covers only: the frames are cropped to them plus the search reach, so the
+    cost follows the size of the box, not of the frame. The median of every component ignores the vectors of
+    background or occluding blocks as long as the target fills most of the box. The box keeps its fractional
+    position, so slow motion adds up instead of being rounded away. The target is lost when the box leaves
+    the block grid.
+    """
+
+    def __init__(self, algorithm=tss_search_batched, block_size=8, search_radius=8, similarity_metric='MAD'):
+        self.algorithm = algorithm
+        self.block_size = block_size
+        self.search_radius = search_radius
+        self.similarity_metric = similarity_metric
+        self.previous_frame = None
+        self.position = None  # (x, y) of the box, in fractional pixels
+        self.size = None
+
+    def init(self, frame, bbox):
+        self.previous_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        x, y, width, height = bbox
+        self.position = np.array([x, y], dtype=np.float64)
+        self.size = (int(width), int(height))
+
+    @property
+    def bbox(self):
+        x, y = np.rint(self.position).astype(int)
+        return int(x), int(y), self.size[0], self.size[1]
+
+    def block_mask(self, frame_shape):
+        """Blocks whose center lies in the box, or the blocks it overlaps for a box smaller than a block."""
+        grid_shape = (frame_shape[0] // self.block_size, frame_shape[1] // self.block_size)
+        x, y, width, height = self.bbox
+        half = self.block_size // 2
+        inside = roi_block_mask([(x + half, y + half, max(0, width - 2 * half), max(0, height - 2 * half))],
+                                grid_shape, self.block_size)
+        if not inside.any():
+            inside = roi_block_mask([(x, y, width, height)], grid_shape, self.block_size)
+        return inside
+
+    def update(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        block_mask = self.block_mask(gray.shape)
+        if not block_mask.any():
+            self.previous_frame = gray
+            return False, self.bbox
+
+        # The previous frame is the current one: a vector leads from a block of the box to where it went
+        motion_vectors, _ = cropped_search(self.algorithm, self.previous_frame, gray, self.block_size,
+                                           self.search_radius, self.similarity_metric, block_mask=block_mask)
+        dy, dx = np.median(motion_vectors[block_mask], axis=0)
+        self.position += (dx, dy)
+        self.previous_frame = gray
+        return True, self.bbox
+
+
+TRACKERS = {
+    'mil': TrackerBackend("MIL", cv2.TrackerMIL_create),
+    'kcf': TrackerBackend("KCF", _opencv_tracker('TrackerKCF_create')),
+    'csrt': TrackerBackend("CSRT", _opencv_tracker('TrackerCSRT_create')),
+    'motion_tss': TrackerBackend("Motion Vectors (TSS)", partial(MotionVectorTracker, algorithm=tss_search_batched)),
+    'motion_ebma': TrackerBackend("Motion Vectors (EBMA)", partial(MotionVectorTracker,
+                                                                     algorithm=ebma_search_vectorized)),
+}
+
+
+def available_trackers():
+    """Names of the tracker backends this OpenCV build can create."""
+    return [name for name, backend in TRACKERS.items() if backend.factory is not None]
+
+
+def get_tracker(name):
+    """
+    Look up a tracker backend by its registry name.
+
+    Input:
+    - name (str): The registry name, e.g. 'mil' or 'motion_tss'
+
+    Returns:
+    - callable: The factory, factory() -> a new tracker
+
+    Raises:
+    - ValueError: If no backend is registered under that name, or this OpenCV build does not have it
+    """
+    if name not in TRACKERS:
+        raise ValueError(f"Unknown tracker '{name}'. Use one of: {', '.join(TRACKERS)}.")
+    if TRACKERS[name].factory is None:
+        raise ValueError(f"The {TRACKERS[name].label} tracker needs the opencv-contrib-python package.")
+    return TRACKERS[name].factory
+
+
+def box_thumbnail(frame, bbox):
+    """Grayscale float32 THUMBNAIL_SIZE thumbnail of the part of a box inside a BGR frame, None if it is outside."""
+    x, y, width, height = (int(value) for value in bbox)
+    frame_height, frame_width = frame.shape[:2]
+    left, top = max(0, x), max(0, y)
+    right, bottom = min(frame_width, x + width), min(frame_height, y + height)
+    if right <= left or bottom <= top:
+        return None
+    gray = cv2.cvtColor(frame[top:bottom, left:right], cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def interpolated_track(keyframes, frame_indices):
+    """
+    Box of a target on every frame, from its boxes on the keyframes its tracker ran on.
+
+    Between two keyframes every coordinate moves at constant velocity. After the last keyframe the box keeps
+    moving at the velocity between the last two, at a constant size; before the first one it stays put.
+
+    Input:
+    - keyframes (dict): frame index -> (x, y, width, height) box found by the tracker
+    - frame_indices (list): The frames to give a box for
+
+    Returns:
+    - list: The (x, y, width, height) box of every frame, in whole pixels
+    """
+    key_indices = np.array(sorted(keyframes))
+    key_boxes = np.array([keyframes[index] for index in key_indices], dtype=np.float64)
+    frame_indices = np.asarray(frame_indices)
+    boxes = np.stack([np.interp(frame_indices, key_indices, key_boxes[:, coordinate]) for coordinate in range(4)],
+                     axis=-1)
+    if len(key_indices) > 1:
+        after = frame_indices > key_indices[-1]
+        velocity = (key_boxes[-1] - key_boxes[-2]) / (key_indices[-1] - key_indices[-2])
+        velocity[2:] = 0
+        boxes[after] = key_boxes[-1] + np.outer(frame_indices[after] - key_indices[-1], velocity)
+    return [tuple(int(value) for value in box) for box in np.rint(boxes)]
 
 
-class TrackingProcessor(QThread):
-    frame_ready = pyqtSignal(np.ndarray)
-    tracking_progress_updated = pyqtSignal(int, int)
+class TrackedTarget:
+    """
+    One target of a TrackingPipeline: its tracker, its current box and its re-acquisition model.
 
-    def __init__(self, video_path):
-        super().__init__()
+    The frames its tracker ran on are its keyframes. On the other frames the box is predicted with a
+    constant velocity model: it moves on from the last keyframe at the velocity between the last two.
+    """
+
+    def __init__(self, bbox, orb, tracker_factory=cv2.TrackerMIL_create):
+        self.bbox = tuple(bbox)
+        self.tracker_factory = tracker_factory
+        self.tracker = None
+        self.reacquisition = OrbReacquisition(orb)
+        self.keyframes = {}  # frame index -> box the tracker found on that frame
+        self.last_keyframe = None  # Index of the latest keyframe
+        self.last_tracked = None  # Index of the latest frame the tracker ran on, found or not
+        self.velocity = np.zeros(2)  # (dx, dy) per frame between the last two keyframes
+        self.thumbnail = None  # box_thumbnail of the box on the latest keyframe
+
+    def init(self, frame, frame_index=0):
+        """Start tracking from the current box, and take the re-acquisition model from it."""
+        self.restart(frame, self.bbox, frame_index)
+        self.reacquisition.set_model(frame, self.bbox)
+
+    def restart(self, frame, bbox, frame_index=0):
+        """Start a new tracker on a box; the box is a keyframe, with no velocity to carry on."""
+        self.bbox = tuple(bbox)
+        self.tracker = self.tracker_factory()
+        self.tracker.init(frame, self.bbox)
+        self.velocity = np.zeros(2)
+        self.last_tracked = frame_index
+        self.set_keyframe(frame, frame_index, moving=False)
+
+    def set_keyframe(self, frame, frame_index, moving=True):
+        if moving and self.last_keyframe is not None and frame_index > self.last_keyframe:
+            last_x, last_y = self.keyframes[self.last_keyframe][:2]
+            self.velocity = (np.array(self.bbox[:2], dtype=np.float64) - (last_x, last_y)) \
+                / (frame_index - self.last_keyframe)
+        self.keyframes[frame_index] = tuple(int(value) for value in self.bbox)
+        self.last_keyframe = frame_index
+        self.thumbnail = box_thumbnail(frame, self.bbox)
+
+    def update(self, frame, frame_index=0):
+        """Track the target into a later frame, which becomes a keyframe if it is found; returns whether it was."""
+        found, bbox = self.tracker.update(frame)
+        self.last_tracked = frame_index
+        if found:
+            self.bbox = tuple(bbox)
+            self.set_keyframe(frame, frame_index)
+        else:
+            self.velocity = np.zeros(2)  # A lost target is not extrapolated any further
+        return found
+
+    def predict(self, frame_index):
+        """Move the box to where the constant velocity model puts it on a frame after the last keyframe."""
+        x, y, width, height = self.keyframes[self.last_keyframe]
+        x, y = np.rint((x, y) + self.velocity * (frame_index - self.last_keyframe)).astype(int)
+        self.bbox = (int(x), int(y), width, height)
+
+    def is_due(self, frame, frame_index, keyframe_interval=1, appearance_threshold=None):
+        """
+        Whether the tracker has to run on a frame.
+
+        Input:
+        - frame (np.array): The BGR frame, with the predicted box
+        - frame_index (int): Its index
+        - keyframe_interval (int): The tracker runs every keyframe_interval frames at least
+        - appearance_threshold (float): Mean grey level difference between the thumbnails of the predicted box and
+            of the box on the last keyframe past which the tracker runs early, None to run on the interval only
+
+        Returns:
+        - bool: True if the tracker has to run
+        """
+        if frame_index - self.last_tracked >= keyframe_interval:
+            return True
+        if appearance_threshold is None or self.thumbnail is None:
+            return False
+        thumbnail = box_thumbnail(frame, self.bbox)
+        return thumbnail is None or float(np.abs(thumbnail - self.thumbnail).mean()) > appearance_threshold
+
+
+class TrackingPipeline:
+    """
+    Decode -> track -> draw pipeline of the tracking tab, without any Qt.
+
+    Every target is followed by a tracker of the backend named by tracker, a key of TRACKERS. Every frame
+    is decoded once for all targets. Their trackers are updated on a thread pool, as OpenCV
+    releases the GIL while it tracks, and targets lost in the same frame share one ORB detection of it.
+
+    A tracker only has to run every keyframe_interval frames, or earlier when the appearance of its predicted
+    box changes by more than appearance_threshold; in between, boxes follow a constant velocity model.
+    With grab_skip, the frames in between are not even decoded, only grabbed, and frame_callback does not see
+    them. tracks() gives the boxes of every frame, interpolated between the keyframes.
+
+    frame_callback(frame, frame_index, bboxes) receives every BGR frame with the bounding boxes drawn on it,
+    and the (x, y, width, height) box of every target; the frame lives in the frame source's ring and must
+    be copied to be kept. progress_callback receives (frames done, total frames).
+    """
+
+    def __init__(self, video_path, frame_callback=None, progress_callback=None, tracker='mil', keyframe_interval=1,
+                 appearance_threshold=None, grab_skip=False, frame_access=None):
+        if keyframe_interval < 1:
+            raise ValueError("The keyframe interval must be at least 1.")
+        if grab_skip and appearance_threshold is not None:
+            raise ValueError("The appearance of skipped frames is unknown, grab_skip needs appearance_threshold=None.")
         self.video_path = video_path
-        self.videocapture = cv2.VideoCapture(video_path)
-        self.tracker = cv2.TrackerMIL_create()
+        self.tracker = tracker
+        self.tracker_factory = get_tracker(tracker)
+        self.keyframe_interval = keyframe_interval
+        self.appearance_threshold = appearance_threshold
+        self.grab_skip = grab_skip
+        self.timer = StageTimer()  # Rolling statistics of every stage, decode included
+        # Decodes ahead on its own thread; a shared FrameAccess serves frames decoded by earlier runs from its cache
+        self.frame_source = FrameSource(video_path, grayscale=False, timer=self.timer,
+                                        grab_only=self.skipped if grab_skip else None, frame_access=frame_access)
+        self.start_frame_index = 0  # Index of the frame the trackers started on in the current run
+        self.last_frame_index = None  # Index of the latest frame read
         self.is_running = True
-        self.initial_bbox = None
-        self.current_bbox = None
+        self.initial_bboxes = []
+        self.targets = []  # TrackedTarget of every box, created on the first run
+        # Finds lost targets again, shared by every target
         self.orb_detector = cv2.ORB_create()  # Using ORB feature matching (ORiented BRIEF: uses FAST for keypoints behind the scenes)
-        self.total_frame_count = int(self.videocapture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.reacquisitions = []  # (frame index, seconds, targets lost, targets found) of every re-acquisition
+        self.total_frame_count = self.frame_source.total_frames
         self.current_frame_index = 0
-        self.drawn_bbox = None
+        self.drawn_bboxes = []
+        self.frame_callback = frame_callback
+        self.progress_callback = progress_callback
+        self.frames_processed = 0
 
     def set_bounding_box(self, bbox):
-        self.initial_bbox = bbox
+        self.set_bounding_boxes([bbox])
+
+    def set_bounding_boxes(self, bboxes):
+        self.initial_bboxes = [tuple(bbox) for bbox in bboxes]
+
+    @property
+    def bboxes(self):
+        """Current (x, y, width, height) box of every target."""
+        return [tuple(int(value) for value in target.bbox) for target in self.targets]
+
+    def skipped(self, frame_index):
+        """Whether a frame is off the keyframe schedule of the current run, so grab_skip does not decode it."""
+        return (frame_index - self.start_frame_index) % self.keyframe_interval != 0
 
     def run(self):
-        if self.current_frame_index > 0:
-            self.videocapture.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame_index)
+        self.start_frame_index = self.current_frame_index
+        self.frame_source.start(self.current_frame_index)
+        executor = None
         try:
-            frame_read, frame = self.videocapture.read()
-            if not frame_read or self.initial_bbox is None:
+            decoded = self.frame_source.read()
+            if decoded is None or not (self.targets or self.initial_bboxes):
                 return
+            frame = decoded.color
 
-            # Set the initial bounding box if not set
-            if self.current_bbox is None:
-                self.current_bbox = self.initial_bbox
+            # Targets are created on the first run and keep their boxes across stop / resume
+            if not self.targets:
+                self.targets = [TrackedTarget(bbox, self.orb_detector, self.tracker_factory)
+                                for bbox in self.initial_bboxes]
+            if len(self.targets) > 1:
+                executor = ThreadPoolExecutor(max_workers=min(len(self.targets), os.cpu_count() or 1))
 
-            # Initialize the tracker with the first frame and the initial/current bounding box
-            self.tracker.init(frame, self.current_bbox)
-            self.keypoints_initial, self.descriptors_initial = self.orb_detector.detectAndCompute(frame, None)
+            # Initialize the trackers with the first frame and the initial/current bounding boxes
+            self.for_each_target(executor, lambda target: target.init(frame, decoded.index))
+            self.last_frame_index = decoded.index
+            self.frame_source.release(decoded)
 
             while self.is_running:
-                frame_read, frame = self.videocapture.read()
-                if not frame_read:
+                start = time.perf_counter()
+                decoded = self.frame_source.read()
+                self.timer.add('wait', time.perf_counter() - start, start, decoded and decoded.index)
+                if decoded is None:
                     break
+                frame = decoded.color
 
                 self.current_frame_index += 1
-                self.tracking_progress_updated.emit(self.current_frame_index, self.total_frame_count)
-
-                frame_read, bbox = self.tracker.update(frame)
-                if frame_read:
-                    self.current_bbox = bbox  # Update current bounding box
-                else:
-                    # Tracker lost the target, try to reinitialize
-                    keypoints_frame, descriptors_frame = self.orb_detector.detectAndCompute(frame, None)
-
-                    # Check if there are enough keypoints in the current frame
-                    if descriptors_frame is not None and len(descriptors_frame) >= 2:
-                        # Create a BFMatcher object using Hamming distance
-                        bf_matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-                        # Match the initial descriptors with the current frame descriptors
-                        matches = bf_matcher.match(self.descriptors_initial, descriptors_frame)
-                        # Sort matches by distance
-                        matches = sorted(matches, key=lambda x: x.distance)
-                        if len(matches) > 10:
-                            src_points = np.float32(
-                                [self.keypoints_initial[m.queryIdx].pt for m in matches[:10]]).reshape(-1, 1, 2)
-                            dst_points = np.float32([keypoints_frame[m.trainIdx].pt for m in matches[:10]]).reshape(-1,
-                                                                                                                    1,
-                                                                                                                    2)
-
-                            # Uses: RANdom SAmple Consensus, findHomography from Features2D:
-                            # https://docs.opencv.org/4.x/d9/dab/tutorial_homography.html
-                            # Find the homography matrix to transform the source points to destination points
-                            matrix, mask = cv2.findHomography(src_points, dst_points, cv2.RANSAC, 5.0)
-
-                            # Define the four corners of the initial bounding box
-                            bbox_points = np.float32([
-                                [self.initial_bbox[0], self.initial_bbox[1]],  # Top-left corner
-                                [self.initial_bbox[0] + self.initial_bbox[2], self.initial_bbox[1]],  # Top-right corner
-                                [self.initial_bbox[0] + self.initial_bbox[2],
-                                 self.initial_bbox[1] + self.initial_bbox[3]],  # Bottom-right corner
-                                [self.initial_bbox[0], self.initial_bbox[1] + self.initial_bbox[3]]
-                                # Bottom-left corner
-                            ]).reshape(-1, 1, 2)  # Reshape to the required format for perspective transform
-                            transformed_bbox = cv2.perspectiveTransform(bbox_points, matrix)
-                            self.current_bbox = cv2.boundingRect(transformed_bbox)
-                            self.tracker = cv2.TrackerMIL_create()
-                            self.tracker.init(frame, self.current_bbox)
-
-                top_left = (int(self.current_bbox[0]), int(self.current_bbox[1]))
-                bottom_right = (int(self.current_bbox[0] + self.current_bbox[2]), int(self.current_bbox[1] + self.current_bbox[3]))
-                cv2.rectangle(frame, top_left, bottom_right, (255, 0, 0), 2, 1)
-
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                self.frame_ready.emit(frame_rgb)
+                if self.progress_callback is not None:
+                    self.progress_callback(self.current_frame_index, self.total_frame_count)
+
+                self.last_frame_index = decoded.index
+
+                start = time.perf_counter()
+                for target in self.targets:
+                    target.predict(decoded.index)
+                due = [] if frame is None else \
+                    [target for target in self.targets
+                     if target.is_due(frame, decoded.index, self.keyframe_interval, self.appearance_threshold)]
+                if due:
+                    found = self.for_each_target(executor, lambda target: target.update(frame, decoded.index), due)
+                    lost = [target for target, target_found in zip(due, found) if not target_found]
+                    if lost:
+                        # Trackers lost their targets, look for them around where they were last seen
+                        self.reacquire(frame, decoded.index, lost)
+                self.timer.add('track' if due else 'predict', time.perf_counter() - start, start, decoded.index)
+                if frame is None:
+                    # Only grabbed, nothing to draw
+                    self.frames_processed += 1
+                    continue
+
+                start = time.perf_counter()
+                bboxes = self.bboxes
+                for index, (x, y, width, height) in enumerate(bboxes):
+                    color = TARGET_COLORS[index % len(TARGET_COLORS)]
+                    cv2.rectangle(frame, (x, y), (x + width, y + height), color, 2, 1)
+                self.timer.add('draw', time.perf_counter() - start, start, decoded.index)
+
+                if self.frame_callback is not None:
+                    self.frame_callback(frame, decoded.index, bboxes)
+                self.frames_processed += 1
+                self.frame_source.release(decoded)
         except Exception as e:
             print(f"Error in tracking process: {e}")
         finally:
-            self.videocapture.release()
+            if executor is not None:
+                executor.shutdown(wait=True)
+            self.frame_source.stop()
+
+    def for_each_target(self, executor, function, targets=None):
+        """Results of function(target) for every target, or the given ones, on the thread pool if there is one."""
+        targets = self.targets if targets is None else targets
+        if executor is None or len(targets) < 2:
+            return [function(target) for target in targets]
+        return list(executor.map(function, targets))
+
+    def reacquire(self, frame, frame_index, lost):
+        """
+        Find lost targets in a frame and restart their trackers on them; the time it takes is the 'reacquire' stage.
+
+        A single lost target detects features in growing windows around its last box only. Several lost
+        targets share one detection of the whole frame, each matching the features of its own windows.
+        """
+        start = time.perf_counter()
+        features = None
+        if len(lost) > 1:
+            frame_height, frame_width = frame.shape[:2]
+            features = lost[0].reacquisition.detect(frame, (0, 0, frame_width, frame_height))
+        found = 0
+        for target in lost:
+            bbox = target.reacquisition.reacquire(frame, target.bbox, features)
+            if bbox is not None:
+                target.restart(frame, bbox, frame_index)
+                found += 1
+        seconds = time.perf_counter() - start
+        self.timer.add('reacquire', seconds, start, frame_index)
+        self.reacquisitions.append((frame_index, seconds, len(lost), found))
+
+    def reacquisition_summary(self):
+        """
+        Statistics of the attempts to find lost targets.
+
+        Returns:
+        - dict: attempts (targets lost), found and the mean and max latency of a re-acquisition in milliseconds
+        """
+        seconds = [reacquisition[1] for reacquisition in self.reacquisitions]
+        return {'attempts': sum(reacquisition[2] for reacquisition in self.reacquisitions),
+                'found': sum(reacquisition[3] for reacquisition in self.reacquisitions),
+                'mean': 1000 * float(np.mean(seconds)) if seconds else 0.0,
+                'max': 1000 * max(seconds, default=0.0)}
+
+    def tracks(self):
+        """
+        Box of every target on every frame after the one it started on, interpolated between its keyframes.
+
+        Returns:
+        - list: (frame index, target, (x, y, width, height), keyframe) tuples, by frame then target; keyframe is
+            True where the tracker found the box, False where it was interpolated
+        """
+        rows = []
+        for target_index, target in enumerate(self.targets):
+            if not target.keyframes or self.last_frame_index is None:
+                continue
+            frame_indices = range(min(target.keyframes) + 1, self.last_frame_index + 1)
+            for frame_index, bbox in zip(frame_indices, interpolated_track(target.keyframes, frame_indices)):
+                rows.append((frame_index, target_index, bbox, frame_index in target.keyframes))
+        rows.sort(key=lambda row: (row[0], row[1]))
+        return rows
 
     def stop(self):
         self.is_running = False
-        self.wait()
-        if self.videocapture.isOpened():
-            self.current_frame_index = int(self.videocapture.get(cv2.CAP_PROP_POS_FRAMES))
-            self.videocapture.release()
 
     def resume(self):
-        if not self.videocapture.isOpened():
-            self.videocapture = cv2.VideoCapture(self.video_path)
-            if self.drawn_bbox:
-                self.current_bbox = self.drawn_bbox  # Update the bounding box to the drawn one
-            self.is_running = True
-            self.start()
+        """Prepare a new run after stop(), from the frame after the last one shown."""
+        self.current_frame_index = self.frame_source.position
+        if self.drawn_bboxes:
+            # The drawn boxes replace the targets
+            self.targets = [TrackedTarget(bbox, self.orb_detector, self.tracker_factory) for bbox in self.drawn_bboxes]
+            self.drawn_bboxes = []
+        self.is_running = True
 
     def draw_bounding_box(self, bbox):
-        self.drawn_bbox = bbox
+        self.draw_bounding_boxes([bbox])
+
+    def draw_bounding_boxes(self, bboxes):
+        self.drawn_bboxes = [tuple(bbox) for bbox in bboxes]
 
 
 """ ORB Implementation based on:
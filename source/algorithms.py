@@ -0,0 +1,65 @@
+﻿from collections import namedtuple
+
+from source.arps import arps_search
+from source.diamondsearch import ds_search
+from source.ebma import ebma_search, ebma_search_pruned, ebma_search_vectorized
+from source.hexagonsearch import hexbs_search
+from source.pyramid import check_pyramid_levels
+from source.threestepsearch import tss_search, tss_search_batched
+
+# Every algorithm takes (current_frame, reference_frame, block_size, search_radius, similarity_metric) and
+# accepts workers, executor and return_evaluations keyword arguments. metrics are the similarity metrics it
+# supports, None for all of them.
+Algorithm = namedtuple('Algorithm', ['label', 'function', 'metrics'], defaults=(None,))
+
+ALGORITHMS = {
+    'ebma': Algorithm("EBMA", ebma_search),
+    'ebma_vectorized': Algorithm("EBMA (Vectorized)", ebma_search_vectorized),
+    'ebma_pruned': Algorithm("EBMA (Pruned)", ebma_search_pruned, ('MAD', 'SAD')),
+    'tss': Algorithm("Three-Step-Search", tss_search),
+    'tss_batched': Algorithm("Three-Step-Search (Batched)", tss_search_batched),
+    'ds': Algorithm("Diamond Search", ds_search),
+    'hexbs': Algorithm("Hexagon-Based Search", hexbs_search),
+    'arps': Algorithm("Adaptive Rood Pattern Search", arps_search),
+}
+
+
+def get_algorithm(name):
+    """
+    Look up a motion estimation algorithm by its registry name.
+
+    Input:
+    - name (str): The registry name, e.g. 'ebma' or 'tss'
+
+    Returns:
+    - callable: The search function
+
+    Raises:
+    - ValueError: If no algorithm is registered under that name
+    """
+    if name not in ALGORITHMS:
+        raise ValueError(f"Unknown algorithm '{name}'. Use one of: {', '.join(ALGORITHMS)}.")
+    return ALGORITHMS[name].function
+
+
+def check_search_settings(algorithm, similarity_metric, block_size, pyramid_levels=1):
+    """
+    Check that an algorithm can search with a similarity metric and block size, before any frame is searched.
+
+    Input:
+    - algorithm (callable): The search function, one of ALGORITHMS
+    - similarity_metric (str): A key of similarity_metrics.METRICS
+    - block_size (int): The block size at full resolution
+    - pyramid_levels (int): Pyramid levels, the coarsest one searches blocks of block_size >> (pyramid_levels - 1)
+
+    Raises:
+    - ValueError: If the algorithm does not support the metric, the block size cannot be split over the pyramid
+      levels, or SATD gets blocks that are no multiple of 4
+    """
+    entry = next((entry for entry in ALGORITHMS.values() if entry.function is algorithm), None)
+    if entry is not None and entry.metrics is not None and similarity_metric not in entry.metrics:
+        raise ValueError(f"{entry.label} only supports the {' and '.join(entry.metrics)} similarity metrics.")
+    if pyramid_levels > 1:
+        check_pyramid_levels(block_size, pyramid_levels)
+    if similarity_metric == 'SATD' and (block_size >> (pyramid_levels - 1)) % 4:
+        raise ValueError("SATD needs a block size that is a multiple of 4.")
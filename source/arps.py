@@ -0,0 +1,93 @@
+﻿import numpy as np
+
+from source.patternsearch import BlockMatcher
+from source.tiling import run_tiled
+
+# Unit rood pattern used for the refinement, as (offset_y, offset_x) around the center
+UNIT_ROOD = ((-1, 0), (0, -1), (0, 1), (1, 0))
+# Arm length of the first rood for blocks without a left neighbour
+DEFAULT_ARM_LENGTH = 2
+
+
+def arps_search(current_frame, reference_frame, block_size=16, search_radius=8, similarity_metric='MAD',
+                workers=None, executor=None, return_evaluations=False, block_mask=None, initial_vectors=None):
+    """
+    Adaptive Rood Pattern Search Algorithm for Motion Estimation
+
+    The motion vector of the left neighbour, already stored in the motion vector array, predicts the
+    motion of the current block. The first step checks a rood whose arm length is the largest component
+    of that prediction, plus the predicted point itself; the unit rood then refines the best point until
+    the center is the best point. Displacements are limited to the search radius.
+
+    Input:
+    - current_frame (np.array): The current frame
+    - reference_frame (np.array): The reference frame
+    - block_size (int): The size of the block
+    - search_radius (int): The maximum search radius
+    - similarity_metric (str): Name of a metric in similarity_metrics.METRICS
+    - workers (int): Split the block grid into row bands searched by this many worker processes
+    - executor (concurrent.futures.Executor): Executor to search the row bands on
+    - return_evaluations (bool): Also return the number of block comparisons
+    - block_mask (np.array): Boolean (num_blocks_y, num_blocks_x) array; only blocks set to True are searched,
+        the others keep a zero vector
+    - initial_vectors (np.array): (num_blocks_y, num_blocks_x, 2) vectors checked in the first step next to
+        the prediction from the left neighbour
+
+    Returns:
+    - np.array: A 3D numpy array containing the motion vectors for each block.
+        The third dimension contains the y and x offsets.
+    - int: The number of block comparisons, only if return_evaluations is set
+    """
+    height, width = current_frame.shape
+    motion_vectors = np.zeros((height // block_size, width // block_size, 2), dtype=int)
+
+    # Row bands keep whole block rows together, so every block still sees its left neighbour
+    evaluations = run_tiled(_arps_search_rows, current_frame, reference_frame, motion_vectors,
+                            (block_size, search_radius, similarity_metric, block_mask, initial_vectors),
+                            workers, executor)
+
+    if return_evaluations:
+        return motion_vectors, evaluations
+    return motion_vectors
+
+
+def _arps_search_rows(current_frame, reference_frame, motion_vectors, row_start, row_end, block_size, search_radius,
+                      similarity_metric, block_mask, initial_vectors):
+    matcher = BlockMatcher(current_frame, reference_frame, block_size, search_radius, similarity_metric)
+
+    for block_y in range(row_start, row_end):
+        for block_x in range(motion_vectors.shape[1]):
+            if block_mask is not None and not block_mask[block_y, block_x]:
+                continue
+
+            matcher.set_block(block_y, block_x)
+
+            if block_x > 0:
+                predicted = tuple(int(component) for component in motion_vectors[block_y, block_x - 1])
+                arm_length = max(abs(predicted[0]), abs(predicted[1]))
+            else:
+                predicted = (0, 0)
+                arm_length = DEFAULT_ARM_LENGTH
+
+            # Adaptive rood around the block position, plus the predicted vector
+            first_step = [(-arm_length, 0), (0, -arm_length), (0, arm_length), (arm_length, 0)]
+            if predicted not in first_step and predicted != (0, 0):
+                first_step.append(predicted)
+            if initial_vectors is not None:
+                initial = matcher.clamp(initial_vectors[block_y, block_x])
+                if initial not in first_step and initial != (0, 0):
+                    first_step.append(initial)
+            center = matcher.best_of((0, 0), first_step)
+
+            motion_vectors[block_y, block_x] = matcher.descend(center, UNIT_ROOD)
+
+    return matcher.evaluations
+
+
+""" Adaptive Rood Pattern Search based on:
+
+    Yao Nie and Kai-Kuang Ma.
+    Adaptive rood pattern search for fast block-matching motion estimation.
+    IEEE Transactions on Image Processing, 11(12):1442-1449, 2002.
+
+"""
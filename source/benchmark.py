@@ -0,0 +1,267 @@
+﻿import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from source.algorithms import ALGORITHMS
+from source.similarity_metrics import METRICS
+
+RESOLUTIONS = {
+    '360p': (360, 640),
+    '720p': (720, 1280),
+    '1080p': (1080, 1920),
+    '4K': (2160, 3840),
+}
+DEFAULT_VIDEO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'media', 'input1.mp4')
+# Fields that identify a benchmark case, results with the same fields are compared with each other
+CASE_FIELDS = ('source', 'resolution', 'algorithm', 'block_size', 'search_radius', 'similarity_metric')
+
+
+def synthetic_pair(resolution, block_size, search_radius, global_shift=(2, -3), local_fraction=0.25, seed=0):
+    """
+    Frame pair with a known motion vector for every block.
+
+    The reference frame is smoothed noise. Every block of the current frame is copied from the reference frame
+    at its true displacement: the global shift for most blocks, a random displacement within the search radius
+    for a local_fraction of them. Displacements are clamped so the copied block stays inside the frame.
+
+    Input:
+    - resolution (tuple): (height, width) of the frames
+    - block_size (int): The size of the block
+    - search_radius (int): Largest displacement of the local motion
+    - global_shift (tuple): (dy, dx) of the global motion
+    - local_fraction (float): Fraction of the blocks that move on their own
+    - seed (int): Seed of the random texture and local motion
+
+    Returns:
+    - np.array: The current frame (uint8)
+    - np.array: The reference frame (uint8)
+    - np.array: The (num_blocks_y, num_blocks_x, 2) true motion vectors
+    """
+    height, width = resolution
+    rng = np.random.default_rng(seed)
+    reference_frame = cv2.GaussianBlur(rng.integers(0, 256, (height, width)).astype(np.uint8), (0, 0), 1.5)
+
+    num_blocks_y, num_blocks_x = height // block_size, width // block_size
+    true_vectors = np.empty((num_blocks_y, num_blocks_x, 2), dtype=int)
+    true_vectors[:] = global_shift
+    local = rng.random((num_blocks_y, num_blocks_x)) < local_fraction
+    true_vectors[local] = rng.integers(-search_radius, search_radius + 1, (int(local.sum()), 2))
+
+    # Keep every displaced block inside the frame
+    start_y = (np.arange(num_blocks_y) * block_size)[:, None]
+    start_x = (np.arange(num_blocks_x) * block_size)[None, :]
+    true_vectors[..., 0] = np.clip(true_vectors[..., 0], -start_y, height - block_size - start_y)
+    true_vectors[..., 1] = np.clip(true_vectors[..., 1], -start_x, width - block_size - start_x)
+
+    current_frame = reference_frame.copy()
+    for block_y in range(num_blocks_y):
+        for block_x in range(num_blocks_x):
+            y, x = block_y * block_size, block_x * block_size
+            dy, dx = true_vectors[block_y, block_x]
+            current_frame[y:y + block_size, x:x + block_size] = \
+                reference_frame[y + dy:y + dy + block_size, x + dx:x + dx + block_size]
+    return current_frame, reference_frame, true_vectors
+
+
+def video_pairs(video_path, num_pairs=3, start_frame=0):
+    """Consecutive grayscale frame pairs of a video, as (current_frame, reference_frame) tuples."""
+    videocapture = cv2.VideoCapture(video_path)
+    videocapture.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    frames = []
+    while len(frames) < num_pairs + 1:
+        frame_read, frame = videocapture.read()
+        if not frame_read:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    videocapture.release()
+    return list(zip(frames[:-1], frames[1:]))
+
+
+def vector_error(motion_vectors, true_vectors):
+    """
+    Mean endpoint error and fraction of exactly recovered vectors.
+
+    Returns:
+    - float: Mean Euclidean distance between the estimated and the true vectors
+    - float: Fraction of the blocks whose vector is exactly right
+    """
+    difference = np.asarray(motion_vectors, dtype=float) - true_vectors
+    return float(np.linalg.norm(difference, axis=-1).mean()), float((difference == 0).all(axis=-1).mean())
+
+
+def time_algorithm(algorithm, pairs, block_size, search_radius, similarity_metric, repeat=3, max_seconds=10.0):
+    """
+    Run an algorithm on frame pairs and time it.
+
+    Every pair is searched repeat times, unless a single search already took longer than max_seconds.
+
+    Returns:
+    - float: The median time of one search in seconds
+    - int: The block comparisons of one search, averaged over the pairs
+    - list: The motion vectors of every pair
+    """
+    seconds, evaluations, results = [], [], []
+    for current_frame, reference_frame in pairs:
+        for run in range(repeat):
+            start = time.perf_counter()
+            motion_vectors, pair_evaluations = algorithm(current_frame, reference_frame, block_size, search_radius,
+                                                         similarity_metric, return_evaluations=True)
+            seconds.append(time.perf_counter() - start)
+            if run == 0:
+                evaluations.append(pair_evaluations)
+                results.append(motion_vectors)
+            if seconds[-1] > max_seconds:
+                break
+    return float(np.median(seconds)), int(np.mean(evaluations)), results
+
+
+def run_benchmarks(algorithms, resolutions, block_sizes, search_radii, metrics, video_path=None, video_pairs_count=3,
+                   repeat=3, max_seconds=10.0, log=print):
+    """
+    Time every combination of algorithm, frame source, block size, search radius and metric.
+
+    Synthetic pairs are scored against their true vectors. Video pairs have no ground truth, so they are scored
+    against the exhaustive search (ebma_vectorized) with the same parameters.
+
+    Returns:
+    - list: One dict per case, with the CASE_FIELDS and seconds, fps, evaluations, mean_error, exact_fraction
+    """
+    results = []
+    exhaustive = ALGORITHMS['ebma_vectorized'].function
+
+    sources = [(name, 'synthetic', RESOLUTIONS[name]) for name in resolutions]
+    if video_path:
+        sources.append((os.path.basename(video_path), 'video', None))
+
+    for source_name, kind, resolution in sources:
+        for block_size in block_sizes:
+            for search_radius in search_radii:
+                for metric in metrics:
+                    if kind == 'synthetic':
+                        current_frame, reference_frame, true_vectors = synthetic_pair(resolution, block_size,
+                                                                                      search_radius)
+                        pairs = [(current_frame, reference_frame)]
+                        truths = [true_vectors]
+                    else:
+                        pairs = video_pairs(video_path, video_pairs_count)
+                        truths = [exhaustive(current_frame, reference_frame, block_size, search_radius, metric)
+                                  for current_frame, reference_frame in pairs]
+                    height, width = pairs[0][0].shape
+
+                    for name in algorithms:
+                        if ALGORITHMS[name].metrics is not None and metric not in ALGORITHMS[name].metrics:
+                            continue
+                        seconds, evaluations, estimates = time_algorithm(ALGORITHMS[name].function, pairs,
+                                                                         block_size, search_radius, metric, repeat,
+                                                                         max_seconds)
+                        errors = [vector_error(estimate, truth) for estimate, truth in zip(estimates, truths)]
+                        result = {
+                            'source': kind,
+                            'resolution': source_name if kind == 'synthetic' else f"{source_name} {width}x{height}",
+                            'algorithm': name,
+                            'block_size': block_size,
+                            'search_radius': search_radius,
+                            'similarity_metric': metric,
+                            'seconds': seconds,
+                            'fps': 1.0 / seconds if seconds > 0 else float('inf'),
+                            'evaluations': evaluations,
+                            'mean_error': float(np.mean([error[0] for error in errors])),
+                            'exact_fraction': float(np.mean([error[1] for error in errors])),
+                        }
+                        results.append(result)
+                        log(f"{result['resolution']:>24} {name:>16} bs={block_size:<3} r={search_radius:<3} "
+                            f"{metric:<5} {result['fps']:9.2f} fps {evaluations:>12} evals "
+                            f"error {result['mean_error']:.3f}")
+    return results
+
+
+def environment():
+    """The software and hardware the benchmarks ran on."""
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare_results(results, baseline_results, fps_tolerance=0.2, error_tolerance=0.01):
+    """
+    Flag the cases that got worse than in a baseline run.
+
+    A case regresses when its fps dropped by more than fps_tolerance (a fraction of the baseline fps), when it
+    needs more block comparisons, or when its mean error grew by more than error_tolerance. Cases missing from
+    either run are ignored.
+
+    Returns:
+    - list: (case, list of reasons) for every regressed case
+    """
+    baseline = {tuple(result[field] for field in CASE_FIELDS): result for result in baseline_results}
+    regressions = []
+    for result in results:
+        case = tuple(result[field] for field in CASE_FIELDS)
+        if case not in baseline:
+            continue
+        previous = baseline[case]
+        reasons = []
+        if result['fps'] < previous['fps'] * (1 - fps_tolerance):
+            reasons.append(f"fps {previous['fps']:.2f} -> {result['fps']:.2f}")
+        if result['evaluations'] > previous['evaluations']:
+            reasons.append(f"evaluations {previous['evaluations']} -> {result['evaluations']}")
+        if result['mean_error'] > previous['mean_error'] + error_tolerance:
+            reasons.append(f"mean error {previous['mean_error']:.3f} -> {result['mean_error']:.3f}")
+        if reasons:
+            regressions.append((dict(zip(CASE_FIELDS, case)), reasons))
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the motion estimation algorithms.")
+    parser.add_argument('--algorithms', nargs='+', choices=list(ALGORITHMS), default=list(ALGORITHMS))
+    parser.add_argument('--resolutions', nargs='*', choices=list(RESOLUTIONS), default=['360p', '720p'])
+    parser.add_argument('--block-sizes', nargs='+', type=int, default=[16])
+    parser.add_argument('--search-radii', nargs='+', type=int, default=[8])
+    parser.add_argument('--metrics', nargs='+', choices=list(METRICS), default=['MAD'])
+    parser.add_argument('--video', default=DEFAULT_VIDEO, help="Video to benchmark on, '' to skip it")
+    parser.add_argument('--video-pairs', type=int, default=3, help="Consecutive frame pairs taken from the video")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per frame pair")
+    parser.add_argument('--max-seconds', type=float, default=10.0,
+                        help="A frame pair is not searched again once a run took longer than this")
+    parser.add_argument('--output', default=None, help="Write the results to this JSON file")
+    parser.add_argument('--baseline', default=None, help="JSON file of an earlier run to compare against")
+    parser.add_argument('--fps-tolerance', type=float, default=0.2,
+                        help="Allowed fps drop against the baseline, as a fraction")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    results = run_benchmarks(args.algorithms, args.resolutions, args.block_sizes, args.search_radii, args.metrics,
+                             args.video or None, args.video_pairs, args.repeat, args.max_seconds)
+    report = {'environment': environment(), 'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_results(results, baseline['results'], args.fps_tolerance)
+        for case, reasons in regressions:
+            print(f"REGRESSION {case}: {', '.join(reasons)}")
+        print(f"{len(regressions)} regressions against {args.baseline}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,231 @@
+﻿import argparse
+import csv
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from source.algorithms import ALGORITHMS, check_search_settings
+from source.motion_cache import MotionFieldCache
+from source.motion_pipeline import MotionPipeline
+from source.quadtree import DEFAULT_SPLIT_THRESHOLD, QuadtreeLeaves, check_quadtree_settings
+from source.ROITracking import TRACKERS, TrackingPipeline
+from source.similarity_metrics import METRICS
+from source.subpixel import PRECISIONS
+from source.vector_rendering import RENDERERS
+
+
+class AnnotatedVideoWriter:
+    """Writes the annotated frames of a pipeline to a video file, opened on the first frame."""
+
+    def __init__(self, output_path, fps):
+        self.output_path = output_path
+        self.fps = fps if fps and fps > 0 else 25.0
+        self.writer = None
+
+    def write(self, frame):
+        if self.writer is None:
+            height, width = frame.shape[:2]
+            self.writer = cv2.VideoWriter(self.output_path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, (width, height))
+        self.writer.write(frame)
+
+    def release(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+def video_fps(video_path):
+    videocapture = cv2.VideoCapture(video_path)
+    fps = videocapture.get(cv2.CAP_PROP_FPS)
+    videocapture.release()
+    return fps
+
+
+def print_throughput(pipeline, elapsed):
+    """Print frames per second over the whole run, and the time per frame and rolling statistics of every stage."""
+    frames = pipeline.frames_processed
+    print(f"{frames} frames in {elapsed:.2f} s, {frames / elapsed if elapsed > 0 else 0:.1f} frames/s")
+    statistics = pipeline.timer.statistics()
+    for stage, values in statistics.items():
+        print(f"  {stage:<10} {1000 * pipeline.timer.total_seconds[stage] / max(frames, 1):8.2f} ms/frame"
+              f"   last {pipeline.timer.window}: mean {values['mean']:.2f}  p95 {values['p95']:.2f}"
+              f"  max {values['max']:.2f} ms")
+
+
+def finish(pipeline, elapsed, trace_path):
+    if trace_path:
+        pipeline.timer.dump_trace(trace_path)
+    print_throughput(pipeline, elapsed)
+
+
+def save_leaves(path, motion_fields, block_size, min_block_size):
+    """
+    Write the quadtree leaves of every frame pair to a .npz file.
+
+    The leaves of all frames are concatenated: those of frame frame_indices[i] are the leaf_counts[i] rows of
+    positions, sizes and vectors that follow the rows of the frames before it.
+    """
+    leaves = [field[1] for field in motion_fields]
+    np.savez_compressed(path,
+                        frame_indices=np.array([field[0] for field in motion_fields], dtype=np.int64),
+                        leaf_counts=np.array([len(frame_leaves.sizes) for frame_leaves in leaves], dtype=np.int64),
+                        positions=np.concatenate([np.zeros((0, 2), dtype=np.int32)]
+                                                 + [frame_leaves.positions for frame_leaves in leaves]).astype(np.int32),
+                        sizes=np.concatenate([np.zeros(0, dtype=np.int32)]
+                                             + [frame_leaves.sizes for frame_leaves in leaves]).astype(np.int32),
+                        vectors=np.concatenate([np.zeros((0, 2), dtype=np.int16)]
+                                               + [frame_leaves.vectors for frame_leaves in leaves]).astype(np.int16),
+                        evaluations=np.array([field[2] for field in motion_fields], dtype=np.int64),
+                        block_size=block_size, min_block_size=min_block_size)
+
+
+def run_motion(args, parser):
+    try:
+        # Settings every frame would fail with are rejected before the video is opened
+        if args.min_block_size is not None:
+            check_quadtree_settings(args.block_size, args.min_block_size, args.metric)
+        else:
+            check_search_settings(ALGORITHMS[args.algorithm].function, args.metric, args.block_size,
+                                  args.pyramid_levels)
+    except ValueError as e:
+        parser.error(str(e))
+
+    motion_fields = []  # (frame_index, motion_vectors, evaluations) of every frame pair
+    writer = AnnotatedVideoWriter(args.output_video, video_fps(args.video)) if args.output_video else None
+    vector_dtype = np.float32 if args.subpixel > 1 else np.int16
+
+    def on_frame(frame, frame_index, motion_vectors, evaluations):
+        if isinstance(motion_vectors, QuadtreeLeaves):
+            motion_fields.append((frame_index, motion_vectors, evaluations))
+        elif isinstance(motion_vectors, np.ndarray) and motion_vectors.size:
+            motion_fields.append((frame_index, motion_vectors.astype(vector_dtype), evaluations))
+        if writer is not None:
+            with pipeline.timer.measure('write', frame_index):
+                writer.write(frame)
+
+    motion_cache = MotionFieldCache(args.cache_dir) if args.cache_dir else None
+    pipeline = MotionPipeline(args.video, ALGORITHMS[args.algorithm].function, args.block_size, args.search_radius,
+                              args.metric, args.workers, args.queue_depth, args.pyramid_levels,
+                              args.static_threshold, args.temporal_seeding, motion_cache, frame_callback=on_frame,
+                              draw_vectors=writer is not None,  # Drawing is only needed for the annotated video
+                              render_mode=args.render, rois=[tuple(roi) for roi in args.roi or []],
+                              subpixel=args.subpixel, min_block_size=args.min_block_size,
+                              split_threshold=args.split_threshold)
+
+    start = time.perf_counter()
+    try:
+        pipeline.run()
+    finally:
+        if writer is not None:
+            writer.release()
+    elapsed = time.perf_counter() - start
+
+    if args.vectors and args.min_block_size:
+        save_leaves(args.vectors, motion_fields, args.block_size, args.min_block_size)
+    elif args.vectors:
+        # vectors[i] is the motion field of frame frame_indices[i] against the frame before it
+        np.savez_compressed(args.vectors,
+                            frame_indices=np.array([field[0] for field in motion_fields], dtype=np.int64),
+                            vectors=np.array([field[1] for field in motion_fields], dtype=vector_dtype),
+                            evaluations=np.array([field[2] for field in motion_fields], dtype=np.int64),
+                            block_size=args.block_size)
+    finish(pipeline, elapsed, args.trace)
+
+
+def run_tracking(args, parser):
+    writer = AnnotatedVideoWriter(args.output_video, video_fps(args.video)) if args.output_video else None
+
+    def on_frame(frame, frame_index, bboxes):
+        if writer is not None:
+            with pipeline.timer.measure('write', frame_index):
+                writer.write(frame)
+
+    pipeline = TrackingPipeline(args.video, frame_callback=on_frame, tracker=args.tracker,
+                                keyframe_interval=args.keyframe_interval,
+                                appearance_threshold=args.appearance_threshold, grab_skip=args.grab_skip)
+    pipeline.set_bounding_boxes([tuple(bbox) for bbox in args.bbox])
+
+    start = time.perf_counter()
+    try:
+        pipeline.run()
+    finally:
+        if writer is not None:
+            writer.release()
+    elapsed = time.perf_counter() - start
+
+    if args.boxes:
+        with open(args.boxes, 'w', newline='') as boxes_file:
+            boxes_writer = csv.writer(boxes_file)
+            boxes_writer.writerow(['frame', 'target', 'x', 'y', 'width', 'height', 'keyframe'])
+            boxes_writer.writerows((frame_index, target) + bbox + (int(keyframe),)
+                                   for frame_index, target, bbox, keyframe in pipeline.tracks())
+    finish(pipeline, elapsed, args.trace)
+    summary = pipeline.reacquisition_summary()
+    if summary['attempts']:
+        print(f"Target lost {summary['attempts']} times, found again {summary['found']} times,"
+              f" re-acquisition mean {summary['mean']:.2f}  max {summary['max']:.2f} ms")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='vectorview', description="Motion estimation and tracking without the GUI.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    motion = commands.add_parser('motion', help="Estimate the motion field of every frame pair of a video.")
+    motion.add_argument('video', help="Input video file")
+    motion.add_argument('--algorithm', choices=list(ALGORITHMS), default='tss_batched')
+    motion.add_argument('--metric', choices=list(METRICS), default='MAD')
+    motion.add_argument('--block-size', type=int, default=16)
+    motion.add_argument('--search-radius', type=int, default=8)
+    motion.add_argument('--pyramid-levels', type=int, default=1)
+    motion.add_argument('--static-threshold', type=float, default=0)
+    motion.add_argument('--temporal-seeding', action='store_true')
+    motion.add_argument('--min-block-size', type=int, default=None,
+                        help="Split blocks down to this size where it pays off (variable block sizes); the motion "
+                             "fields are then quadtree leaves, searched exhaustively whatever the algorithm")
+    motion.add_argument('--split-threshold', type=float, default=DEFAULT_SPLIT_THRESHOLD,
+                        help="Mean cost per pixel a split has to save with --min-block-size")
+    motion.add_argument('--subpixel', type=int, choices=list(PRECISIONS), default=1,
+                        help="Steps per pixel of the motion vectors: 2 refines to half-pel, 4 to quarter-pel")
+    motion.add_argument('--workers', type=int, default=1, help="Worker processes, 1 searches on the main thread")
+    motion.add_argument('--queue-depth', type=int, default=None, help="Frame pairs in flight with several workers")
+    motion.add_argument('--cache-dir', default=None, help="Motion field cache directory, no cache if not given")
+    motion.add_argument('--vectors', default=None, help="Write the motion fields to this .npz file")
+    motion.add_argument('--output-video', default=None, help="Write the annotated video to this file")
+    motion.add_argument('--roi', type=int, nargs=4, action='append', metavar=('X', 'Y', 'WIDTH', 'HEIGHT'),
+                        help="Only search the blocks overlapping this region, may be given several times")
+    motion.add_argument('--render', choices=list(RENDERERS), default='arrows',
+                        help="How the motion vectors are drawn on the annotated video")
+    motion.add_argument('--trace', default=None, help="Write the timing of every stage run to this .csv/.json file")
+    motion.set_defaults(handler=run_motion)
+
+    track = commands.add_parser('track', help="Track regions of a video.")
+    track.add_argument('video', help="Input video file")
+    track.add_argument('--bbox', type=int, nargs=4, action='append', required=True,
+                       metavar=('X', 'Y', 'WIDTH', 'HEIGHT'),
+                       help="Initial bounding box of a target on the first frame, may be given several times")
+    track.add_argument('--tracker', choices=list(TRACKERS), default='mil',
+                       help="Tracker backend; kcf and csrt need the opencv-contrib-python package")
+    track.add_argument('--keyframe-interval', type=int, default=1,
+                       help="Run the tracker every N frames, boxes in between follow a constant velocity model")
+    track.add_argument('--appearance-threshold', type=float, default=None,
+                       help="Also run the tracker when the mean grey level of a predicted box changes by more than this")
+    track.add_argument('--grab-skip', action='store_true',
+                       help="Do not decode the frames between keyframes; they are missing from --output-video")
+    track.add_argument('--boxes', default=None, help="Write the bounding box of every frame to this .csv file")
+    track.add_argument('--output-video', default=None, help="Write the annotated video to this file")
+    track.add_argument('--trace', default=None, help="Write the timing of every stage run to this .csv/.json file")
+    track.set_defaults(handler=run_tracking)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    args.handler(args, parser)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+﻿import numpy as np
+
+from source.patternsearch import BlockMatcher
+from source.tiling import run_tiled
+
+# Large and small diamond search patterns, as (offset_y, offset_x) around the center
+LARGE_DIAMOND = ((-2, 0), (-1, -1), (-1, 1), (0, -2), (0, 2), (1, -1), (1, 1), (2, 0))
+SMALL_DIAMOND = ((-1, 0), (0, -1), (0, 1), (1, 0))
+
+
+def ds_search(current_frame, reference_frame, block_size=16, search_radius=8, similarity_metric='MAD', workers=None,
+              executor=None, return_evaluations=False, block_mask=None, initial_vectors=None):
+    """
+    Diamond Search Algorithm for Motion Estimation
+
+    The large diamond is moved to its best point until the center is the best point, then a single
+    small diamond step refines the result. Displacements are limited to the search radius.
+
+    Input:
+    - current_frame (np.array): The current frame
+    - reference_frame (np.array): The reference frame
+    - block_size (int): The size of the block
+    - search_radius (int): The maximum search radius
+    - similarity_metric (str): Name of a metric in similarity_metrics.METRICS
+    - workers (int): Split the block grid into row bands searched by this many worker processes
+    - executor (concurrent.futures.Executor): Executor to search the row bands on
+    - return_evaluations (bool): Also return the number of block comparisons
+    - block_mask (np.array): Boolean (num_blocks_y, num_blocks_x) array; only blocks set to True are searched,
+        the others keep a zero vector
+    - initial_vectors (np.array): (num_blocks_y, num_blocks_x, 2) vectors the search starts from, instead of
+        the zero vector
+
+    Returns:
+    - np.array: A 3D numpy array containing the motion vectors for each block.
+        The third dimension contains the y and x offsets.
+    - int: The number of block comparisons, only if return_evaluations is set
+    """
+    height, width = current_frame.shape
+    motion_vectors = np.zeros((height // block_size, width // block_size, 2), dtype=int)
+
+    evaluations = run_tiled(_ds_search_rows, current_frame, reference_frame, motion_vectors,
+                            (block_size, search_radius, similarity_metric, block_mask, initial_vectors),
+                            workers, executor)
+
+    if return_evaluations:
+        return motion_vectors, evaluations
+    return motion_vectors
+
+
+def _ds_search_rows(current_frame, reference_frame, motion_vectors, row_start, row_end, block_size, search_radius,
+                    similarity_metric, block_mask, initial_vectors):
+    matcher = BlockMatcher(current_frame, reference_frame, block_size, search_radius, similarity_metric)
+
+    for block_y in range(row_start, row_end):
+        for block_x in range(motion_vectors.shape[1]):
+            if block_mask is not None and not block_mask[block_y, block_x]:
+                continue
+
+            matcher.set_block(block_y, block_x)
+            start = (0, 0) if initial_vectors is None else matcher.clamp(initial_vectors[block_y, block_x])
+            center = matcher.descend(start, LARGE_DIAMOND)
+            motion_vectors[block_y, block_x] = matcher.best_of(center, SMALL_DIAMOND)
+
+    return matcher.evaluations
+
+
+""" Diamond Search based on:
+
+    Shan Zhu and Kai-Kuang Ma.
+    A new diamond search algorithm for fast block-matching motion estimation.
+    IEEE Transactions on Image Processing, 9(2):287-290, 2000.
+
+"""
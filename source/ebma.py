@@ -1,28 +1,43 @@
 ﻿import numpy as np
 
+from source.similarity_metrics import get_metric
+from source.tiling import active_block_spans, run_tiled
 
-def ebma_search(current_frame, reference_frame, block_size=16, search_radius=8, similarity_metric='MAD'):
+
+def ebma_search(current_frame, reference_frame, block_size=16, search_radius=8, similarity_metric='MAD',
+                workers=None, executor=None, return_evaluations=False, block_mask=None, initial_vectors=None):
     """
     Performs the Exhaustive Block Matching Algorithm (EBMA) to find motion vectors
-        between two frames using Mean Absolute Difference (MAD).
+        between two frames using Mean Absolute Difference (MAD) or any other registered similarity metric.
 
     Parameters:
     - current_frame (np.array): The current frame as a 2D numpy array.
     - reference_frame (np.array): The reference frame as a 2D numpy array.
     - block_size (int, optional): The size of the block. Default is 16.
     - search_radius (int, optional): The search radius. Default is 8.
+    - similarity_metric (str, optional): Name of a metric in similarity_metrics.METRICS. Default is 'MAD'.
+    - workers (int, optional): Split the block grid into row bands searched by this many worker processes.
+    - executor (concurrent.futures.Executor, optional): Executor to search the row bands on.
+    - return_evaluations (bool, optional): Also return the number of block comparisons.
+    - block_mask (np.array, optional): Boolean (num_blocks_y, num_blocks_x) array; only blocks set to True are
+        searched, the others keep a zero vector.
+    - initial_vectors (np.array, optional): Accepted like the other algorithms; the exhaustive search does not
+        depend on its starting point, so they are ignored.
 
     Returns:
     - np.array: A 3D numpy array containing the motion vectors for each block.
         The third dimension contains the y and x offsets.
+    - int: The number of block comparisons, only if return_evaluations is set.
 
     Raises:
-    - ValueError: If the current_frame and reference_frame do not have the same shape.
+    - ValueError: If the current_frame and reference_frame do not have the same shape, or the similarity metric
+        is unknown.
     """
 
     # Ensure the current and reference frames are the same shape
     if current_frame.shape != reference_frame.shape:
         raise ValueError("The current frame and reference frame must have the same shape.")
+    metric = get_metric(similarity_metric)
 
     frame_height, frame_width = current_frame.shape
     num_blocks_y = frame_height // block_size
@@ -31,9 +46,27 @@ def ebma_search(current_frame, reference_frame, block_size=16, search_radius=8,
     # Initialize motion vectors array
     motion_vectors = np.zeros((num_blocks_y, num_blocks_x, 2), dtype=int)
 
+    # The per-block loop holds the GIL, so parallel row bands run in processes
+    evaluations = run_tiled(_ebma_search_rows, current_frame, reference_frame, motion_vectors,
+                            (block_size, search_radius, metric, block_mask), workers, executor)
+
+    if return_evaluations:
+        return motion_vectors, evaluations
+    return motion_vectors
+
+
+def _ebma_search_rows(current_frame, reference_frame, motion_vectors, row_start, row_end, block_size, search_radius,
+                      metric, block_mask):
+    frame_height, frame_width = current_frame.shape
+    num_blocks_x = motion_vectors.shape[1]
+    evaluations = 0
+
     # Loop through each block in the current frame
-    for block_y in range(num_blocks_y):
+    for block_y in range(row_start, row_end):
         for block_x in range(num_blocks_x):
+            if block_mask is not None and not block_mask[block_y, block_x]:
+                continue
+
             min_distance = float('inf')
             best_offset_y, best_offset_x = 0, 0
 
@@ -55,13 +88,9 @@ def ebma_search(current_frame, reference_frame, block_size=16, search_radius=8,
                     if 0 <= ref_y < frame_height - block_size + 1 and 0 <= ref_x < frame_width - block_size + 1:
                         reference_block = reference_frame[ref_y:ref_y + block_size, ref_x:ref_x + block_size]
 
-                        # Calculate the Mean Absolute Difference (MAD)
-                        if similarity_metric == 'MAD':
-                            distance = np.mean(np.abs(current_block - reference_block))
-                        elif similarity_metric == 'SSD':
-                            distance = np.sum((current_block - reference_block) ** 2)
-                        else:
-                            raise ValueError("Invalid similarity metric. Use 'MAD' or 'SSD'.")
+                        # Calculate the distance with the chosen metric
+                        distance = metric(current_block, reference_block)
+                        evaluations += 1
 
                         # Update the best offset if a smaller distance is found
                         if distance < min_distance:
@@ -72,4 +101,289 @@ def ebma_search(current_frame, reference_frame, block_size=16, search_radius=8,
             # Store the best offsets (motion vectors) for the current block
             motion_vectors[block_y, block_x] = [best_offset_y, best_offset_x]
 
+    return evaluations
+
+
+def ebma_cost_volume(current_frame, reference_frame, block_size=16, search_radius=8, similarity_metric='MAD'):
+    """
+    Computes the EBMA cost of every block against every displacement in the search window at once.
+
+    For each displacement the whole block grid is compared against the reference frame shifted by that
+    displacement, and the per-pixel differences are reduced per block. Displacements that would place a
+    reference block outside the frame get an infinite cost, following the boundary rule of ebma_search.
+
+    Parameters:
+    - current_frame (np.array): The current frame as a 2D numpy array.
+    - reference_frame (np.array): The reference frame as a 2D numpy array.
+    - block_size (int, optional): The size of the block. Default is 16.
+    - search_radius (int, optional): The search radius. Default is 8.
+    - similarity_metric (str, optional): Name of a metric in similarity_metrics.METRICS. Default is 'MAD'.
+
+    Returns:
+    - np.array: A 4D numpy array of shape (num_blocks_y, num_blocks_x, 2*r+1, 2*r+1), indexed by block
+        position and by (offset_y + r, offset_x + r).
+
+    Raises:
+    - ValueError: If the frames do not have the same shape or the similarity metric is unknown.
+    """
+    if current_frame.shape != reference_frame.shape:
+        raise ValueError("The current frame and reference frame must have the same shape.")
+
+    return _ebma_cost_rows(current_frame, reference_frame, 0, current_frame.shape[0] // block_size, block_size,
+                           search_radius, get_metric(similarity_metric))
+
+
+def _ebma_cost_rows(current_frame, reference_frame, row_start, row_end, block_size, search_radius, metric,
+                    col_start=0, col_end=None):
+    # Cost volume of the blocks in rows [row_start, row_end) and columns [col_start, col_end), block positions
+    # stay absolute for the boundary rule
+    frame_height, frame_width = current_frame.shape
+    if col_end is None:
+        col_end = frame_width // block_size
+    window_size = 2 * search_radius + 1
+
+    cost_volume = np.full((row_end - row_start, col_end - col_start, window_size, window_size), np.inf)
+
+    for offset_y in range(-search_radius, search_radius + 1):
+        # Range of block rows whose displaced block stays inside the frame
+        first_y = max(row_start, -(offset_y // block_size))
+        last_y = min(row_end, (frame_height - block_size - offset_y) // block_size + 1)
+        if last_y <= first_y:
+            continue
+
+        for offset_x in range(-search_radius, search_radius + 1):
+            first_x = max(col_start, -(offset_x // block_size))
+            last_x = min(col_end, (frame_width - block_size - offset_x) // block_size + 1)
+            if last_x <= first_x:
+                continue
+
+            current_region = current_frame[first_y * block_size:last_y * block_size,
+                                           first_x * block_size:last_x * block_size]
+            reference_region = reference_frame[first_y * block_size + offset_y:last_y * block_size + offset_y,
+                                               first_x * block_size + offset_x:last_x * block_size + offset_x]
+
+            # Same metric as ebma_search, applied to every block of the region at once
+            blocks_shape = (last_y - first_y, block_size, last_x - first_x, block_size)
+            distances = metric(current_region.reshape(blocks_shape).swapaxes(1, 2),
+                               reference_region.reshape(blocks_shape).swapaxes(1, 2))
+
+            cost_volume[first_y - row_start:last_y - row_start, first_x - col_start:last_x - col_start,
+                        offset_y + search_radius, offset_x + search_radius] = distances
+
+    return cost_volume
+
+
+def ebma_search_vectorized(current_frame, reference_frame, block_size=16, search_radius=8, similarity_metric='MAD',
+                           workers=None, executor=None, return_evaluations=False, block_mask=None,
+                           initial_vectors=None):
+    """
+    Vectorized Exhaustive Block Matching Algorithm.
+
+    Builds the whole cost volume with ebma_cost_volume and takes an argmin over the search window of each
+    block. Ties resolve to the first displacement in raster order, so the result is identical to ebma_search.
+    With a block mask, costs are only computed for the bounding columns of each run of rows holding searched
+    blocks.
+
+    Parameters:
+    - current_frame (np.array): The current frame as a 2D numpy array.
+    - reference_frame (np.array): The reference frame as a 2D numpy array.
+    - block_size (int, optional): The size of the block. Default is 16.
+    - search_radius (int, optional): The search radius. Default is 8.
+    - similarity_metric (str, optional): Name of a metric in similarity_metrics.METRICS. Default is 'MAD'.
+    - workers (int, optional): Split the block grid into row bands searched by this many worker threads.
+    - executor (concurrent.futures.Executor, optional): Executor to search the row bands on.
+    - return_evaluations (bool, optional): Also return the number of block comparisons.
+    - block_mask (np.array, optional): Boolean (num_blocks_y, num_blocks_x) array; only blocks set to True are
+        searched, the others keep a zero vector.
+    - initial_vectors (np.array, optional): Ignored, like in ebma_search.
+
+    Returns:
+    - np.array: A 3D numpy array containing the motion vectors for each block.
+        The third dimension contains the y and x offsets.
+    - int: The number of block comparisons, only if return_evaluations is set.
+    """
+    if current_frame.shape != reference_frame.shape:
+        raise ValueError("The current frame and reference frame must have the same shape.")
+    metric = get_metric(similarity_metric)
+
+    frame_height, frame_width = current_frame.shape
+    motion_vectors = np.zeros((frame_height // block_size, frame_width // block_size, 2), dtype=int)
+
+    # NumPy releases the GIL while reducing whole regions, so parallel row bands run in threads
+    evaluations = run_tiled(_ebma_vectorized_rows, current_frame, reference_frame, motion_vectors,
+                            (block_size, search_radius, metric, block_mask), workers, executor,
+                            releases_gil=True)
+
+    if return_evaluations:
+        return motion_vectors, evaluations
     return motion_vectors
+
+
+def _ebma_vectorized_rows(current_frame, reference_frame, motion_vectors, row_start, row_end, block_size,
+                          search_radius, metric, block_mask):
+    window_size = 2 * search_radius + 1
+    evaluations = 0
+
+    for span_row_start, span_row_end, span_col_start, span_col_end in active_block_spans(
+            block_mask, row_start, row_end, motion_vectors.shape[1]):
+        cost_volume = _ebma_cost_rows(current_frame, reference_frame, span_row_start, span_row_end, block_size,
+                                      search_radius, metric, span_col_start, span_col_end)
+        num_rows, num_cols = cost_volume.shape[:2]
+
+        best_index = cost_volume.reshape(num_rows, num_cols, -1).argmin(axis=2)
+        span_vectors = np.stack([best_index // window_size - search_radius,
+                                 best_index % window_size - search_radius], axis=-1)
+
+        # Every finite entry of the cost volume is one block comparison
+        finite = np.isfinite(cost_volume)
+        if block_mask is not None:
+            span_mask = block_mask[span_row_start:span_row_end, span_col_start:span_col_end]
+            span_vectors[~span_mask] = 0
+            finite &= span_mask[:, :, None, None]
+
+        motion_vectors[span_row_start:span_row_end, span_col_start:span_col_end] = span_vectors
+        evaluations += int(finite.sum())
+
+    return evaluations
+
+
+def ebma_search_pruned(current_frame, reference_frame, block_size=16, search_radius=8, similarity_metric='MAD',
+                       workers=None, executor=None, return_evaluations=False, block_mask=None,
+                       initial_vectors=None):
+    """
+    Exhaustive Block Matching with successive elimination and partial distortion elimination.
+
+    Every candidate is first checked against the successive elimination bound
+    |sum(block) - sum(candidate)| <= SAD(block, candidate): candidates whose bound cannot beat the running
+    minimum are skipped. Candidate sums come from an integral image of the reference frame, computed once
+    per frame. The remaining candidates accumulate their distortion row by row and stop as soon as it
+    exceeds the running minimum. Ties are broken by raster order like ebma_search, so the vectors are the
+    ones an exhaustive search with the same distortion finds.
+
+    Differences are computed on widened integers, so the distortion is the true sum of absolute differences.
+
+    Parameters:
+    - current_frame (np.array): The current frame as a 2D numpy array.
+    - reference_frame (np.array): The reference frame as a 2D numpy array.
+    - block_size (int, optional): The size of the block. Default is 16.
+    - search_radius (int, optional): The search radius. Default is 8.
+    - similarity_metric (str, optional): 'MAD' or 'SAD'; both rank candidates by the sum of absolute
+        differences, so they give the same vectors.
+    - workers (int, optional): Split the block grid into row bands searched by this many worker processes.
+    - executor (concurrent.futures.Executor, optional): Executor to search the row bands on.
+    - return_evaluations (bool, optional): Also return the number of block comparisons that were not
+        eliminated by the bound.
+    - block_mask (np.array, optional): Boolean (num_blocks_y, num_blocks_x) array; only blocks set to True are
+        searched, the others keep a zero vector.
+    - initial_vectors (np.array, optional): (num_blocks_y, num_blocks_x, 2) vectors compared right after the
+        zero displacement. A good guess tightens the bound early; the result does not depend on it.
+
+    Returns:
+    - np.array: A 3D numpy array containing the motion vectors for each block.
+        The third dimension contains the y and x offsets.
+    - int: The number of block comparisons, only if return_evaluations is set.
+
+    Raises:
+    - ValueError: If the frames do not have the same shape or the metric is not MAD or SAD.
+    """
+    if current_frame.shape != reference_frame.shape:
+        raise ValueError("The current frame and reference frame must have the same shape.")
+    if similarity_metric not in ('MAD', 'SAD'):
+        raise ValueError("Pruned EBMA only supports the 'MAD' and 'SAD' similarity metrics.")
+
+    frame_height, frame_width = current_frame.shape
+    motion_vectors = np.zeros((frame_height // block_size, frame_width // block_size, 2), dtype=int)
+
+    # Sum of every block_size x block_size window of the reference frame, indexed by its top-left corner
+    integral = np.zeros((frame_height + 1, frame_width + 1), dtype=np.int64)
+    integral[1:, 1:] = reference_frame.astype(np.int64).cumsum(axis=0).cumsum(axis=1)
+    window_sums = (integral[block_size:, block_size:] - integral[:-block_size, block_size:]
+                   - integral[block_size:, :-block_size] + integral[:-block_size, :-block_size])
+
+    # The per-candidate loop holds the GIL, so parallel row bands run in processes
+    evaluations = run_tiled(_ebma_pruned_rows, current_frame, reference_frame, motion_vectors,
+                            (block_size, search_radius, window_sums, block_mask, initial_vectors), workers, executor)
+
+    if return_evaluations:
+        return motion_vectors, evaluations
+    return motion_vectors
+
+
+def _ebma_pruned_rows(current_frame, reference_frame, motion_vectors, row_start, row_end, block_size, search_radius,
+                      window_sums, block_mask, initial_vectors):
+    frame_height, frame_width = current_frame.shape
+    window_size = 2 * search_radius + 1
+    evaluations = 0
+
+    for block_y in range(row_start, row_end):
+        for block_x in range(motion_vectors.shape[1]):
+            if block_mask is not None and not block_mask[block_y, block_x]:
+                continue
+
+            block_start_y = block_y * block_size
+            block_start_x = block_x * block_size
+            current_block = current_frame[block_start_y:block_start_y + block_size,
+                                          block_start_x:block_start_x + block_size].astype(np.int64)
+
+            # Displacements that keep the reference block inside the frame
+            first_y = max(-search_radius, -block_start_y)
+            last_y = min(search_radius, frame_height - block_size - block_start_y)
+            first_x = max(-search_radius, -block_start_x)
+            last_x = min(search_radius, frame_width - block_size - block_start_x)
+
+            # Successive elimination bound of every candidate in the window, in raster order
+            bounds = np.abs(int(current_block.sum()) - window_sums[block_start_y + first_y:block_start_y + last_y + 1,
+                                                                   block_start_x + first_x:block_start_x + last_x + 1])
+            offsets_y, offsets_x = np.mgrid[first_y:last_y + 1, first_x:last_x + 1]
+            indices = ((offsets_y + search_radius) * window_size + offsets_x + search_radius).ravel()
+            bounds = bounds.ravel()
+
+            # Start from the zero displacement, it is always inside the frame and usually a good match
+            reference_block = reference_frame[block_start_y:block_start_y + block_size,
+                                              block_start_x:block_start_x + block_size]
+            min_distance = int(np.abs(current_block - reference_block).sum())
+            best_index = search_radius * window_size + search_radius
+            visited = {best_index}
+            evaluations += 1
+
+            # Then the initial vector, if it lies inside the window
+            if initial_vectors is not None:
+                seed_y, seed_x = (int(component) for component in initial_vectors[block_y, block_x])
+                if first_y <= seed_y <= last_y and first_x <= seed_x <= last_x and (seed_y, seed_x) != (0, 0):
+                    index = (seed_y + search_radius) * window_size + seed_x + search_radius
+                    reference_block = reference_frame[block_start_y + seed_y:block_start_y + seed_y + block_size,
+                                                      block_start_x + seed_x:block_start_x + seed_x + block_size]
+                    distance = int(np.abs(current_block - reference_block).sum())
+                    if distance < min_distance or (distance == min_distance and index < best_index):
+                        min_distance, best_index = distance, index
+                    visited.add(index)
+                    evaluations += 1
+
+            # Visit the most promising candidates first; once the bound exceeds the running minimum, so do
+            # the bounds of all remaining candidates
+            for candidate in np.argsort(bounds, kind='stable'):
+                bound, index = int(bounds[candidate]), int(indices[candidate])
+                if bound > min_distance:
+                    break
+                # A candidate only wins with a smaller distance, or an equal one earlier in raster order
+                if index in visited or (bound == min_distance and index > best_index):
+                    continue
+                evaluations += 1
+
+                ref_y = block_start_y + index // window_size - search_radius
+                ref_x = block_start_x + index % window_size - search_radius
+                reference_block = reference_frame[ref_y:ref_y + block_size, ref_x:ref_x + block_size]
+                distance = 0
+                for row in range(block_size):
+                    distance += int(np.abs(current_block[row] - reference_block[row]).sum())
+                    if distance > min_distance or (distance == min_distance and index > best_index):
+                        break
+                else:
+                    min_distance = distance
+                    best_index = index
+
+            best_offset_y = best_index // window_size - search_radius
+            best_offset_x = best_index % window_size - search_radius
+            motion_vectors[block_y, block_x] = [best_offset_y, best_offset_x]
+
+    return evaluations
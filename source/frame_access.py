@@ -0,0 +1,214 @@
+﻿import bisect
+import threading
+from collections import OrderedDict, namedtuple
+
+import cv2
+import numpy as np
+
+# Keyframe and timestamp index of a video: the frame indices of its keyframes, ascending, and the presentation
+# time of every frame in milliseconds
+FrameIndex = namedtuple('FrameIndex', ['keyframes', 'timestamps'])
+
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024  # Decoded frames kept by a FrameAccess, colour and grayscale together
+# OpenCV's FFmpeg backend seeks to the last keyframe at least this many frames before the requested one, and
+# decodes forward from there
+SEEK_BACK = 16
+# Frames before the requested one that a seek decodes anyway and that are kept for scrubbing backwards
+CACHE_BEHIND = 32
+
+
+def build_frame_index(video_path):
+    """
+    Keyframe and timestamp index of a video, read from its packets without decoding them.
+
+    Packets come in decode order; the frame index of a packet is the rank of its timestamp among all of them,
+    which is its position in presentation order.
+
+    Input:
+    - video_path (str): The video
+
+    Returns:
+    - FrameIndex: The index, None if the backend cannot read the packets
+    """
+    videocapture = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+    try:
+        if not videocapture.isOpened() or not videocapture.set(cv2.CAP_PROP_FORMAT, -1):
+            return None
+        packet_timestamps, packet_is_key = [], []
+        while videocapture.grab():
+            packet_timestamps.append(videocapture.get(cv2.CAP_PROP_POS_MSEC))
+            packet_is_key.append(bool(videocapture.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME)))
+    finally:
+        videocapture.release()
+    if not packet_timestamps:
+        return None
+    order = np.argsort(packet_timestamps, kind='stable')
+    frame_numbers = np.empty(len(order), dtype=int)
+    frame_numbers[order] = np.arange(len(order))
+    keyframes = sorted(int(frame_numbers[packet]) for packet, is_key in enumerate(packet_is_key) if is_key)
+    if not keyframes or keyframes[0] != 0:
+        keyframes.insert(0, 0)
+    return FrameIndex(keyframes, [float(packet_timestamps[packet]) for packet in order])
+
+
+class FrameAccess:
+    """
+    Random access to the decoded frames of a video, shared by everything that reads it.
+
+    The keyframe index is built when the video is first opened. A requested frame comes from the LRU cache of
+    decoded colour and grayscale frames if it is there. Otherwise the decoder reads forward from where it is,
+    when that takes fewer frames than decoding forward from the keyframe a seek would land on; or it seeks,
+    to a position that lands on the same keyframe but returns up to CACHE_BEHIND frames before the requested
+    one, so scrubbing backwards hits the cache. Every frame read on the way is cached. The cache holds at most
+    max_bytes, least recently used frames go first.
+
+    Cached frames are shared and read-only; copy them to draw on them.
+
+    One decoder serves one reader at a time, so a thread that reads the video on its own, like a pipeline,
+    takes a reader(): a FrameAccess with its own decoder that shares the index and the cache of this one, so
+    every frame a reader decodes is there for later readers too.
+    """
+
+    def __init__(self, video_path, max_bytes=DEFAULT_CACHE_BYTES, index=None, build_index=True, shared=None):
+        self.video_path = video_path
+        self.max_bytes = max_bytes
+        # None without packet access or until set_index(), seeks then go straight to the frame
+        self.index = build_frame_index(video_path) if index is None and build_index else index
+        self.shared = shared  # The FrameAccess whose cache the frames go to, None to keep them in this one's
+        self.videocapture = cv2.VideoCapture(video_path)
+        self.fps = self.videocapture.get(cv2.CAP_PROP_FPS)  # 0 if the container does not tell
+        self.frame_height = int(self.videocapture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.frame_width = int(self.videocapture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.total_frames = len(self.index.timestamps) if self.index is not None \
+            else int(self.videocapture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.position = 0  # Index of the next frame the decoder returns
+        self.cache = OrderedDict()  # (frame index, grayscale) -> frame, least recently used first
+        self.cache_bytes = 0
+        self.hits = 0  # Frames served from the cache
+        self.decoded = 0  # Frames decoded
+        self.seeks = 0
+        self._lock = threading.Lock()
+
+    def frame(self, frame_index, grayscale=False):
+        """
+        A frame of the video.
+
+        Input:
+        - frame_index (int): The index of the frame
+        - grayscale (bool): The grayscale frame instead of the BGR one
+
+        Returns:
+        - np.array: The read-only frame, None past the end of the video
+        """
+        if frame_index < 0:
+            return None
+        with self._lock:
+            cached = self._cached((frame_index, grayscale))
+            if cached is not None:
+                return cached
+            color = self._cached((frame_index, False)) if grayscale else None
+            if color is None:
+                color = self._decode_to(frame_index)
+                if color is None:
+                    return None
+            if not grayscale:
+                return color
+            return self._store((frame_index, True), cv2.cvtColor(color, cv2.COLOR_BGR2GRAY))
+
+    def reader(self):
+        """
+        A FrameAccess of the same video for one more thread.
+
+        Returns:
+        - FrameAccess: A reader with its own decoder, sharing this one's index and cache; releasing it keeps
+          the frames it decoded in the cache
+        """
+        return FrameAccess(self.video_path, self.max_bytes, index=self.index, build_index=False, shared=self)
+
+    def set_index(self, index):
+        """Use a keyframe index built after opening, see build_frame_index."""
+        with self._lock:
+            self.index = index
+            if index is not None:
+                self.total_frames = len(index.timestamps)
+
+    def keyframe_before(self, frame_index):
+        """The last keyframe at or before a frame, None without an index."""
+        if self.index is None:
+            return None
+        return self.index.keyframes[bisect.bisect_right(self.index.keyframes, frame_index) - 1]
+
+    def timestamp(self, frame_index):
+        """Presentation time of a frame in milliseconds, from the index or the frame rate."""
+        if self.index is not None and 0 <= frame_index < len(self.index.timestamps):
+            return self.index.timestamps[frame_index]
+        return 1000.0 * frame_index / (self.fps or 25.0)
+
+    def release(self):
+        """Close the decoder and drop the cache."""
+        with self._lock:
+            self.videocapture.release()
+            self.cache.clear()
+            self.cache_bytes = 0
+
+    def _cached(self, key):
+        if self.shared is not None:
+            # A reader holds its own lock for its decoder, and the shared one for the cache
+            with self.shared._lock:
+                frame = self.shared._lookup(key)
+        else:
+            frame = self._lookup(key)
+        if frame is not None:
+            self.hits += 1
+        return frame
+
+    def _lookup(self, key):
+        frame = self.cache.get(key)
+        if frame is not None:
+            self.cache.move_to_end(key)
+        return frame
+
+    def _decode_to(self, frame_index):
+        # Decode forward to a frame, seeking first if that decodes fewer frames
+        if not self.videocapture.isOpened():
+            self.videocapture = cv2.VideoCapture(self.video_path)
+            self.position = 0
+        if self.index is not None:
+            landing = self.keyframe_before(max(0, frame_index - SEEK_BACK))
+            forward = frame_index - self.position if self.position <= frame_index else None
+            if forward is None or forward > frame_index - landing:
+                # Every start from landing + SEEK_BACK on lands on the same keyframe (any start does for the
+                # first one) and costs the same decode; the earliest caches the most frames
+                earliest = landing + SEEK_BACK if landing else 0
+                self._seek(max(earliest, frame_index - CACHE_BEHIND))
+        elif self.position != frame_index:
+            self._seek(frame_index)
+
+        color = None
+        while self.position <= frame_index:
+            frame_read, color = self.videocapture.read()
+            if not frame_read:
+                return None
+            self.decoded += 1
+            self._store((self.position, False), color)
+            self.position += 1
+        return color
+
+    def _seek(self, frame_index):
+        self.videocapture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        self.position = frame_index
+        self.seeks += 1
+
+    def _store(self, key, frame):
+        frame.flags.writeable = False
+        if self.shared is not None:
+            with self.shared._lock:
+                return self.shared._store(key, frame)
+        if key in self.cache:
+            self.cache_bytes -= self.cache.pop(key).nbytes
+        self.cache[key] = frame
+        self.cache_bytes += frame.nbytes
+        while self.cache_bytes > self.max_bytes and len(self.cache) > 1:
+            _, evicted = self.cache.popitem(last=False)
+            self.cache_bytes -= evicted.nbytes
+        return frame
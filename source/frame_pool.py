@@ -0,0 +1,67 @@
+﻿import threading
+from collections import deque
+
+import numpy as np
+
+
+class FramePool:
+    """
+    Fixed set of preallocated output buffers handed from a producer thread to a consumer.
+
+    The producer writes a frame into a buffer taken with acquire() and passes the buffer itself on; the
+    consumer owns it until it gives it back with release(). No frame is copied on the way, and no memory is
+    allocated once the pool holds `capacity` buffers of the frame size. When every buffer is out, acquire()
+    waits, so a slow consumer (e.g. the GUI) holds back the producer instead of queueing frames. close()
+    wakes a waiting producer, which is what lets a GUI thread stop the producer while it holds buffers.
+    """
+
+    def __init__(self, capacity=3):
+        self.capacity = capacity
+        self._condition = threading.Condition()
+        self._buffers = []  # Every buffer of the current frame size, free or not
+        self._free = deque()
+        self._closed = False
+
+    def acquire(self, shape, dtype=np.uint8):
+        """
+        Take a free buffer, waiting for one if they are all out.
+
+        Input:
+        - shape (tuple): Shape of the frame to be written
+        - dtype (np.dtype): Type of the frame
+
+        Returns:
+        - np.array: An uninitialized buffer of that shape and type, or None once the pool is closed
+        """
+        shape, dtype = tuple(shape), np.dtype(dtype)
+        with self._condition:
+            if self._buffers and (self._buffers[0].shape != shape or self._buffers[0].dtype != dtype):
+                # The frame size changed; buffers still out are dropped when they come back
+                self._buffers = []
+                self._free = deque()
+            while not self._free and len(self._buffers) >= self.capacity and not self._closed:
+                self._condition.wait()
+            if self._closed:
+                return None
+            if not self._free:
+                buffer = np.empty(shape, dtype=dtype)
+                self._buffers.append(buffer)
+                return buffer
+            return self._free.popleft()
+
+    def release(self, buffer):
+        """Give a buffer back. Arrays that are not buffers of this pool are ignored."""
+        with self._condition:
+            if any(buffer is pooled for pooled in self._buffers) and not any(buffer is free for free in self._free):
+                self._free.append(buffer)
+                self._condition.notify_all()
+
+    def close(self):
+        """Make acquire() return None, now and until open() is called."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def open(self):
+        with self._condition:
+            self._closed = False
@@ -0,0 +1,219 @@
+﻿import threading
+import time
+from collections import deque, namedtuple
+
+import cv2
+import numpy as np
+
+# A decoded frame: its index in the video, the BGR image, its grayscale version (None if the source does not
+# convert) and the ring slot both images live in. Frames that were only grabbed have no images and no slot.
+DecodedFrame = namedtuple('DecodedFrame', ['index', 'color', 'gray', 'slot'])
+
+
+class FrameSource:
+    """
+    Decodes a video on its own thread into a fixed ring of preallocated frame buffers.
+
+    Decoding overlaps with whatever the consumer does with the previous frames. Every slot holds one BGR
+    frame and, optionally, its grayscale conversion, both written in place. A frame returned by read()
+    keeps its slot until it is given back with release(); when every slot is taken the decode thread
+    waits, so a slow consumer holds back the decoder instead of growing memory. Each of those waits is
+    counted in `stalls`.
+
+    A consumer must never hold more frames than the ring has slots, or read() blocks forever.
+
+    Frames for which grab_only(index) is True are only grabbed: the decoder steps over them without
+    converting them to images, and read() returns them without images and without a slot.
+
+    With a FrameAccess, frames come from it instead of a capture of their own: frames it has cached are
+    copied into the ring without decoding, and it stays open across stop() and start(), so a resume
+    continues decoding where the decoder stopped instead of seeking.
+    """
+
+    def __init__(self, video_path, capacity=4, grayscale=True, timer=None, grab_only=None, frame_access=None):
+        if capacity < 2:
+            raise ValueError("The frame ring needs at least 2 slots.")
+        self.video_path = video_path
+        self.capacity = capacity
+        self.grayscale = grayscale
+        self.timer = timer  # StageTimer for the 'decode' and 'grayscale' stages, None times nothing
+        self.grab_only = grab_only  # grab_only(index) -> True for frames that are not retrieved, None retrieves all
+        self.frame_access = frame_access  # Shared FrameAccess of the video, None decodes with a capture of its own
+        if frame_access is not None:
+            self.videocapture = None
+            self.total_frames = frame_access.total_frames
+            self.frame_height = frame_access.frame_height
+            self.frame_width = frame_access.frame_width
+            self.fps = frame_access.fps
+        else:
+            self.videocapture = cv2.VideoCapture(video_path)
+            self.total_frames = int(self.videocapture.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.frame_height = int(self.videocapture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            self.frame_width = int(self.videocapture.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self.fps = self.videocapture.get(cv2.CAP_PROP_FPS)  # 0 if the container does not tell
+        self.stalls = 0  # Times the decode thread found the ring full
+        self.position = 0  # Index of the next frame read() returns
+
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._color_buffers = []
+        self._gray_buffers = []
+        self._free_slots = deque()
+        self._decoded = deque()  # DecodedFrame, in decode order
+        self._finished = False
+
+    def start(self, start_frame=0):
+        """
+        Start decoding at a frame index. Calling start again after stop() resumes at another index.
+
+        The ring is allocated anew on every start, so frames of a previous run stay valid.
+        """
+        if self._thread is not None:
+            self.stop()
+        if self.frame_access is None:
+            if not self.videocapture.isOpened():
+                self.videocapture = cv2.VideoCapture(self.video_path)
+            if start_frame > 0:
+                self.videocapture.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+        self.position = start_frame
+        self._color_buffers = []
+        self._gray_buffers = []
+        self._free_slots = deque(range(self.capacity))
+        self._decoded = deque()
+        self._finished = False
+        self._running = True
+        self._thread = threading.Thread(target=self._decode, args=(start_frame,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the decode thread and close the video, unless it is shared. Frames already read stay valid."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.videocapture is not None and self.videocapture.isOpened():
+            self.videocapture.release()
+
+    def read(self):
+        """
+        Next decoded frame, in decode order.
+
+        Returns:
+        - DecodedFrame: The frame, to be given back with release() once it is no longer used,
+            or None at the end of the video or after stop()
+        """
+        with self._condition:
+            while not self._decoded and not self._finished and self._running:
+                self._condition.wait()
+            if not self._decoded or not self._running:
+                return None
+            decoded = self._decoded.popleft()
+            self.position = decoded.index + 1
+            return decoded
+
+    def release(self, decoded):
+        """Give the slot of a frame back to the decoder; its images may be overwritten afterwards."""
+        if decoded is None or decoded.slot is None:
+            return
+        with self._condition:
+            self._free_slots.append(decoded.slot)
+            self._condition.notify_all()
+
+    def __iter__(self):
+        """Iterate over the frames, releasing each one when the next is requested."""
+        previous = None
+        while True:
+            decoded = self.read()
+            self.release(previous)
+            if decoded is None:
+                return
+            yield decoded
+            previous = decoded
+
+    def _decode(self, index):
+        try:
+            while True:
+                if self.grab_only is not None and self.grab_only(index):
+                    start = time.perf_counter()
+                    if self.frame_access is not None:
+                        frame_grabbed = index < self.frame_access.total_frames
+                    else:
+                        frame_grabbed = self.videocapture.grab()
+                    if self.timer is not None:
+                        self.timer.add('decode', time.perf_counter() - start, start, index)
+                    if not frame_grabbed:
+                        return
+                    with self._condition:
+                        if not self._running:
+                            return
+                        self._decoded.append(DecodedFrame(index, None, None, None))
+                        self._condition.notify_all()
+                    index += 1
+                    continue
+
+                with self._condition:
+                    if not self._free_slots and self._running:
+                        self.stalls += 1
+                    while not self._free_slots and self._running:
+                        self._condition.wait()
+                    if not self._running:
+                        return
+                    slot = self._free_slots.popleft()
+
+                start = time.perf_counter()
+                frame_read, color = self._read(index, self._color_buffers[slot] if self._color_buffers else None)
+                if self.timer is not None:
+                    self.timer.add('decode', time.perf_counter() - start, start, index)
+                if not frame_read:
+                    return
+                if not self._color_buffers:
+                    # The first frame tells the frame size; preallocate every slot for it
+                    self._allocate(color)
+                    self._color_buffers[slot][...] = color
+                elif color is not self._color_buffers[slot]:
+                    # The decoder could not write in place (the frame size changed)
+                    self._color_buffers[slot] = color
+                    if self.grayscale:
+                        self._gray_buffers[slot] = np.empty(color.shape[:2], dtype=np.uint8)
+                color = self._color_buffers[slot]
+
+                gray = None
+                if self.grayscale:
+                    gray = self._gray_buffers[slot]
+                    start = time.perf_counter()
+                    if self.frame_access is not None:
+                        np.copyto(gray, self.frame_access.frame(index, grayscale=True))
+                    else:
+                        cv2.cvtColor(color, cv2.COLOR_BGR2GRAY, dst=gray)
+                    if self.timer is not None:
+                        self.timer.add('grayscale', time.perf_counter() - start, start, index)
+
+                with self._condition:
+                    self._decoded.append(DecodedFrame(index, color, gray, slot))
+                    self._condition.notify_all()
+                index += 1
+        finally:
+            with self._condition:
+                self._finished = True
+                self._condition.notify_all()
+
+    def _read(self, index, buffer):
+        # The next frame, into buffer if it fits (None allocates one), like VideoCapture.read
+        if self.frame_access is None:
+            return self.videocapture.read(buffer)
+        frame = self.frame_access.frame(index)
+        if frame is None:
+            return False, None
+        if buffer is None or buffer.shape != frame.shape:
+            return True, frame.copy()
+        np.copyto(buffer, frame)
+        return True, buffer
+
+    def _allocate(self, frame):
+        self._color_buffers = [np.empty_like(frame) for _ in range(self.capacity)]
+        if self.grayscale:
+            self._gray_buffers = [np.empty(frame.shape[:2], dtype=np.uint8) for _ in range(self.capacity)]
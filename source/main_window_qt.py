@@ -1,116 +1,199 @@
 ﻿import sys
+import time
+
 import cv2
 import numpy as np
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QFileDialog, QLabel,
     QVBoxLayout, QPushButton, QWidget, QHBoxLayout,
-    QGroupBox, QTabWidget, QMessageBox, QProgressBar, QLineEdit, QFormLayout, QScrollArea, QRadioButton, QButtonGroup
+    QGroupBox, QTabWidget, QMessageBox, QProgressBar, QLineEdit, QFormLayout, QScrollArea, QRadioButton, QButtonGroup,
+    QCheckBox
 )
-from PyQt5.QtGui import QImage, QPixmap
-from PyQt5.QtCore import QThread, pyqtSignal, Qt
-from source.ebma import ebma_search
-from source.threestepsearch import tss_search
-from ROITracking import TrackingProcessor
+from PyQt5.QtGui import QImage, QPixmap, QPainter, QPen
+from PyQt5.QtCore import QThread, pyqtSignal, Qt, QRect
+from source.algorithms import ALGORITHMS, check_search_settings
+from source.frame_access import FrameAccess, build_frame_index
+from source.frame_pool import FramePool
+from source.motion_cache import MotionFieldCache
+from source.motion_pipeline import MotionPipeline
+from source.pyramid import check_pyramid_levels
+from source.quadtree import DEFAULT_SPLIT_THRESHOLD, check_quadtree_settings
+from source.ROITracking import TRACKERS, TrackingPipeline, available_trackers
+from source.similarity_metrics import METRICS
+from source.stage_timing import StageTimer
+from source.subpixel import PRECISIONS
+from source.vector_rendering import RENDERERS
+
+TIMINGS_INTERVAL = 15  # Frames between two timings_updated signals
+DISPLAY_BUFFERS = 3  # Frames on their way to the GUI, or being shown, per processor
+
+
+def bgr_image(frame):
+    """QImage viewing a BGR frame's memory, no copy and no color swap. The frame must outlive the image."""
+    height, width = frame.shape[:2]
+    return QImage(frame.data, width, height, frame.strides[0], QImage.Format_BGR888)
+
+
+class SelectionOverlay(QWidget):
+    """
+    Transparent layer over a video label that paints the rectangle being drawn, and optionally rectangles
+    already placed, leaving the frame alone.
+    """
+
+    def __init__(self, parent=None, color=Qt.red):
+        super().__init__(parent)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.color = color
+        self.selection = None  # QRect in label coordinates, None paints nothing
+        self.regions = []  # QRects that stay until replaced
+
+    def set_selection(self, selection):
+        self.selection = selection
+        self.update()
+
+    def set_regions(self, regions):
+        self.regions = list(regions)
+        self.update()
+
+    def paintEvent(self, event):
+        if self.selection is None and not self.regions:
+            return
+        painter = QPainter(self)
+        painter.setPen(QPen(self.color, 2))
+        for region in self.regions:
+            painter.drawRect(region)
+        if self.selection is not None:
+            painter.setPen(QPen(self.color, 2, Qt.DashLine))
+            painter.drawRect(self.selection)
+
+
+class IndexBuilder(QThread):
+    index_built = pyqtSignal(str, object)  # The video and its FrameIndex, None if its packets cannot be read
+
+    def __init__(self, video_path):
+        super().__init__()
+        self.video_path = video_path
+
+    def run(self):
+        # Reads every packet of the video, too slow for the GUI thread on long videos
+        self.index_built.emit(self.video_path, build_frame_index(self.video_path))
 
 
-# Todo: Could be moved to its own file
 class VideoProcessor(QThread):
     # Signals
-    frame_ready = pyqtSignal(np.ndarray)
+    frame_ready = pyqtSignal(np.ndarray)  # A frame_pool buffer, the receiver gives it back with release()
     progress_updated = pyqtSignal(int, int)
-
-    def __init__(self, video_path, algorithm, block_size=16, search_radius=8, similarity_metric="MAD"):
+    evaluations_updated = pyqtSignal(int)  # Block comparisons done for the last frame pair
+    timings_updated = pyqtSignal(dict)  # StageTimer.statistics() of the pipeline, every TIMINGS_INTERVAL frames
+    settings_updated = pyqtSignal(dict)  # MotionPipeline.effective_settings(), on change and with the timings
+
+    def __init__(self, video_path, algorithm, block_size=16, search_radius=8, similarity_metric="MAD", workers=1,
+                 queue_depth=None, pyramid_levels=1, static_threshold=0, temporal_seeding=False, motion_cache=None,
+                 render_mode='arrows', realtime=True, adaptive=False, rois=None, subpixel=1, min_block_size=None,
+                 split_threshold=DEFAULT_SPLIT_THRESHOLD, frame_access=None):
         super().__init__()
-        self.video_path = video_path  # Path to the video file
-        self.block_size = block_size  # Block size for motion estimation algorithms
-        self.search_radius = search_radius  # Search area for motion estimation algorithms
-        self.videocapture = cv2.VideoCapture(video_path)  # Open the video file
-        self.prev_frame = None  # Previous frame for motion estimation
-        self.running = True  # Flag to stop the thread
-        self.algorithm = algorithm  # The motion estimation algorithm to use
-        self.similarity_metric = similarity_metric  # The similarity metric to use (MAD or SSD)
-        self.total_frames = int(
-            self.videocapture.get(cv2.CAP_PROP_FRAME_COUNT))  # Total Amount of frames in the video, needed for progress
-        self.current_frame_index = 0  # Current frame index for resuming playback
+        # All the processing happens in the pipeline, this thread only turns its callbacks into signals
+        self.pipeline = MotionPipeline(video_path, algorithm, block_size, search_radius, similarity_metric, workers,
+                                       queue_depth, pyramid_levels, static_threshold, temporal_seeding,
+                                       motion_cache, frame_callback=self.emit_frame,
+                                       progress_callback=self.progress_updated.emit, render_mode=render_mode,
+                                       realtime=realtime, adaptive=adaptive,
+                                       settings_callback=self.settings_updated.emit, rois=rois, subpixel=subpixel,
+                                       min_block_size=min_block_size, split_threshold=split_threshold,
+                                       frame_access=frame_access)
+        self.frame_access = frame_access
+        self.frame_pool = FramePool(DISPLAY_BUFFERS)
 
     def run(self):
-        if self.current_frame_index > 0:
-            self.videocapture.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame_index)
+        self.pipeline.run()
+
+    def emit_frame(self, frame, frame_index, motion_vectors, evaluations):
+        if motion_vectors is not None:
+            self.evaluations_updated.emit(evaluations)
+        # The decoder reuses the frame's ring slot, so it is copied once into a display buffer that the GUI owns
+        # until it was shown
+        buffer = self.frame_pool.acquire(frame.shape)
+        if buffer is None:
+            return
+        with self.pipeline.timer.measure('handoff', frame_index):
+            np.copyto(buffer, frame)
+        self.frame_ready.emit(buffer)
+        if frame_index % TIMINGS_INTERVAL == 0:
+            self.timings_updated.emit(self.pipeline.timer.statistics())
+            self.settings_updated.emit(self.pipeline.effective_settings())
+
+    def stop(self):
+        self.pipeline.stop()
+        self.frame_pool.close()  # A run waiting for a display buffer must not wait for the GUI, which waits here
+        self.wait()
 
-        while self.running:
-            frame_read, frame = self.videocapture.read()
-            if not frame_read:
-                break
+    def resume(self):
+        # Decoding restarts right after the last emitted frame
+        if not self.isRunning():
+            self.pipeline.running = True
+            self.frame_pool.open()
+            self.start()
 
-            try:
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                if self.prev_frame is not None:
-                    motion_vectors = self.calculate_motion_vectors(self.prev_frame, gray)
-                    frame = self.draw_motion_vectors(frame, motion_vectors)
-                self.prev_frame = gray
+    def release(self):
+        # Stops for good, closing the processor's own decoder
+        self.stop()
+        if self.frame_access is not None:
+            self.frame_access.release()
 
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                self.frame_ready.emit(frame)
 
-                # update progress bar
-                self.current_frame_index += 1
-                self.progress_updated.emit(self.current_frame_index, self.total_frames)
+class TrackingProcessor(QThread):
+    frame_ready = pyqtSignal(np.ndarray)  # A frame_pool buffer, the receiver gives it back with release()
+    tracking_progress_updated = pyqtSignal(int, int)
+    timings_updated = pyqtSignal(dict)  # StageTimer.statistics() of the pipeline, every TIMINGS_INTERVAL frames
 
-            except Exception as e:
-                print(f"Error processing frame: {e}")
-                break
+    def __init__(self, video_path, tracker='mil', keyframe_interval=1, appearance_threshold=None, frame_access=None):
+        super().__init__()
+        self.pipeline = TrackingPipeline(video_path, frame_callback=self.emit_frame,
+                                         progress_callback=self.tracking_progress_updated.emit, tracker=tracker,
+                                         keyframe_interval=keyframe_interval,
+                                         appearance_threshold=appearance_threshold, frame_access=frame_access)
+        self.frame_access = frame_access
+        self.frame_pool = FramePool(DISPLAY_BUFFERS)
 
-        self.videocapture.release()
+    @property
+    def is_running(self):
+        return self.pipeline.is_running
 
-    def calculate_motion_vectors(self, prev_frame, curr_frame):
-        try:
-            return self.algorithm(prev_frame, curr_frame, self.block_size, self.search_radius, self.similarity_metric)
-        except Exception as e:
-            print(f"Error in calculating motion vectors: {e}")
-            return []
+    def set_bounding_boxes(self, bboxes):
+        self.pipeline.set_bounding_boxes(bboxes)
 
-    def draw_motion_vectors(self, frame: np.ndarray, motion_vectors: np.ndarray):
-        """
-        Draw motion vectors on the frame.
+    def draw_bounding_boxes(self, bboxes):
+        self.pipeline.draw_bounding_boxes(bboxes)
 
-        Input:
-            frame (np.ndarray): The frame on which to draw the motion vectors. It should be a 3-channel image.
-            motion_vectors (np.ndarray): A 2D array of motion vectors. Each element is a tuple (dy, dx) representing
-                                         the displacement vector for each block.
+    def run(self):
+        self.pipeline.run()
 
-        Returns:
-            np.ndarray: The frame with motion vectors drawn on it.
-        """
-        try:
-            num_blocks_y, num_blocks_x, _ = motion_vectors.shape
-            for block_y in range(num_blocks_y):
-                for block_x in range(num_blocks_x):
-                    dy, dx = motion_vectors[block_y, block_x]
-                    start_point = (block_x * self.block_size + self.block_size // 2,
-                                   block_y * self.block_size + self.block_size // 2)
-                    if dx == 0 and dy == 0:  # Check if there was any change from the previous frame
-                        end_point = start_point
-                    else:
-                        end_point = (int(start_point[0] + dx), int(start_point[1] + dy))
-                    frame = cv2.arrowedLine(frame, start_point, end_point, (0, 0, 255), 1)
-            return frame
-        except Exception as e:
-            print(f"Error drawing motion vectors: {e}")
-            return frame
+    def emit_frame(self, frame, frame_index, bboxes):
+        buffer = self.frame_pool.acquire(frame.shape)
+        if buffer is None:
+            return
+        with self.pipeline.timer.measure('handoff', frame_index):
+            np.copyto(buffer, frame)
+        self.frame_ready.emit(buffer)
+        if frame_index % TIMINGS_INTERVAL == 0:
+            self.timings_updated.emit(self.pipeline.timer.statistics())
 
     def stop(self):
-        self.running = False
+        self.pipeline.stop()
+        self.frame_pool.close()
         self.wait()
-        if self.videocapture.isOpened():
-            self.current_frame_index = int(self.videocapture.get(cv2.CAP_PROP_POS_FRAMES))
-            self.videocapture.release()
 
     def resume(self):
-        if not self.videocapture.isOpened():
-            self.videocapture = cv2.VideoCapture(self.video_path)
-            self.running = True
+        if not self.isRunning():
+            self.pipeline.resume()
+            self.frame_pool.open()
             self.start()
 
+    def release(self):
+        self.stop()
+        if self.frame_access is not None:
+            self.frame_access.release()
+
 
 class MotionVectorVisualizer(QMainWindow):
     def __init__(self):
@@ -120,13 +203,20 @@ class MotionVectorVisualizer(QMainWindow):
         self.tracking_processor = None
         self.algorithm = None
         self.similarity_metric = "MAD"
+        self.render_mode = "arrows"
+        self.motion_cache = MotionFieldCache()  # Motion fields of videos already analysed, shared by every run
+        self.frame_access = None  # Indexed, cached frames of the loaded video, every run on it gets its own reader
+        self.index_builders = []  # Keyframe indexes being built, kept until their thread is done
         self.video_path = None
         self.bounding_box = None
+        self.bounding_boxes = []  # Boxes drawn since tracking last started or resumed, one target each
         self.drawing = False
         self.start_point = None
         self.end_point = None
-        self.current_frame = None
+        self.tracking_pixmap = None  # The frame shown in the tracking tab, the bounding box is drawn over it
         self.tracking_started = False
+        self.motion_rois = []  # (x, y, width, height) regions of interest of the motion tab, in video pixels
+        self.roi_start_point = None
 
     def initUI(self):
         self.setWindowTitle("Multimedia VectorView")
@@ -151,6 +241,15 @@ class MotionVectorVisualizer(QMainWindow):
         self.scroll_area.setWidget(self.video_label)
         self.video_layout.addWidget(self.scroll_area)
 
+        # Regions of interest are drawn with the mouse on the video, like the tracking bounding box
+        self.video_label.mousePressEvent = self.mouse_press_event_roi
+        self.video_label.mouseMoveEvent = self.mouse_move_event_roi
+        self.video_label.mouseReleaseEvent = self.mouse_release_event_roi
+        self.roi_overlay = SelectionOverlay(self.video_label, Qt.green)
+        roi_overlay_layout = QVBoxLayout(self.video_label)
+        roi_overlay_layout.setContentsMargins(0, 0, 0, 0)
+        roi_overlay_layout.addWidget(self.roi_overlay)
+
         self.load_button = QPushButton("Load Video")
         self.load_button.clicked.connect(self.load_video)
         self.video_layout.addWidget(self.load_button)
@@ -166,6 +265,20 @@ class MotionVectorVisualizer(QMainWindow):
         self.progress_bar = QProgressBar()
         self.video_layout.addWidget(self.progress_bar)
 
+        self.evaluations_label = QLabel("Block comparisons per frame: -")
+        self.video_layout.addWidget(self.evaluations_label)
+
+        self.effective_settings_label = QLabel("Effective settings: -")
+        self.video_layout.addWidget(self.effective_settings_label)
+
+        self.clear_rois_button = QPushButton("Clear Regions of Interest (drag on the video to add one)")
+        self.clear_rois_button.clicked.connect(self.clear_rois)
+        self.video_layout.addWidget(self.clear_rois_button)
+
+        self.save_trace_button = QPushButton("Save Timing Trace")
+        self.save_trace_button.clicked.connect(lambda: self.save_timing_trace(self.video_processor))
+        self.video_layout.addWidget(self.save_trace_button)
+
         self.side_menu_layout = QVBoxLayout()
         self.motion_layout.addLayout(self.side_menu_layout, stretch=1)
 
@@ -174,36 +287,88 @@ class MotionVectorVisualizer(QMainWindow):
         self.algorithm_group_box.setLayout(self.algorithm_layout)
         self.side_menu_layout.addWidget(self.algorithm_group_box)
 
-        self.ebma_button = QPushButton("EBMA")
-        self.ebma_button.clicked.connect(lambda: self.set_algorithm(ebma_search))
-        self.algorithm_layout.addWidget(self.ebma_button)
-
-        self.tss_button = QPushButton("Three-Step-Search")
-        self.tss_button.clicked.connect(lambda: self.set_algorithm(tss_search))
-        self.algorithm_layout.addWidget(self.tss_button)
+        # One button per registered algorithm
+        self.algorithm_buttons = {}
+        for name, algorithm in ALGORITHMS.items():
+            button = QPushButton(algorithm.label)
+            button.clicked.connect(lambda _, function=algorithm.function: self.set_algorithm(function))
+            self.algorithm_layout.addWidget(button)
+            self.algorithm_buttons[name] = button
 
         self.similarity_group_box = QGroupBox("Similarity Metric")
         self.similarity_layout = QVBoxLayout()
         self.similarity_group_box.setLayout(self.similarity_layout)
         self.side_menu_layout.addWidget(self.similarity_group_box)
 
-        self.mad_radio_button = QRadioButton("Mean Absolute Difference (MAD)")
-        self.mad_radio_button.setChecked(True)
-        self.mad_radio_button.toggled.connect(self.set_similarity_metric)
-        self.similarity_layout.addWidget(self.mad_radio_button)
-
-        self.ssd_radio_button = QRadioButton("Sum of Squared Differences (SSD)")
-        self.ssd_radio_button.toggled.connect(self.set_similarity_metric)
-        self.similarity_layout.addWidget(self.ssd_radio_button)
+        # One radio button per registered similarity metric
+        self.similarity_radio_buttons = {}
+        for name, metric in METRICS.items():
+            radio_button = QRadioButton(metric.label)
+            radio_button.setChecked(name == "MAD")
+            radio_button.toggled.connect(self.set_similarity_metric)
+            self.similarity_layout.addWidget(radio_button)
+            self.similarity_radio_buttons[name] = radio_button
+
+        self.subpixel_group_box = QGroupBox("Sub-pixel Precision")
+        self.subpixel_layout = QVBoxLayout()
+        self.subpixel_group_box.setLayout(self.subpixel_layout)
+        self.side_menu_layout.addWidget(self.subpixel_group_box)
+
+        # Applied when an algorithm is selected, like the block size
+        self.subpixel_radio_buttons = {}
+        for precision, label in PRECISIONS.items():
+            radio_button = QRadioButton(label)
+            radio_button.setChecked(precision == 1)
+            self.subpixel_layout.addWidget(radio_button)
+            self.subpixel_radio_buttons[precision] = radio_button
+
+        self.render_group_box = QGroupBox("Vector Display")
+        self.render_layout = QVBoxLayout()
+        self.render_group_box.setLayout(self.render_layout)
+        self.side_menu_layout.addWidget(self.render_group_box)
+
+        # One radio button per registered renderer, switchable while the video plays
+        self.render_radio_buttons = {}
+        for name, renderer in RENDERERS.items():
+            radio_button = QRadioButton(renderer.label)
+            radio_button.setChecked(name == "arrows")
+            radio_button.toggled.connect(self.set_render_mode)
+            self.render_layout.addWidget(radio_button)
+            self.render_radio_buttons[name] = radio_button
 
         self.block_size_input = QLineEdit()
         self.search_radius_input = QLineEdit()
         self.block_size_input.setPlaceholderText("Default: 16")
         self.search_radius_input.setPlaceholderText("Default: 8")
+        self.workers_input = QLineEdit()
+        self.queue_depth_input = QLineEdit()
+        self.workers_input.setPlaceholderText("Default: 1")
+        self.queue_depth_input.setPlaceholderText("Default: 2 x Workers")
+        self.pyramid_levels_input = QLineEdit()
+        self.pyramid_levels_input.setPlaceholderText("Default: 1 (no pyramid)")
+        self.static_threshold_input = QLineEdit()
+        self.static_threshold_input.setPlaceholderText("Default: 0 (search every block)")
+        self.min_block_size_input = QLineEdit()
+        self.min_block_size_input.setPlaceholderText("Default: none (fixed block size)")
+        self.split_threshold_input = QLineEdit()
+        self.split_threshold_input.setPlaceholderText(f"Default: {DEFAULT_SPLIT_THRESHOLD:g} per pixel")
+        self.temporal_seeding_checkbox = QCheckBox("Start from previous vectors")
+        self.realtime_checkbox = QCheckBox("Play at the video's frame rate, drop late frames")
+        self.realtime_checkbox.setChecked(True)
+        self.adaptive_checkbox = QCheckBox("Lower radius / block size / resolution to keep up")
 
         form_layout = QFormLayout()
         form_layout.addRow("Block Size:", self.block_size_input)
         form_layout.addRow("Search Radius:", self.search_radius_input)
+        form_layout.addRow("Pyramid Levels:", self.pyramid_levels_input)
+        form_layout.addRow("Static Threshold:", self.static_threshold_input)
+        form_layout.addRow("Min Block Size:", self.min_block_size_input)
+        form_layout.addRow("Split Threshold:", self.split_threshold_input)
+        form_layout.addRow("Temporal Seeding:", self.temporal_seeding_checkbox)
+        form_layout.addRow("Real-time Playback:", self.realtime_checkbox)
+        form_layout.addRow("Adaptive Quality:", self.adaptive_checkbox)
+        form_layout.addRow("Workers:", self.workers_input)
+        form_layout.addRow("Queue Depth:", self.queue_depth_input)
         self.side_menu_layout.addLayout(form_layout)
 
         self.video_exit_label = QLabel("Press ESC to close the application")
@@ -220,6 +385,33 @@ class MotionVectorVisualizer(QMainWindow):
         self.tracking_scroll_area.setWidget(self.tracking_video_label)
         self.tracking_layout.addWidget(self.tracking_scroll_area)
 
+        self.tracker_group_box = QGroupBox("Tracker")
+        self.tracker_layout = QHBoxLayout()
+        self.tracker_group_box.setLayout(self.tracker_layout)
+        self.tracking_layout.addWidget(self.tracker_group_box)
+
+        # One radio button per registered backend, read when tracking starts; the ones this OpenCV build
+        # lacks are shown disabled
+        self.tracker_radio_buttons = {}
+        available = available_trackers()
+        for name, backend in TRACKERS.items():
+            radio_button = QRadioButton(backend.label)
+            radio_button.setChecked(name == "mil")
+            if name not in available:
+                radio_button.setEnabled(False)
+                radio_button.setToolTip("Needs the opencv-contrib-python package")
+            self.tracker_layout.addWidget(radio_button)
+            self.tracker_radio_buttons[name] = radio_button
+
+        self.keyframe_interval_input = QLineEdit()
+        self.keyframe_interval_input.setPlaceholderText("Default: 1 (track every frame)")
+        self.appearance_threshold_input = QLineEdit()
+        self.appearance_threshold_input.setPlaceholderText("Default: none (track on the interval only)")
+        tracking_form_layout = QFormLayout()
+        tracking_form_layout.addRow("Track Every N Frames:", self.keyframe_interval_input)
+        tracking_form_layout.addRow("Appearance Threshold:", self.appearance_threshold_input)
+        self.tracking_layout.addLayout(tracking_form_layout)
+
         self.load_tracking_button = QPushButton("Load Video to Track")
         self.load_tracking_button.clicked.connect(self.load_tracking_video)
         self.tracking_layout.addWidget(self.load_tracking_button)
@@ -232,9 +424,17 @@ class MotionVectorVisualizer(QMainWindow):
         self.resume_tracking_button.clicked.connect(self.resume_tracking_video)
         self.tracking_layout.addWidget(self.resume_tracking_button)
 
+        self.clear_boxes_button = QPushButton("Clear Drawn Boxes")
+        self.clear_boxes_button.clicked.connect(self.clear_tracking_boxes)
+        self.tracking_layout.addWidget(self.clear_boxes_button)
+
         self.tracking_progress_bar = QProgressBar()
         self.tracking_layout.addWidget(self.tracking_progress_bar)
 
+        self.save_tracking_trace_button = QPushButton("Save Timing Trace")
+        self.save_tracking_trace_button.clicked.connect(lambda: self.save_timing_trace(self.tracking_processor))
+        self.tracking_layout.addWidget(self.save_tracking_trace_button)
+
         self.tracking_exit_label = QLabel("Press ESC to close the application")
         self.tracking_layout.addWidget(self.tracking_exit_label)
 
@@ -242,13 +442,42 @@ class MotionVectorVisualizer(QMainWindow):
         self.tracking_video_label.mouseMoveEvent = self.mouse_move_event_tracking
         self.tracking_video_label.mouseReleaseEvent = self.mouse_release_event_tracking
 
+        # The bounding box being drawn is painted on this layer, so mouse moves never touch the frame
+        self.selection_overlay = SelectionOverlay(self.tracking_video_label)
+        overlay_layout = QVBoxLayout(self.tracking_video_label)
+        overlay_layout.setContentsMargins(0, 0, 0, 0)
+        overlay_layout.addWidget(self.selection_overlay)
+
+        # Rolling per-stage timings of the running pipeline, kept apart from the status messages
+        self.timings_label = QLabel()
+        self.statusBar().addPermanentWidget(self.timings_label)
+
     def set_similarity_metric(self):
-        if self.mad_radio_button.isChecked():
-            self.similarity_metric = "MAD"
-        elif self.ssd_radio_button.isChecked():
-            self.similarity_metric = "SSD"
+        similarity_metric = next((name for name, radio_button in self.similarity_radio_buttons.items()
+                                  if radio_button.isChecked()), self.similarity_metric)
+        if self.video_processor and similarity_metric != self.similarity_metric:
+            pipeline = self.video_processor.pipeline
+            try:
+                # The running algorithm and block size must support the metric, or every frame would fail
+                if pipeline.min_block_size:
+                    check_quadtree_settings(pipeline.block_size, pipeline.min_block_size, similarity_metric)
+                else:
+                    check_search_settings(pipeline.base_algorithm, similarity_metric, pipeline.block_size,
+                                          pipeline.pyramid_levels)
+            except ValueError as e:
+                QMessageBox.warning(self, "Invalid Similarity Metric", str(e))
+                self.similarity_radio_buttons[self.similarity_metric].setChecked(True)
+                return
+        self.similarity_metric = similarity_metric
+        if self.video_processor:
+            self.video_processor.pipeline.similarity_metric = self.similarity_metric
+
+    def set_render_mode(self):
+        for name, radio_button in self.render_radio_buttons.items():
+            if radio_button.isChecked():
+                self.render_mode = name
         if self.video_processor:
-            self.video_processor.similarity_metric = self.similarity_metric
+            self.video_processor.pipeline.render_mode = self.render_mode
 
     def load_tracking_video(self):
         options = QFileDialog.Options()
@@ -259,40 +488,77 @@ class MotionVectorVisualizer(QMainWindow):
             self.video_path = file_path
             video_title = file_path.split("/")[-1]
             self.statusBar().showMessage(f"{video_title} was successfully loaded for tracking!")
+            self.clear_tracking_boxes()  # Boxes of another video do not apply
             self.tracking_progress_bar.setValue(0)
 
             # Display the first frame to draw bounding box
-            self.cap = cv2.VideoCapture(file_path)
-            frame_read, frame = self.cap.read()
+            frame = self.open_frame_access(file_path).frame(0)
 
-            if frame_read:
+            if frame is not None:
                 height, width, _ = frame.shape
                 self.resize(width + (int(width * 0.05)), height + (
                     int(height * 0.25)))  # resize by video's width and height, but also account for external UI elements
                 self.tracking_video_label.setFixedSize(width, height)
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                self.update_tracking_frame(frame_rgb)
+                self.update_tracking_frame(frame)
+
+    def open_frame_access(self, video_path):
+        # The frames of a video are cached for every later run, scrub or resume on it, and indexed in the
+        # background; loading another video replaces them
+        if self.frame_access is None or self.frame_access.video_path != video_path:
+            if self.frame_access is not None:
+                self.frame_access.release()
+            self.frame_access = FrameAccess(video_path, build_index=False)
+            index_builder = IndexBuilder(video_path)
+            index_builder.index_built.connect(self.set_frame_index)
+            index_builder.finished.connect(lambda: self.index_builders.remove(index_builder))
+            self.index_builders.append(index_builder)
+            index_builder.start()
+        return self.frame_access
+
+    def set_frame_index(self, video_path, index):
+        # Runs started before the index was there seek without it
+        if self.frame_access is not None and self.frame_access.video_path == video_path:
+            self.frame_access.set_index(index)
 
     def start_tracking(self):
-        if self.bounding_box is not None:
+        bboxes = self.bounding_boxes or ([self.bounding_box] if self.bounding_box is not None else [])
+        if bboxes:
             if self.tracking_processor:
-                self.tracking_processor.stop()
-            self.tracking_processor = TrackingProcessor(self.video_path)
-            self.tracking_processor.set_bounding_box(self.bounding_box)
+                self.tracking_processor.release()
+            tracker = next(name for name, radio_button in self.tracker_radio_buttons.items()
+                           if radio_button.isChecked())
+            try:
+                # Frames in between follow a constant velocity model
+                keyframe_interval = max(1, int(self.keyframe_interval_input.text() or 1))
+                appearance_threshold = float(self.appearance_threshold_input.text()) \
+                    if self.appearance_threshold_input.text() else None
+            except ValueError:
+                QMessageBox.warning(self, "Invalid Input", "Keyframe settings are automatically being set to default")
+                keyframe_interval = 1
+                appearance_threshold = None
+            self.tracking_processor = TrackingProcessor(self.video_path, tracker, keyframe_interval,
+                                                        appearance_threshold,
+                                                        self.open_frame_access(self.video_path).reader())
+            self.tracking_processor.set_bounding_boxes(bboxes)
             self.tracking_processor.frame_ready.connect(self.update_tracking_frame)
             self.tracking_processor.tracking_progress_updated.connect(self.update_tracking_progress)
+            self.tracking_processor.timings_updated.connect(self.update_timings)
             self.tracking_processor.start()
             self.tracking_started = True
 
     def update_tracking_frame(self, frame):
         try:
-            self.current_frame = frame  # Save current frame for redrawing
-            height, width, channel = frame.shape
-            bytes_per_line = 3 * width
-            qImg = QImage(frame.data, width, height, bytes_per_line, QImage.Format_RGB888)
-            self.tracking_video_label.setPixmap(QPixmap.fromImage(qImg))
+            start = time.perf_counter()
+            self.tracking_pixmap = QPixmap.fromImage(bgr_image(frame))  # Save current frame for redrawing
+            self.tracking_video_label.setPixmap(self.tracking_pixmap)
+            if self.tracking_processor:
+                self.tracking_processor.pipeline.timer.add('display', time.perf_counter() - start, start)
         except Exception as e:
             print(f"Error updating tracking frame: {e}")
+        finally:
+            # The pixmap holds its own copy, the buffer can take the next frame
+            if self.tracking_processor:
+                self.tracking_processor.frame_pool.release(frame)
 
     def update_tracking_progress(self, current_frame, total_frames):
         self.tracking_progress_bar.setMaximum(total_frames)
@@ -310,7 +576,6 @@ class MotionVectorVisualizer(QMainWindow):
         if not self.video_path:
             QMessageBox.warning(self, "No Video Loaded", "Please load a video before selecting an algorithm.")
             return
-        self.algorithm = algorithm
         try:
             block_size = int(self.block_size_input.text())
             search_radius = int(self.search_radius_input.text())
@@ -318,12 +583,63 @@ class MotionVectorVisualizer(QMainWindow):
             QMessageBox.warning(self, "Invalid Input", "Values are automatically being set to default")
             block_size = 16
             search_radius = 8
+        try:
+            # Empty fields silently fall back to the serial defaults
+            workers = int(self.workers_input.text() or 1)
+            queue_depth = int(self.queue_depth_input.text() or 2 * workers)
+        except ValueError:
+            QMessageBox.warning(self, "Invalid Input", "Worker settings are automatically being set to default")
+            workers = 1
+            queue_depth = None
+        try:
+            pyramid_levels = max(1, int(self.pyramid_levels_input.text() or 1))
+            check_pyramid_levels(block_size, pyramid_levels)
+        except ValueError:
+            QMessageBox.warning(self, "Invalid Input", "Pyramid levels are automatically being set to default")
+            pyramid_levels = 1
+        try:
+            static_threshold = max(0.0, float(self.static_threshold_input.text() or 0))
+        except ValueError:
+            QMessageBox.warning(self, "Invalid Input", "Static threshold is automatically being set to default")
+            static_threshold = 0
+        try:
+            # Variable block sizes split the blocks down to this size, by powers of two
+            min_block_size = int(self.min_block_size_input.text()) if self.min_block_size_input.text() else None
+            split_threshold = float(self.split_threshold_input.text() or DEFAULT_SPLIT_THRESHOLD)
+            if min_block_size is not None:
+                check_quadtree_settings(block_size, min_block_size, self.similarity_metric)
+        except ValueError as e:
+            QMessageBox.warning(self, "Invalid Input",
+                                f"Variable block sizes are automatically being turned off: {e}")
+            min_block_size = None
+            split_threshold = DEFAULT_SPLIT_THRESHOLD
+        subpixel = next(precision for precision, radio_button in self.subpixel_radio_buttons.items()
+                        if radio_button.isChecked())
+        if min_block_size is None:
+            try:
+                check_search_settings(algorithm, self.similarity_metric, block_size, pyramid_levels)
+            except ValueError as e:
+                QMessageBox.warning(self, "Invalid Similarity Metric", f"{e} Pick another metric or algorithm.")
+                return
+        self.algorithm = algorithm
 
         if self.video_processor:
-            self.video_processor.stop()
-        self.video_processor = VideoProcessor(self.video_path, self.algorithm, block_size, search_radius, self.similarity_metric)
+            self.video_processor.release()
+        self.video_processor = VideoProcessor(self.video_path, self.algorithm, block_size, search_radius,
+                                              self.similarity_metric, workers, queue_depth, pyramid_levels,
+                                              static_threshold, self.temporal_seeding_checkbox.isChecked(),
+                                              motion_cache=self.motion_cache, render_mode=self.render_mode,
+                                              realtime=self.realtime_checkbox.isChecked(),
+                                              adaptive=self.adaptive_checkbox.isChecked(), rois=self.motion_rois,
+                                              subpixel=subpixel, min_block_size=min_block_size,
+                                              split_threshold=split_threshold,
+                                              frame_access=self.open_frame_access(self.video_path).reader())
         self.video_processor.frame_ready.connect(self.update_frame)  # Connect to the frame_ready signal
         self.video_processor.progress_updated.connect(self.update_progress)  # Connect to the progress_updated signal
+        self.video_processor.evaluations_updated.connect(self.update_evaluations)
+        self.video_processor.timings_updated.connect(self.update_timings)
+        self.video_processor.settings_updated.connect(self.update_effective_settings)
+        self.update_effective_settings(self.video_processor.pipeline.effective_settings())
         self.video_processor.start()
 
     def load_video(self):
@@ -333,14 +649,14 @@ class MotionVectorVisualizer(QMainWindow):
                                                    "Video Files (*.mp4 *.avi *.mov);;All Files (*)", options=options)
         if file_path:
             self.video_path = file_path
+            self.clear_rois()  # Regions of another video do not apply
             video_title = file_path.split("/")[-1]
             self.statusBar().showMessage(f"{video_title} was successfully loaded!")
             self.progress_bar.setValue(0)
 
-            cap = cv2.VideoCapture(file_path)
-            frame_read, frame = cap.read()
+            frame = self.open_frame_access(file_path).frame(0)
 
-            if frame_read:
+            if frame is not None:
                 height, width, _ = frame.shape
                 self.resize(width + (int(width * 0.33)), height + (
                     int(height * 0.25)))  # resize by video's width and height, but also account for external UI elements
@@ -361,12 +677,41 @@ class MotionVectorVisualizer(QMainWindow):
 
     def update_frame(self, frame):
         try:
-            height, width, channel = frame.shape
-            bytes_per_line = 3 * width
-            qImg = QImage(frame.data, width, height, bytes_per_line, QImage.Format_RGB888)
-            self.video_label.setPixmap(QPixmap.fromImage(qImg))
+            start = time.perf_counter()
+            self.video_label.setPixmap(QPixmap.fromImage(bgr_image(frame)))
+            if self.video_processor:
+                self.video_processor.pipeline.timer.add('display', time.perf_counter() - start, start)
         except Exception as e:
             print(f"Error updating frame: {e}")
+        finally:
+            if self.video_processor:
+                self.video_processor.frame_pool.release(frame)
+
+    def mouse_press_event_roi(self, event):
+        if event.button() == Qt.LeftButton and self.video_path:
+            self.roi_start_point = event.pos()
+
+    def mouse_move_event_roi(self, event):
+        if self.roi_start_point is not None:
+            self.roi_overlay.set_selection(QRect(self.roi_start_point, event.pos()).normalized())
+
+    def mouse_release_event_roi(self, event):
+        if event.button() == Qt.LeftButton and self.roi_start_point is not None:
+            region = QRect(self.roi_start_point, event.pos()).normalized()
+            self.roi_start_point = None
+            self.roi_overlay.set_selection(None)
+            if region.width() > 1 and region.height() > 1:  # A click is not a region
+                self.set_rois(self.motion_rois + [(region.x(), region.y(), region.width(), region.height())])
+
+    def clear_rois(self):
+        self.set_rois([])
+
+    def set_rois(self, rois):
+        self.motion_rois = rois
+        self.roi_overlay.set_regions([QRect(*roi) for roi in rois])
+        if self.video_processor:
+            self.video_processor.pipeline.rois = list(rois)
+        self.statusBar().showMessage(f"{len(rois)} regions of interest" if rois else "Searching the whole frame.")
 
     def mouse_press_event_tracking(self, event):
         if event.button() == Qt.LeftButton:
@@ -384,19 +729,25 @@ class MotionVectorVisualizer(QMainWindow):
             self.end_point = event.pos()
             self.drawing = False
             self.bounding_box = self.get_bounding_box()
-            if self.tracking_processor and not self.tracking_processor.is_running:
-                self.tracking_processor.draw_bounding_box(self.bounding_box)
-            self.redraw_tracking_frame()
+            if self.bounding_box is not None and self.bounding_box[2] > 1 and self.bounding_box[3] > 1:
+                # Every box drawn is one more target; drawn while tracking is stopped, they replace the targets
+                self.bounding_boxes.append(self.bounding_box)
+                if self.tracking_processor and not self.tracking_processor.is_running:
+                    self.tracking_processor.draw_bounding_boxes(self.bounding_boxes)
+            self.selection_overlay.set_selection(None)
+            self.selection_overlay.set_regions([QRect(*bbox) for bbox in self.bounding_boxes])
+            self.statusBar().showMessage(f"{len(self.bounding_boxes)} boxes drawn")
+
+    def clear_tracking_boxes(self):
+        self.bounding_boxes = []
+        self.bounding_box = None
+        self.selection_overlay.set_regions([])
+        if self.tracking_processor and not self.tracking_processor.is_running:
+            self.tracking_processor.draw_bounding_boxes([])  # Resuming keeps the current targets
 
     def redraw_tracking_frame(self):
-        if self.current_frame is not None and self.start_point and self.end_point:
-            frame_copy = self.current_frame.copy()
-            cv2.rectangle(frame_copy, (self.start_point.x(), self.start_point.y()),
-                          (self.end_point.x(), self.end_point.y()), (255, 0, 0), 2)
-            height, width, channel = frame_copy.shape
-            bytes_per_line = 3 * width
-            qImg = QImage(frame_copy.data, width, height, bytes_per_line, QImage.Format_RGB888)
-            self.tracking_video_label.setPixmap(QPixmap.fromImage(qImg))
+        if self.tracking_pixmap is not None and self.start_point and self.end_point:
+            self.selection_overlay.set_selection(QRect(self.start_point, self.end_point).normalized())
 
     def get_bounding_box(self):
         if self.start_point and self.end_point:
@@ -406,11 +757,15 @@ class MotionVectorVisualizer(QMainWindow):
         return None
 
     def resume_tracking_video(self):
+        # From now on the tracker draws the boxes on the frames
+        self.selection_overlay.set_selection(None)
+        self.selection_overlay.set_regions([])
         if not self.tracking_started:
             self.start_tracking()
             self.statusBar().showMessage("Tracking started.")
         elif self.tracking_processor:
             self.tracking_processor.resume()
+        self.bounding_boxes = []  # Handed over to the trackers
         self.statusBar().showMessage("Tracking resumed.")
 
     def update_progress(self, current_frame, total_frames):
@@ -418,15 +773,39 @@ class MotionVectorVisualizer(QMainWindow):
         self.progress_bar.setValue(current_frame)
         self.progress_bar.setFormat(f"    Frames Processed: {current_frame} out of {total_frames} Total Frames")
 
+    def update_evaluations(self, evaluations):
+        self.evaluations_label.setText(f"Block comparisons per frame: {evaluations}")
+
+    def update_effective_settings(self, settings):
+        resolution = "full resolution" if settings['scale'] == 1 else f"1/{settings['scale']} resolution"
+        self.effective_settings_label.setText(
+            f"Effective settings: block {settings['block_size']}, radius {settings['search_radius']}, "
+            f"{resolution}, {settings['frames_dropped']} frames dropped")
+
+    def update_timings(self, statistics):
+        self.timings_label.setText(StageTimer.format(statistics))
+
+    def save_timing_trace(self, processor):
+        if processor is None:
+            QMessageBox.warning(self, "Nothing to Save", "Run motion estimation or tracking before saving a trace.")
+            return
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Timing Trace", "timing_trace.csv",
+                                                   "CSV Files (*.csv);;JSON Files (*.json)")
+        if file_path:
+            processor.pipeline.timer.dump_trace(file_path)
+            self.statusBar().showMessage(f"Timing trace saved to {file_path}")
+
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Escape:
             self.close_application()
 
     def close_application(self):
         if self.video_processor:
-            self.video_processor.stop()
+            self.video_processor.release()
         if self.tracking_processor:
-            self.tracking_processor.stop()
+            self.tracking_processor.release()
+        for index_builder in list(self.index_builders):
+            index_builder.wait()
         self.close()
 
     def closeEvent(self, event):
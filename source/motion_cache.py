@@ -0,0 +1,180 @@
+﻿import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'vectorview', 'motion_fields')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+_video_hashes = {}  # (path, size, mtime) -> content hash, so a video is only hashed once per process
+
+
+def video_hash(video_path, chunk_size=1 << 20):
+    """
+    SHA-1 of a video file's content.
+
+    Input:
+    - video_path (str): Path to the video file
+    - chunk_size (int): Bytes read at a time
+
+    Returns:
+    - str: The hex digest
+    """
+    stat = os.stat(video_path)
+    file_id = (os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns)
+    if file_id not in _video_hashes:
+        digest = hashlib.sha1()
+        with open(video_path, 'rb') as video_file:
+            for chunk in iter(lambda: video_file.read(chunk_size), b''):
+                digest.update(chunk)
+        _video_hashes[file_id] = digest.hexdigest()
+    return _video_hashes[file_id]
+
+
+class MotionFieldCache:
+    """
+    On-disk cache of the motion fields of whole videos.
+
+    Every entry belongs to one video content hash and one set of search parameters, and holds two .npy
+    files opened as memory maps: the (num_frames, num_blocks_y, num_blocks_x, 2) motion vectors of every
+    frame against the previous one, int16 or float32 for sub-pixel fields, and the number of block
+    comparisons per frame, -1 for frames that were not computed yet. Frames can be filled in any order, so
+    seeking and partial playback are cached too. When the cache grows past max_bytes, the least recently
+    opened entries are deleted.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(video_path, parameters):
+        """
+        Cache key of a video and the parameters of its motion search.
+
+        Input:
+        - video_path (str): Path to the video file
+        - parameters (dict): Everything the motion fields depend on (algorithm, block size, radius, metric...)
+
+        Returns:
+        - str: The key, also the name of the entry's directory
+        """
+        description = json.dumps({'video': video_hash(video_path), **parameters}, sort_keys=True, default=str)
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def open(self, video_path, parameters, num_frames, grid_shape, dtype=np.int16):
+        """
+        Open the entry of a video and parameter set, creating it if needed.
+
+        Input:
+        - video_path (str): Path to the video file
+        - parameters (dict): Everything the motion fields depend on
+        - num_frames (int): Number of frames of the video
+        - grid_shape (tuple): (num_blocks_y, num_blocks_x) of the motion fields
+        - dtype (np.dtype): Type the vectors are stored as
+
+        Returns:
+        - MotionFieldEntry: The entry
+        """
+        entry_directory = os.path.join(self.directory, self.key(video_path, parameters))
+        vectors_path = os.path.join(entry_directory, 'vectors.npy')
+        evaluations_path = os.path.join(entry_directory, 'evaluations.npy')
+        vectors_shape = (num_frames,) + tuple(grid_shape) + (2,)
+
+        entry = None
+        if os.path.isdir(entry_directory):
+            try:
+                entry = MotionFieldEntry(np.load(vectors_path, mmap_mode='r+'),
+                                         np.load(evaluations_path, mmap_mode='r+'))
+                if entry.vectors.shape != vectors_shape or entry.vectors.dtype != dtype:
+                    entry = None
+            except (OSError, ValueError):
+                entry = None
+        if entry is None:
+            shutil.rmtree(entry_directory, ignore_errors=True)
+            os.makedirs(entry_directory)
+            with open(os.path.join(entry_directory, 'parameters.json'), 'w') as parameters_file:
+                json.dump({'video': os.path.abspath(video_path), **parameters}, parameters_file, indent=2,
+                          default=str)
+            vectors = np.lib.format.open_memmap(vectors_path, mode='w+', dtype=dtype, shape=vectors_shape)
+            evaluations = np.lib.format.open_memmap(evaluations_path, mode='w+', dtype=np.int64, shape=(num_frames,))
+            evaluations[:] = -1
+            entry = MotionFieldEntry(vectors, evaluations)
+
+        # The directory's modification time records when the entry was last used
+        os.utime(entry_directory)
+        self.evict(keep=entry_directory)
+        return entry
+
+    def size(self):
+        """Total size of the cached entries in bytes."""
+        return sum(size for _, _, size in self._entries())
+
+    def evict(self, keep=None):
+        """
+        Delete the least recently used entries until the cache fits in max_bytes.
+
+        Input:
+        - keep (str): Directory of an entry that must not be deleted, e.g. the one just opened
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for entry_directory, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            if entry_directory == keep:
+                continue
+            shutil.rmtree(entry_directory, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Delete every entry."""
+        for entry_directory, _, _ in self._entries():
+            shutil.rmtree(entry_directory, ignore_errors=True)
+
+    def _entries(self):
+        # (directory, last use, size in bytes) of every entry
+        entries = []
+        for name in os.listdir(self.directory):
+            entry_directory = os.path.join(self.directory, name)
+            if not os.path.isdir(entry_directory):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_directory, file_name))
+                       for file_name in os.listdir(entry_directory))
+            entries.append((entry_directory, os.path.getmtime(entry_directory), size))
+        return entries
+
+
+class MotionFieldEntry:
+    """The memory-mapped motion fields of one video and parameter set."""
+
+    def __init__(self, vectors, evaluations):
+        self.vectors = vectors
+        self.evaluations = evaluations
+
+    def get(self, frame_index):
+        """
+        Cached motion field of a frame against the previous one.
+
+        Returns:
+        - tuple: (motion_vectors, evaluations), or None if the frame was not computed yet
+        """
+        if not 0 <= frame_index < len(self.evaluations) or self.evaluations[frame_index] < 0:
+            return None
+        vectors = self.vectors[frame_index]
+        vectors = vectors.astype(int) if np.issubdtype(vectors.dtype, np.integer) else vectors.astype(np.float64)
+        return vectors, int(self.evaluations[frame_index])
+
+    def put(self, frame_index, motion_vectors, evaluations):
+        """Store the motion field of a frame; frames past the expected frame count are not cached."""
+        if not 0 <= frame_index < len(self.evaluations):
+            return
+        self.vectors[frame_index] = motion_vectors
+        self.evaluations[frame_index] = evaluations
+
+    def flush(self):
+        self.vectors.flush()
+        self.evaluations.flush()
@@ -0,0 +1,458 @@
+﻿import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+
+import cv2
+import numpy as np
+
+from source.frame_source import FrameSource
+from source.playback import PlaybackClock, QualityController
+from source.pyramid import pyramid_search
+from source.quadtree import DEFAULT_SPLIT_THRESHOLD, quadtree_search
+from source.roi import cropped_search, roi_block_mask
+from source.stage_timing import StageTimer
+from source.subpixel import subpixel_search
+from source.temporal import changed_blocks
+from source.vector_rendering import get_renderer
+
+
+class MotionPipeline:
+    """
+    Decode -> grayscale -> motion search -> draw pipeline of the motion estimation tab, without any Qt.
+
+    The GUI runs it on a QThread and turns the callbacks into signals; the command line runs it directly.
+    """
+
+    def __init__(self, video_path, algorithm, block_size=16, search_radius=8, similarity_metric="MAD", workers=1,
+                 queue_depth=None, pyramid_levels=1, static_threshold=0, temporal_seeding=False, motion_cache=None,
+                 frame_callback=None, progress_callback=None, draw_vectors=True, render_mode='arrows',
+                 realtime=False, adaptive=False, settings_callback=None, rois=None, subpixel=1,
+                 min_block_size=None, split_threshold=DEFAULT_SPLIT_THRESHOLD, frame_access=None):
+        self.video_path = video_path  # Path to the video file
+        self.block_size = block_size  # Block size for motion estimation algorithms
+        self.search_radius = search_radius  # Search area for motion estimation algorithms
+        self.prev_frame = None  # Previous frame for motion estimation
+        self.prev_motion_vectors = None  # Motion field of the previous frame pair, seeds the next search
+        self.running = True  # Flag to stop the run
+        self.algorithm = algorithm  # The motion estimation algorithm to use
+        self.base_algorithm = algorithm  # The algorithm before any pyramid wrapping, part of the cache key
+        self.pyramid_levels = pyramid_levels
+        if pyramid_levels > 1:
+            # Coarse-to-fine: the chosen algorithm searches the coarsest level, finer levels refine its vectors
+            self.algorithm = partial(pyramid_search, base_algorithm=algorithm, levels=pyramid_levels)
+        self.subpixel = subpixel  # Steps per pixel of the motion vectors: 1, 2 (half-pel) or 4 (quarter-pel)
+        if subpixel > 1:
+            # The integer vectors of the search are refined on an interpolated reference frame, and become float
+            self.algorithm = partial(subpixel_search, base_algorithm=self.algorithm, precision=subpixel)
+        # Variable block size: an exhaustive quadtree search splits block_size blocks down to min_block_size
+        # and emits QuadtreeLeaves instead of a grid, in place of the chosen algorithm
+        self.min_block_size = min_block_size
+        self.split_threshold = split_threshold
+        self.similarity_metric = similarity_metric  # The similarity metric to use, a key of METRICS
+        self.current_frame_index = 0  # Current frame index for resuming playback
+        self.workers = max(1, workers)  # Worker processes computing motion fields, 1 runs everything on this thread
+        self.queue_depth = max(1, queue_depth or 2 * self.workers)  # Frame pairs in flight in pipelined mode
+        # Decodes ahead on its own thread; the ring holds the frames in flight, the previous frame and a spare
+        ring_size = max(4, self.queue_depth + 2) if self.workers > 1 else 4
+        # Times decode and grayscale on the decode thread, and every later stage of the pipeline
+        self.timer = StageTimer()
+        # A shared FrameAccess serves frames decoded by earlier runs from its cache
+        self.frame_source = FrameSource(video_path, ring_size, timer=self.timer, frame_access=frame_access)
+        self.total_frames = self.frame_source.total_frames  # Total Amount of frames in the video, needed for progress
+        self.static_threshold = static_threshold  # Blocks whose mean frame difference is at most this are not searched
+        self.temporal_seeding = temporal_seeding  # Start each block's search from its previous motion vector
+        self.motion_cache = motion_cache  # MotionFieldCache reused across runs, None computes every field
+        self.cache_entry = None  # Entry of the current parameters, reopened when they change
+        self.cache_entry_parameters = None
+        self.frame_callback = frame_callback  # Called with every annotated frame, see emit_frame
+        self.progress_callback = progress_callback  # Called with (frames done, total frames)
+        self.draw_vectors = draw_vectors  # Draw the motion vectors on the frames handed to the callback
+        self.render_mode = render_mode  # How the motion vectors are drawn, a key of RENDERERS
+        self.frames_processed = 0
+        self.frames_dropped = 0  # Frames skipped by the playback clock because they were already late
+        self.prev_frame_index = None  # Index of prev_frame, motion fields across dropped frames are not cached
+        self.scale = 1  # Downsampling of the frames searched, block_size and search_radius stay full resolution
+        # Frames are paced at the video's frame rate and skipped when late, instead of emitted as fast as possible
+        self.clock = PlaybackClock(self.frame_source.fps) if realtime else None
+        self.quality = None  # Lowers the search settings while frames take longer than the frame budget
+        if adaptive:
+            # The quadtree searches full resolution frames, so its quality levels stop before downsampling
+            self.quality = QualityController(block_size, search_radius, 1.0 / (self.frame_source.fps or 25.0),
+                                             min_search_block=max(4, 2 << (pyramid_levels - 1)),
+                                             max_scale=1 if min_block_size else 4)
+        self.settings_callback = settings_callback  # Called with effective_settings() whenever they change
+        # (x, y, width, height) regions of interest in pixels; only the blocks they overlap are searched and
+        # drawn, an empty list searches the whole frame. The list may be replaced during playback.
+        self.rois = list(rois or [])
+
+    def run(self):
+        """Process the video from current_frame_index until its end or until stop() is called."""
+        self.frame_source.start(self.current_frame_index)
+        if self.clock is not None:
+            self.clock.start(self.current_frame_index)
+        try:
+            if self.workers > 1:
+                self.run_pipelined()
+            else:
+                self.run_serial()
+        finally:
+            self.frame_source.stop()
+            if self.cache_entry is not None:
+                self.cache_entry.flush()
+
+    def stop(self):
+        self.running = False
+
+    def effective_settings(self):
+        """
+        The settings the search actually runs with, which adaptive quality may lower.
+
+        Returns:
+            dict: block_size, search_radius, scale (downsampling factor) and frames_dropped.
+        """
+        return {'block_size': self.block_size, 'search_radius': self.search_radius, 'scale': self.scale,
+                'frames_dropped': self.frames_dropped}
+
+    def run_serial(self):
+        previous = None  # The last emitted frame, its gray image is the reference of the next search
+        while self.running:
+            start = time.perf_counter()
+            decoded = self.frame_source.read()
+            self.timer.add('wait', time.perf_counter() - start, start, decoded and decoded.index)
+            if decoded is None:
+                break
+            if self.drop_late_frame(decoded):
+                continue
+
+            try:
+                processing_start = time.perf_counter()
+                motion_vectors, evaluations = None, 0
+                if self.prev_frame is not None:
+                    start = time.perf_counter()
+                    motion_vectors, evaluations = self.calculate_motion_vectors(self.prev_frame, decoded.gray,
+                                                                                self.cache_index(decoded.index))
+                    self.timer.add('motion', time.perf_counter() - start, start, decoded.index)
+                self.emit_frame(decoded.color, decoded.gray, motion_vectors, evaluations, decoded.index,
+                                processing_start)
+
+            except Exception as e:
+                print(f"Error processing frame: {e}")
+                break
+
+            self.frame_source.release(previous)
+            previous = decoded
+
+    def drop_late_frame(self, decoded, has_reference=None):
+        """
+        Skip a frame that is already late on the playback clock, giving its slot straight back.
+
+        The first frame of a run is never dropped, it is the reference of the next search.
+
+        Input:
+            decoded (DecodedFrame): The frame just read from the frame source.
+            has_reference (bool): Whether a frame before it is kept as a reference; by default whether a frame
+                                  was emitted, pipelined mode passes whether one was submitted.
+
+        Returns:
+            bool: Whether the frame was dropped.
+        """
+        if has_reference is None:
+            has_reference = self.prev_frame is not None
+        if self.clock is None or not has_reference or not self.clock.is_late(decoded.index):
+            return False
+        self.frame_source.release(decoded)
+        self.frames_dropped += 1
+        self.current_frame_index = decoded.index + 1
+        if self.progress_callback is not None:
+            self.progress_callback(self.current_frame_index, self.total_frames)
+        return True
+
+    def cache_index(self, frame_index):
+        # Cached fields are against the frame right before, a field across dropped frames is neither
+        # looked up nor stored
+        return frame_index if self.prev_frame_index == frame_index - 1 else None
+
+    def adapt_quality(self, seconds):
+        """Feed the processing time of a frame to the quality controller and apply its settings."""
+        if self.quality is None or not self.quality.observe(seconds):
+            return
+        self.block_size, self.search_radius, self.scale = self.quality.settings
+        if self.settings_callback is not None:
+            self.settings_callback(self.effective_settings())
+
+    def run_pipelined(self):
+        """
+        Submit frame pairs from the frame source to a process pool that computes several motion fields at once.
+
+        At most queue_depth frames are in flight; they are drawn and emitted in decode order, so the output
+        is the same as run_serial's. Temporal seeding needs the previous motion field before the next search
+        can start, so it is not used in this mode, and neither is adaptive quality: the fields in flight were
+        searched with the settings of their submission. Late frames are dropped as they are read.
+        """
+        # (decoded, future, cached, cache_index) in decode order, future is None for the very first frame
+        pending = deque()
+        prev_gray, prev_index = self.prev_frame, self.prev_frame_index
+        previous = None  # The last emitted frame, still the reference of a pair in flight
+        executor = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            while self.running:
+                start = time.perf_counter()
+                decoded = self.frame_source.read()
+                self.timer.add('wait', time.perf_counter() - start, start, decoded and decoded.index)
+                if decoded is not None and self.drop_late_frame(decoded, has_reference=prev_gray is not None):
+                    continue
+                if decoded is not None:
+                    future, cached = None, None
+                    cache_index = decoded.index if prev_index == decoded.index - 1 else None
+                    if prev_gray is not None:
+                        cached = self.cached_motion_vectors(cache_index)
+                    if cached is not None:
+                        future = Future()
+                        future.set_result(cached)
+                    elif prev_gray is not None and self.min_block_size:
+                        future = executor.submit(quadtree_search, prev_gray, decoded.gray,
+                                                 **self.quadtree_options())
+                    elif prev_gray is not None:
+                        future = executor.submit(cropped_search, self.algorithm, prev_gray, decoded.gray,
+                                                 self.block_size, self.search_radius, self.similarity_metric,
+                                                 reach=self.search_reach(self.search_radius),
+                                                 **self.search_options(prev_gray, decoded.gray, seeded=False))
+                    pending.append((decoded, future, cached is not None, cache_index))
+                    prev_gray, prev_index = decoded.gray, decoded.index
+
+                # Emit the oldest pair once the queue is full, and drain everything at the end of the video
+                while pending and self.running and (len(pending) >= self.queue_depth or decoded is None):
+                    emitted, future, cached, cache_index = pending.popleft()
+                    motion_vectors, evaluations = None, 0
+                    if future is not None:
+                        # Only the wait for the result shows up here, the search itself runs in the pool
+                        start = time.perf_counter()
+                        try:
+                            motion_vectors, evaluations = future.result()
+                            if not cached:
+                                self.store_motion_vectors(cache_index, motion_vectors, evaluations)
+                        except Exception as e:
+                            print(f"Error in calculating motion vectors: {e}")
+                            motion_vectors = []
+                        self.timer.add('motion', time.perf_counter() - start, start, emitted.index)
+                    self.emit_frame(emitted.color, emitted.gray, motion_vectors, evaluations, emitted.index)
+                    self.frame_source.release(previous)
+                    previous = emitted
+
+                if decoded is None:
+                    break
+        except Exception as e:
+            print(f"Error processing frame: {e}")
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            if pending:
+                # Frames dropped after the ones still in flight moved the progress past them; a resume after a
+                # stop restarts from the first frame that was not emitted
+                self.current_frame_index = pending[0][0].index
+
+    def emit_frame(self, frame, gray, motion_vectors, evaluations, frame_index, processing_start=None):
+        """
+        Draw the motion vectors on a frame and hand it to the frame callback.
+
+        The callback is called as frame_callback(frame, frame_index, motion_vectors, evaluations) with the BGR
+        frame, which lives in the frame source's ring and must be copied to be kept. motion_vectors is None
+        for the first frame, and an empty list if the search failed. With a playback clock, the callback
+        waits until the frame is due. processing_start, the perf_counter() time the frame's processing began,
+        feeds adaptive quality.
+        """
+        if motion_vectors is not None:
+            if self.draw_vectors:
+                start = time.perf_counter()
+                frame = self.draw_motion_vectors(frame, motion_vectors)
+                self.timer.add('draw', time.perf_counter() - start, start, frame_index)
+            if isinstance(motion_vectors, np.ndarray):
+                self.prev_motion_vectors = motion_vectors
+        # Only frames that were actually emitted count, so resuming after a stop restarts from the right pair
+        self.prev_frame = gray
+        self.prev_frame_index = frame_index
+        if processing_start is not None:
+            self.adapt_quality(time.perf_counter() - processing_start)
+
+        if self.clock is not None:
+            start = time.perf_counter()
+            self.clock.wait(frame_index, lambda: self.running)
+            self.timer.add('pace', time.perf_counter() - start, start, frame_index)
+        if self.frame_callback is not None:
+            self.frame_callback(frame, frame_index, motion_vectors, evaluations)
+
+        # update progress bar
+        self.current_frame_index = frame_index + 1
+        self.frames_processed += 1
+        if self.progress_callback is not None:
+            self.progress_callback(self.current_frame_index, self.total_frames)
+
+    def calculate_motion_vectors(self, prev_frame, curr_frame, frame_index=None):
+        cached = self.cached_motion_vectors(frame_index)
+        if cached is not None:
+            return cached
+        try:
+            if self.min_block_size:
+                motion_vectors, evaluations = quadtree_search(prev_frame, curr_frame, **self.quadtree_options())
+            elif self.scale > 1:
+                motion_vectors, evaluations = self.downsampled_search(prev_frame, curr_frame)
+            else:
+                # Only the part of the frames the regions of interest can reach is searched
+                motion_vectors, evaluations = cropped_search(self.algorithm, prev_frame, curr_frame, self.block_size,
+                                                             self.search_radius, self.similarity_metric,
+                                                             reach=self.search_reach(self.search_radius),
+                                                             **self.search_options(prev_frame, curr_frame))
+        except Exception as e:
+            print(f"Error in calculating motion vectors: {e}")
+            return [], 0
+        self.store_motion_vectors(frame_index, motion_vectors, evaluations)
+        return motion_vectors, evaluations
+
+    def downsampled_search(self, prev_frame, curr_frame):
+        """
+        Search frames downsampled by self.scale, with the block size and radius scaled alike.
+
+        The motion field has the same grid as a full resolution search with self.block_size, and its vectors
+        are scaled back to full resolution pixels.
+        """
+        size = (prev_frame.shape[1] // self.scale, prev_frame.shape[0] // self.scale)
+        start = time.perf_counter()
+        prev_small = cv2.resize(prev_frame, size, interpolation=cv2.INTER_AREA)
+        curr_small = cv2.resize(curr_frame, size, interpolation=cv2.INTER_AREA)
+        self.timer.add('downsample', time.perf_counter() - start, start)
+        search_radius = max(1, self.search_radius // self.scale)
+        motion_vectors, evaluations = cropped_search(self.algorithm, prev_small, curr_small,
+                                                     self.block_size // self.scale, search_radius,
+                                                     self.similarity_metric, reach=self.search_reach(search_radius),
+                                                     **self.search_options(prev_small, curr_small))
+        return np.asarray(motion_vectors) * self.scale, evaluations
+
+    def quadtree_options(self):
+        """Keyword arguments of quadtree_search for the current settings, searching the regions of interest only."""
+        return {'block_size': self.block_size, 'search_radius': self.search_radius,
+                'similarity_metric': self.similarity_metric, 'min_block_size': self.min_block_size,
+                'split_threshold': self.split_threshold, 'return_evaluations': True, 'block_mask': self.roi_mask()}
+
+    def search_reach(self, search_radius):
+        # Farthest displacement a search can end at; a pyramid covers the radius at its coarsest level,
+        # plus the refinement of every finer level, and sub-pixel refinement adds less than a pixel
+        if self.pyramid_levels > 1:
+            search_radius = (search_radius + 1) << (self.pyramid_levels - 1)
+        return search_radius + (self.subpixel > 1)
+
+    def roi_mask(self):
+        """Blocks of the motion field grid that overlap a region of interest, None without regions."""
+        grid_shape = (self.frame_source.frame_height // self.block_size,
+                      self.frame_source.frame_width // self.block_size)
+        return roi_block_mask(self.rois, grid_shape, self.block_size)
+
+    def cache_parameters(self):
+        """
+        Everything the motion fields depend on besides the video, the key of the motion field cache.
+
+        Returns:
+            dict: The search parameters.
+        """
+        return {
+            'algorithm': f"{self.base_algorithm.__module__}.{self.base_algorithm.__qualname__}",
+            'block_size': self.block_size,
+            'search_radius': self.search_radius,
+            'similarity_metric': self.similarity_metric,
+            'pyramid_levels': self.pyramid_levels,
+            'static_threshold': self.static_threshold,
+            # Pipelined mode never seeds, so its fields are the unseeded ones
+            'temporal_seeding': self.temporal_seeding and self.workers == 1,
+            # Only searches on downsampled frames get the key, so the fields of full resolution runs keep theirs
+            **({'scale': self.scale} if self.scale > 1 else {}),
+            **({'rois': sorted(self.rois)} if self.rois else {}),
+            **({'subpixel': self.subpixel} if self.subpixel > 1 else {}),
+        }
+
+    def open_cache_entry(self):
+        # The similarity metric can change during playback, which moves the frames to another entry. Quadtree
+        # leaves are no grid, they are not cached
+        if self.motion_cache is None or self.min_block_size:
+            return None
+        parameters = self.cache_parameters()
+        if parameters != self.cache_entry_parameters:
+            if self.cache_entry is not None:
+                self.cache_entry.flush()
+            grid_shape = (self.frame_source.frame_height // self.block_size,
+                          self.frame_source.frame_width // self.block_size)
+            try:
+                dtype = np.float32 if self.subpixel > 1 else np.int16
+                self.cache_entry = self.motion_cache.open(self.video_path, parameters, self.total_frames, grid_shape,
+                                                          dtype)
+            except OSError as e:
+                print(f"Error opening the motion field cache: {e}")
+                self.cache_entry = None
+            self.cache_entry_parameters = parameters
+        return self.cache_entry
+
+    def cached_motion_vectors(self, frame_index):
+        """
+        Motion field of a frame against the previous one, if it is in the motion field cache.
+
+        Input:
+            frame_index (int): Index of the frame in the video.
+
+        Returns:
+            tuple: (motion_vectors, evaluations), or None if the field still has to be computed.
+        """
+        entry = self.open_cache_entry()
+        if entry is None or frame_index is None:
+            return None
+        return entry.get(frame_index)
+
+    def store_motion_vectors(self, frame_index, motion_vectors, evaluations):
+        entry = self.open_cache_entry()
+        if entry is not None and frame_index is not None and isinstance(motion_vectors, np.ndarray):
+            entry.put(frame_index, motion_vectors, evaluations)
+
+    def search_options(self, prev_frame, curr_frame, seeded=True):
+        """
+        Block mask and initial vectors for the next search.
+
+        Input:
+            prev_frame (np.ndarray): The grayscale frame the blocks are taken from, downsampled by self.scale.
+            curr_frame (np.ndarray): The grayscale frame the blocks are searched in, downsampled alike.
+            seeded (bool): Whether the previous motion field may seed the search.
+
+        Returns:
+            dict: Keyword arguments for the algorithm.
+        """
+        options = {}
+        block_size = self.block_size // self.scale
+        roi_mask = self.roi_mask()  # Downsampling by self.scale keeps the grid, and so the mask
+        if self.static_threshold > 0:
+            # Static blocks keep a zero vector without being searched
+            options['block_mask'] = changed_blocks(prev_frame, curr_frame, block_size, self.static_threshold,
+                                                   roi_mask)
+        elif roi_mask is not None:
+            options['block_mask'] = roi_mask
+        grid_shape = (prev_frame.shape[0] // block_size, prev_frame.shape[1] // block_size)
+        # A field of other settings (adaptive quality changed the block size) does not fit the grid
+        if seeded and self.temporal_seeding and self.prev_motion_vectors is not None \
+                and self.prev_motion_vectors.shape[:2] == grid_shape:
+            options['initial_vectors'] = self.prev_motion_vectors // self.scale
+        return options
+
+    def draw_motion_vectors(self, frame: np.ndarray, motion_vectors: np.ndarray):
+        """
+        Draw motion vectors on the frame with the renderer selected by render_mode.
+
+        Input:
+            frame (np.ndarray): The frame on which to draw the motion vectors. It should be a 3-channel image.
+            motion_vectors (np.ndarray): A 2D array of motion vectors. Each element is a tuple (dy, dx) representing
+                                         the displacement vector for each block, float with sub-pixel refinement.
+
+        Returns:
+            np.ndarray: The frame with motion vectors drawn on it.
+        """
+        try:
+            renderer = get_renderer(self.render_mode)
+            return renderer(frame, motion_vectors, self.block_size, self.search_radius, block_mask=self.roi_mask())
+        except Exception as e:
+            print(f"Error drawing motion vectors: {e}")
+            return frame
+
@@ -0,0 +1,74 @@
+﻿from source.similarity_metrics import get_metric
+
+
+class BlockMatcher:
+    """
+    Evaluates candidate displacements of one block at a time for the pattern-based searches.
+
+    Candidates outside the search window or the frame cost infinity. Every displacement is compared at
+    most once per block, and the number of comparisons is accumulated in `evaluations`.
+    """
+
+    def __init__(self, current_frame, reference_frame, block_size, search_radius, similarity_metric):
+        self.current_frame = current_frame
+        self.reference_frame = reference_frame
+        self.block_size = block_size
+        self.search_radius = search_radius
+        self.metric = get_metric(similarity_metric)
+        self.height, self.width = current_frame.shape
+        self.evaluations = 0
+        self.start_y = self.start_x = 0
+        self.current_block = None
+        self.costs = {}
+
+    def set_block(self, block_y, block_x):
+        self.start_y = block_y * self.block_size
+        self.start_x = block_x * self.block_size
+        self.current_block = self.current_frame[self.start_y:self.start_y + self.block_size,
+                                                self.start_x:self.start_x + self.block_size]
+        self.costs = {}
+
+    def clamp(self, offset):
+        """Move an offset inside the search window and the frame, e.g. a predicted vector."""
+        offset_y = min(max(offset[0], -self.search_radius, -self.start_y),
+                       self.search_radius, self.height - self.block_size - self.start_y)
+        offset_x = min(max(offset[1], -self.search_radius, -self.start_x),
+                       self.search_radius, self.width - self.block_size - self.start_x)
+        return int(offset_y), int(offset_x)
+
+    def cost(self, offset):
+        if offset in self.costs:
+            return self.costs[offset]
+
+        offset_y, offset_x = offset
+        ref_y = self.start_y + offset_y
+        ref_x = self.start_x + offset_x
+        if (abs(offset_y) > self.search_radius or abs(offset_x) > self.search_radius
+                or not (0 <= ref_y < self.height - self.block_size + 1)
+                or not (0 <= ref_x < self.width - self.block_size + 1)):
+            distance = float('inf')
+        else:
+            reference_block = self.reference_frame[ref_y:ref_y + self.block_size, ref_x:ref_x + self.block_size]
+            distance = self.metric(self.current_block, reference_block)
+            self.evaluations += 1
+
+        self.costs[offset] = distance
+        return distance
+
+    def best_of(self, center, pattern):
+        """Best of the center and the pattern points around it; the center wins ties."""
+        best, best_distance = center, self.cost(center)
+        for step_y, step_x in pattern:
+            candidate = (center[0] + step_y, center[1] + step_x)
+            distance = self.cost(candidate)
+            if distance < best_distance:
+                best, best_distance = candidate, distance
+        return best
+
+    def descend(self, center, pattern):
+        """Move the pattern to its best point until the center is the best point."""
+        while True:
+            best = self.best_of(center, pattern)
+            if best == center:
+                return center
+            center = best
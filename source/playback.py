@@ -0,0 +1,153 @@
+﻿import time
+
+DEFAULT_FPS = 25.0  # Frame rate assumed when the container does not tell
+
+
+class PlaybackClock:
+    """
+    Wall clock of a playback at the video's frame rate.
+
+    Frame i is due frame_period * (i - first frame) seconds after start(). A consumer waits for a frame's due
+    time before showing it, so fast settings do not play too fast, and skips frames that are already late,
+    so slow settings stay in sync instead of falling further and further behind.
+    """
+
+    def __init__(self, fps, late_frames=1.0):
+        self.fps = fps if fps and fps > 0 else DEFAULT_FPS
+        self.frame_period = 1.0 / self.fps
+        self.late_frames = late_frames  # How many frame periods late a frame may be before it is dropped
+        self.origin = None
+        self.first_frame = 0
+
+    def start(self, frame_index=0):
+        """Make frame_index due now, e.g. when playback starts or resumes."""
+        self.origin = time.perf_counter()
+        self.first_frame = frame_index
+
+    def due(self, frame_index):
+        """perf_counter() time at which a frame should be shown."""
+        return self.origin + (frame_index - self.first_frame) * self.frame_period
+
+    def lateness(self, frame_index):
+        """Seconds since the frame was due, negative while it is early."""
+        return time.perf_counter() - self.due(frame_index)
+
+    def is_late(self, frame_index):
+        return self.lateness(frame_index) > self.late_frames * self.frame_period
+
+    def wait(self, frame_index, keep_waiting=lambda: True, poll_seconds=0.05):
+        """
+        Sleep until a frame is due.
+
+        Input:
+        - frame_index (int): Index of the frame about to be shown
+        - keep_waiting (callable): Checked at least every poll_seconds, the wait ends early once it returns False
+        - poll_seconds (float): Longest single sleep
+        """
+        while keep_waiting():
+            remaining = self.due(frame_index) - time.perf_counter()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, poll_seconds))
+
+
+def quality_levels(block_size, search_radius, max_block_size=64, max_scale=4, min_search_block=4):
+    """
+    Search settings from the requested quality down to the cheapest, in the order they are given up.
+
+    The search radius is halved down to 2 first, then the block size is doubled up to max_block_size, then
+    the frames are downsampled by 2 up to max_scale. Block size and radius are always full resolution
+    pixels; a search at scale s uses block_size // s and search_radius // s on frames s times smaller, so
+    the searched radius stays the same and the motion field keeps its grid.
+
+    Input:
+    - block_size (int): The requested block size
+    - search_radius (int): The requested search radius
+    - max_block_size (int): Largest block size to fall back to
+    - max_scale (int): Largest downsampling factor
+    - min_search_block (int): Smallest block the downsampled search may use
+
+    Returns:
+    - list: (block_size, search_radius, scale) tuples, best quality first
+    """
+    levels = [(block_size, search_radius, 1)]
+    radius = search_radius
+    while radius > 2:
+        radius = max(2, radius // 2)
+        levels.append((block_size, radius, 1))
+    size = block_size
+    while size * 2 <= max_block_size:
+        size *= 2
+        levels.append((size, radius, 1))
+    scale = 1
+    while scale * 2 <= max_scale and size % (scale * 2) == 0 and size // (scale * 2) >= min_search_block:
+        scale *= 2
+        levels.append((size, radius * scale, scale))
+    return levels
+
+
+class QualityController:
+    """
+    Picks the search settings from quality_levels() that fit the frame budget.
+
+    The processing time of every frame is smoothed with an exponential moving average. Once it stays above
+    high_water of the budget, the controller gives up one level of quality; once it stays below low_water, it
+    takes one level back, unless that level was measured over budget in the last `memory` frames. Quality is
+    given up after `degrade_patience` frames at a level and taken back after `restore_patience`: a frame
+    over budget costs dropped frames right away, while restoring too early only makes the settings swing.
+    """
+
+    def __init__(self, block_size, search_radius, frame_budget, high_water=0.9, low_water=0.5, smoothing=0.3,
+                 degrade_patience=2, restore_patience=10, memory=300, **level_options):
+        self.levels = quality_levels(block_size, search_radius, **level_options)
+        self.level = 0
+        self.frame_budget = frame_budget
+        self.high_water = high_water
+        self.low_water = low_water
+        self.smoothing = smoothing
+        self.degrade_patience = degrade_patience
+        self.restore_patience = restore_patience
+        self.memory = memory
+        self.average = None  # Smoothed seconds per frame at the current level
+        self.frames_at_level = 0
+        self.frames_observed = 0
+        self.level_seconds = {}  # level -> (smoothed seconds per frame, frames_observed when measured)
+
+    @property
+    def settings(self):
+        """(block_size, search_radius, scale) of the current level."""
+        return self.levels[self.level]
+
+    def observe(self, seconds):
+        """
+        Account for the processing time of one frame.
+
+        Returns:
+        - bool: Whether the level changed, i.e. the next frame must use the new settings
+        """
+        self.frames_observed += 1
+        self.frames_at_level += 1
+        if self.average is None:
+            self.average = seconds
+        else:
+            self.average += self.smoothing * (seconds - self.average)
+        if self.frames_at_level < self.degrade_patience:
+            return False
+        self.level_seconds[self.level] = (self.average, self.frames_observed)
+
+        if self.average > self.high_water * self.frame_budget and self.level < len(self.levels) - 1:
+            return self._move(1)
+        if self.frames_at_level < self.restore_patience:
+            return False
+        if self.average < self.low_water * self.frame_budget and self.level > 0:
+            finer_seconds, measured_at = self.level_seconds.get(self.level - 1, (0.0, 0))
+            if finer_seconds <= self.high_water * self.frame_budget \
+                    or self.frames_observed - measured_at > self.memory:
+                return self._move(-1)
+        return False
+
+    def _move(self, step):
+        self.level += step
+        self.average = None
+        self.frames_at_level = 0
+        return True
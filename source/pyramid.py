@@ -0,0 +1,179 @@
+﻿import cv2
+import numpy as np
+
+from source.similarity_metrics import get_metric
+from source.threestepsearch import tss_search_batched
+
+
+def check_pyramid_levels(block_size, levels):
+    """
+    Check that a block size can be halved levels - 1 times, down to blocks of at least 2 pixels.
+
+    Raises:
+    - ValueError: If it cannot
+    """
+    if levels < 1 or block_size % (1 << (levels - 1)) or block_size >> (levels - 1) < 2:
+        raise ValueError(f"A block size of {block_size} cannot be split over {levels} pyramid levels.")
+
+
+def pyramid_search(current_frame, reference_frame, block_size=16, search_radius=8, similarity_metric='MAD', levels=3,
+                   base_algorithm=tss_search_batched, refine_radius=1, workers=None, executor=None,
+                   return_evaluations=False, block_mask=None, initial_vectors=None):
+    """
+    Hierarchical coarse-to-fine motion estimation.
+
+    Both frames are downsampled levels - 1 times with cv2.pyrDown. The base algorithm searches the coarsest
+    level with the full search radius, using blocks scaled down by the same factor so the block grid is the
+    same at every level. Each finer level doubles the vectors of the level below and refines them with an
+    exhaustive search of radius refine_radius around them. A search radius r at the coarsest level covers
+    displacements of about r * 2 ** (levels - 1) pixels at full resolution.
+
+    Input:
+    - current_frame (np.array): The current frame
+    - reference_frame (np.array): The reference frame
+    - block_size (int): The size of the block at full resolution
+    - search_radius (int): The search radius of the base algorithm at the coarsest level
+    - similarity_metric (str): Name of a metric in similarity_metrics.METRICS
+    - levels (int): Number of pyramid levels, 1 runs the base algorithm on the frames directly
+    - base_algorithm (callable): Any motion estimation algorithm of the project
+    - refine_radius (int): Search radius of the refinement at the finer levels
+    - workers (int): Passed on to the base algorithm
+    - executor (concurrent.futures.Executor): Passed on to the base algorithm
+    - return_evaluations (bool): Also return the number of block comparisons
+    - block_mask (np.array): Boolean (num_blocks_y, num_blocks_x) array; only blocks set to True are searched
+        at any level, the others keep a zero vector
+    - initial_vectors (np.array): (num_blocks_y, num_blocks_x, 2) full resolution vectors, scaled down to
+        seed the base algorithm at the coarsest level
+
+    Returns:
+    - np.array: A 3D numpy array containing the motion vectors for each block.
+        The third dimension contains the y and x offsets.
+    - int: The number of block comparisons, only if return_evaluations is set
+
+    Raises:
+    - ValueError: If the block size cannot be split over the levels, see check_pyramid_levels.
+    """
+    if current_frame.shape != reference_frame.shape:
+        raise ValueError("The current frame and reference frame must have the same shape.")
+    check_pyramid_levels(block_size, levels)
+
+    num_blocks_y = current_frame.shape[0] // block_size
+    num_blocks_x = current_frame.shape[1] // block_size
+
+    current_pyramid = [current_frame]
+    reference_pyramid = [reference_frame]
+    for _ in range(levels - 1):
+        current_pyramid.append(_pyr_down(current_pyramid[-1]))
+        reference_pyramid.append(_pyr_down(reference_pyramid[-1]))
+
+    # The coarsest level can hold a few more blocks than the full resolution grid; they are not searched
+    coarse_block_size = block_size >> (levels - 1)
+    coarse_shape = (current_pyramid[-1].shape[0] // coarse_block_size,
+                    current_pyramid[-1].shape[1] // coarse_block_size)
+    coarse_mask = None
+    if block_mask is not None or coarse_shape != (num_blocks_y, num_blocks_x):
+        coarse_mask = np.zeros(coarse_shape, dtype=bool)
+        coarse_mask[:num_blocks_y, :num_blocks_x] = True if block_mask is None else block_mask
+    coarse_initial_vectors = None
+    if initial_vectors is not None:
+        coarse_initial_vectors = np.zeros(coarse_shape + (2,), dtype=int)
+        coarse_initial_vectors[:num_blocks_y, :num_blocks_x] = np.round(
+            np.asarray(initial_vectors) / 2 ** (levels - 1))
+
+    motion_vectors, evaluations = base_algorithm(current_pyramid[-1], reference_pyramid[-1], coarse_block_size,
+                                                 search_radius, similarity_metric, workers=workers,
+                                                 executor=executor, return_evaluations=True,
+                                                 block_mask=coarse_mask, initial_vectors=coarse_initial_vectors)
+    motion_vectors = motion_vectors[:num_blocks_y, :num_blocks_x]
+
+    for level in range(levels - 2, -1, -1):
+        motion_vectors, level_evaluations = refine_vectors(current_pyramid[level], reference_pyramid[level],
+                                                           motion_vectors * 2, block_size >> level, refine_radius,
+                                                           similarity_metric, block_mask)
+        evaluations += level_evaluations
+
+    motion_vectors = np.ascontiguousarray(motion_vectors, dtype=int)
+    if return_evaluations:
+        return motion_vectors, evaluations
+    return motion_vectors
+
+
+def _pyr_down(frame):
+    # pyrDown does not take every integer type, those go through float32 and back to the frame's type
+    if frame.dtype == np.uint8:
+        return cv2.pyrDown(frame)
+    return np.round(cv2.pyrDown(frame.astype(np.float32))).astype(frame.dtype)
+
+
+def refine_vectors(current_frame, reference_frame, predicted_vectors, block_size, refine_radius=1,
+                   similarity_metric='MAD', block_mask=None):
+    """
+    Exhaustive search of a small window around a predicted vector for every block.
+
+    Predictions are first clamped so the predicted block lies inside the frame. The prediction itself is
+    compared first and wins ties; the other displacements follow in raster order.
+
+    Input:
+    - current_frame (np.array): The current frame
+    - reference_frame (np.array): The reference frame
+    - predicted_vectors (np.array): A (num_blocks_y, num_blocks_x, 2) array of predicted vectors
+    - block_size (int): The size of the block
+    - refine_radius (int): The search radius around the predicted vectors
+    - similarity_metric (str): Name of a metric in similarity_metrics.METRICS
+    - block_mask (np.array): Boolean (num_blocks_y, num_blocks_x) array; only blocks set to True are searched,
+        the others get a zero vector
+
+    Returns:
+    - np.array: The refined (num_blocks_y, num_blocks_x, 2) motion vectors
+    - int: The number of block comparisons
+    """
+    metric = get_metric(similarity_metric)
+
+    height, width = current_frame.shape
+    num_blocks_y, num_blocks_x, _ = predicted_vectors.shape
+    if num_blocks_y == 0 or num_blocks_x == 0:
+        return np.zeros((num_blocks_y, num_blocks_x, 2), dtype=int), 0
+
+    current_blocks = current_frame[:num_blocks_y * block_size, :num_blocks_x * block_size] \
+        .reshape(num_blocks_y, block_size, num_blocks_x, block_size) \
+        .swapaxes(1, 2) \
+        .reshape(-1, block_size, block_size)
+    reference_windows = np.lib.stride_tricks.sliding_window_view(reference_frame, (block_size, block_size))
+
+    start_y = np.repeat(np.arange(num_blocks_y) * block_size, num_blocks_x)
+    start_x = np.tile(np.arange(num_blocks_x) * block_size, num_blocks_y)
+    predicted_vectors = predicted_vectors.reshape(-1, 2)
+
+    # Keep only the blocks to search
+    searched = np.ones(len(current_blocks), dtype=bool) if block_mask is None else block_mask.ravel()
+    current_blocks, start_y, start_x = current_blocks[searched], start_y[searched], start_x[searched]
+    center_y = np.clip(start_y + predicted_vectors[searched, 0], 0, height - block_size)
+    center_x = np.clip(start_x + predicted_vectors[searched, 1], 0, width - block_size)
+
+    offsets = [(0, 0)] + [(offset_y, offset_x)
+                          for offset_y in range(-refine_radius, refine_radius + 1)
+                          for offset_x in range(-refine_radius, refine_radius + 1)
+                          if (offset_y, offset_x) != (0, 0)]
+
+    min_distance = np.full(len(current_blocks), np.inf)
+    best_y, best_x = center_y.copy(), center_x.copy()
+    evaluations = 0
+    for offset_y, offset_x in offsets:
+        ref_y = center_y + offset_y
+        ref_x = center_x + offset_x
+        in_bounds = (0 <= ref_y) & (ref_y <= height - block_size) & (0 <= ref_x) & (ref_x <= width - block_size)
+        evaluations += int(in_bounds.sum())
+
+        candidate_blocks = reference_windows[np.clip(ref_y, 0, height - block_size),
+                                             np.clip(ref_x, 0, width - block_size)]
+        distances = metric(current_blocks, candidate_blocks)
+
+        improved = in_bounds & (distances < min_distance)
+        min_distance = np.where(improved, distances, min_distance)
+        best_y = np.where(improved, ref_y, best_y)
+        best_x = np.where(improved, ref_x, best_x)
+
+    refined_vectors = np.zeros((num_blocks_y * num_blocks_x, 2), dtype=int)
+    refined_vectors[searched, 0] = best_y - start_y
+    refined_vectors[searched, 1] = best_x - start_x
+    return refined_vectors.reshape(num_blocks_y, num_blocks_x, 2), evaluations
@@ -0,0 +1,225 @@
+﻿from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from source.roi import mask_bounds
+from source.similarity_metrics import HADAMARD_4
+
+# Variable block size motion field: one entry per leaf of the quadtrees, the blocks of the largest size being
+# the roots. positions are the (y, x) top left pixels of the leaves, sizes their sizes in pixels and vectors
+# their (dy, dx) motion vectors; leaves are ordered from the largest size down.
+QuadtreeLeaves = namedtuple('QuadtreeLeaves', ['positions', 'sizes', 'vectors'])
+
+# Mean cost per pixel a split has to save, in the units of the similarity metric
+DEFAULT_SPLIT_THRESHOLD = 1.0
+
+
+def _absolute_difference(current, reference):
+    if current.dtype == np.uint8 and reference.dtype == np.uint8:
+        return cv2.absdiff(current, reference).astype(np.float32)
+    return np.abs(current.astype(np.float32) - reference.astype(np.float32))
+
+
+def _block_sums(pixel_costs, block_size):
+    # Area interpolation averages whole blocks exactly; the sums are rounded back to whole numbers
+    height, width = pixel_costs.shape
+    means = cv2.resize(pixel_costs, (width // block_size, height // block_size), interpolation=cv2.INTER_AREA)
+    return np.rint(means.astype(np.float64) * (block_size * block_size))
+
+
+def _sad_costs(current, reference, block_size):
+    return _block_sums(_absolute_difference(current, reference), block_size)
+
+
+def _ssd_costs(current, reference, block_size):
+    return _block_sums(np.square(_absolute_difference(current, reference)), block_size)
+
+
+def _satd_costs(current, reference, block_size):
+    # The 4x4 Hadamard transform of every sub-block of the difference, as in similarity_metrics.satd, done
+    # for the whole difference image with one product per direction
+    if block_size % 4:
+        raise ValueError("SATD needs a block size that is a multiple of 4.")
+    difference = current.astype(np.float32) - reference.astype(np.float32)
+    height, width = difference.shape
+    hadamard = HADAMARD_4.astype(np.float32)
+    rows = (difference.reshape(-1, 4) @ hadamard).reshape(height // 4, 4, width)
+    transformed = np.matmul(hadamard, rows).reshape(height, width)
+    return _block_sums(np.abs(transformed), block_size)
+
+
+# Metrics whose cost over a block is the sum of the costs of its quarters, so they can be summed up from
+# the smallest blocks: cost(current_pixels, reference_pixels, block_size) -> cost of every block. MAD is
+# ranked by the SAD, as the split threshold is per pixel anyway. SATD is summed over 4x4 sub-blocks, so
+# the smallest block must be a multiple of 4.
+ADDITIVE_METRICS = {
+    'MAD': _sad_costs,
+    'SAD': _sad_costs,
+    'SSD': _ssd_costs,
+    'SATD': _satd_costs,
+}
+
+
+def check_quadtree_settings(block_size, min_block_size, similarity_metric):
+    """
+    Check that variable block sizes can split block_size blocks down to min_block_size with a similarity metric.
+
+    Input:
+    - block_size (int): The size of the largest blocks
+    - min_block_size (int): The size of the smallest blocks
+    - similarity_metric (str): A key of similarity_metrics.METRICS
+
+    Raises:
+    - ValueError: If the metric is not additive, block_size is no power of two multiple of min_block_size, or
+      SATD gets a min_block_size that is no multiple of 4
+    """
+    if similarity_metric not in ADDITIVE_METRICS:
+        raise ValueError(f"Variable block sizes need an additive similarity metric. Use one of: "
+                         f"{', '.join(ADDITIVE_METRICS)}.")
+    if min_block_size < 1 or block_size % min_block_size \
+            or (block_size // min_block_size) & (block_size // min_block_size - 1):
+        raise ValueError("The block size must be a power of two multiple of the smallest block size.")
+    if similarity_metric == 'SATD' and min_block_size % 4:
+        raise ValueError("SATD needs a smallest block size that is a multiple of 4.")
+
+
+def _sum_quarters(costs):
+    # Cost of every block of twice the size, from the costs of its four quarters
+    num_blocks_y, num_blocks_x = costs.shape
+    return costs.reshape(num_blocks_y // 2, 2, num_blocks_x // 2, 2).sum(axis=(1, 3))
+
+
+def quadtree_search(current_frame, reference_frame, block_size=16, search_radius=8, similarity_metric='SAD',
+                    min_block_size=4, split_threshold=DEFAULT_SPLIT_THRESHOLD, return_evaluations=False,
+                    block_mask=None):
+    """
+    Exhaustive motion search with variable block sizes, from block_size down to min_block_size.
+
+    The cost of every candidate offset is computed once per block of the smallest size, and summed up into
+    the costs of the blocks of twice the size, and so on up to block_size, without comparing any pixel
+    again. Every block keeps its best offset at every size. A block is then split into its four quarters
+    when their best partitions cost less than the block's own best match by more than split_threshold per
+    pixel, bottom up, so the leaves follow the motion boundaries while uniform regions stay in large blocks.
+
+    Input:
+    - current_frame (np.array): The current frame
+    - reference_frame (np.array): The reference frame
+    - block_size (int): The size of the largest blocks, the roots of the quadtrees
+    - search_radius (int): The search radius
+    - similarity_metric (str): A key of ADDITIVE_METRICS
+    - min_block_size (int): The size of the smallest blocks; block_size must be a power of two multiple of it
+    - split_threshold (float): Mean cost per pixel a split has to save
+    - return_evaluations (bool): Also return the number of block comparisons, at the smallest block size
+    - block_mask (np.array): Boolean (num_blocks_y, num_blocks_x) array of the roots to search, at block_size
+
+    Returns:
+    - QuadtreeLeaves: The leaves of the roots that were searched
+    - int: The number of block comparisons, only if return_evaluations is set
+
+    Raises:
+    - ValueError: If the settings do not pass check_quadtree_settings
+    """
+    check_quadtree_settings(block_size, min_block_size, similarity_metric)
+    block_costs = ADDITIVE_METRICS[similarity_metric]
+    # Sizes min_block_size << level, for level in range(num_levels)
+    num_levels = (block_size // min_block_size).bit_length()
+
+    height, width = current_frame.shape
+    num_blocks_y, num_blocks_x = height // block_size, width // block_size
+    if block_mask is None:
+        block_mask = np.ones((num_blocks_y, num_blocks_x), dtype=bool)
+    bounds = mask_bounds(block_mask)
+    empty = QuadtreeLeaves(np.zeros((0, 2), dtype=int), np.zeros(0, dtype=int), np.zeros((0, 2), dtype=int))
+    if bounds is None:
+        return (empty, 0) if return_evaluations else empty
+
+    # Only the roots within the bounds of the mask are searched
+    row_start, row_end, col_start, col_end = bounds
+    y_start, x_start = row_start * block_size, col_start * block_size
+    y_end, x_end = row_end * block_size, col_end * block_size
+    current_region = current_frame[y_start:y_end, x_start:x_end]
+    grid_y, grid_x = (y_end - y_start) // min_block_size, (x_end - x_start) // min_block_size
+    block_y = y_start + np.arange(grid_y) * min_block_size  # Pixel rows and columns of the smallest blocks
+    block_x = x_start + np.arange(grid_x) * min_block_size
+
+    best_costs = [np.full((grid_y >> level, grid_x >> level), np.inf) for level in range(num_levels)]
+    best_vectors = [np.zeros((grid_y >> level, grid_x >> level, 2), dtype=int) for level in range(num_levels)]
+    evaluations = 0
+
+    # Shorter offsets first, so they win ties
+    offsets = [(dy, dx) for dy in range(-search_radius, search_radius + 1)
+               for dx in range(-search_radius, search_radius + 1)]
+    offsets.sort(key=lambda offset: offset[0] ** 2 + offset[1] ** 2)
+    for dy, dx in offsets:
+        # The smallest blocks whose candidate lies within the reference frame form a rectangle of the grid
+        rows = np.flatnonzero((block_y + dy >= 0) & (block_y + dy + min_block_size <= height))
+        cols = np.flatnonzero((block_x + dx >= 0) & (block_x + dx + min_block_size <= width))
+        costs = np.full((grid_y, grid_x), np.inf)
+        if len(rows) and len(cols):
+            top, bottom = rows[0] * min_block_size, (rows[-1] + 1) * min_block_size
+            left, right = cols[0] * min_block_size, (cols[-1] + 1) * min_block_size
+            candidates = reference_frame[y_start + top + dy:y_start + bottom + dy,
+                                         x_start + left + dx:x_start + right + dx]
+            costs[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1] = block_costs(current_region[top:bottom, left:right],
+                                                                           candidates, min_block_size)
+            evaluations += len(rows) * len(cols)
+
+        # Larger blocks reuse the costs of their quarters; a candidate outside the frame stays infinite
+        for level in range(num_levels):
+            if level:
+                costs = _sum_quarters(costs)
+            better = costs < best_costs[level]
+            best_costs[level][better] = costs[better]
+            best_vectors[level][better] = (dy, dx)
+
+    # Bottom up, the cheapest partition of every block: itself, or its quarters' partitions plus the threshold
+    splits = [np.zeros_like(best_costs[0], dtype=bool)]
+    partition_costs = best_costs[0]
+    for level in range(1, num_levels):
+        size = min_block_size << level
+        quarters_cost = _sum_quarters(partition_costs)
+        split = quarters_cost + split_threshold * size * size < best_costs[level]
+        splits.append(split)
+        partition_costs = np.where(split, quarters_cost, best_costs[level])
+
+    # Top down, the leaves of the masked roots
+    positions, sizes, vectors = [], [], []
+    active = block_mask[row_start:row_end, col_start:col_end]
+    for level in reversed(range(num_levels)):
+        size = min_block_size << level
+        leaves = active & ~splits[level]
+        rows, cols = np.nonzero(leaves)
+        positions.append(np.stack([y_start + rows * size, x_start + cols * size], axis=-1))
+        sizes.append(np.full(len(rows), size))
+        vectors.append(best_vectors[level][leaves])
+        active = np.repeat(np.repeat(active & splits[level], 2, axis=0), 2, axis=1)
+
+    result = QuadtreeLeaves(np.concatenate(positions), np.concatenate(sizes), np.concatenate(vectors))
+    return (result, evaluations) if return_evaluations else result
+
+
+def leaf_centers(leaves):
+    """(x, y) pixel center of every leaf, shape (num_leaves, 2), as block_centers gives for a grid."""
+    return leaves.positions[:, ::-1] + (leaves.sizes // 2)[:, None]
+
+
+def leaves_to_field(leaves, grid_shape, block_size):
+    """
+    Fixed grid motion field covered by quadtree leaves, e.g. to colour it or compare it with a grid search.
+
+    Input:
+    - leaves (QuadtreeLeaves): The leaves, whose sizes are multiples of block_size
+    - grid_shape (tuple): (num_blocks_y, num_blocks_x) of the field
+    - block_size (int): The size of the blocks of the field
+
+    Returns:
+    - np.array: The (num_blocks_y, num_blocks_x, 2) motion vectors, every block taking its leaf's vector
+    - np.array: Boolean (num_blocks_y, num_blocks_x) array of the blocks covered by a leaf
+    """
+    motion_vectors = np.zeros(tuple(grid_shape) + (2,), dtype=leaves.vectors.dtype)
+    covered = np.zeros(grid_shape, dtype=bool)
+    for (y, x), size, vector in zip(leaves.positions // block_size, leaves.sizes // block_size, leaves.vectors):
+        motion_vectors[y:y + size, x:x + size] = vector
+        covered[y:y + size, x:x + size] = True
+    return motion_vectors, covered
@@ -0,0 +1,165 @@
+﻿import cv2
+import numpy as np
+
+# Search windows tried in turn when the target is lost, as multiples of the last known box around its
+# center; None is the whole frame
+DEFAULT_WINDOW_SCALES = (2, 4, None)
+
+
+def expanded_box(bbox, scale, frame_shape, margin=0):
+    """
+    Box grown around its center and clipped to the frame.
+
+    Input:
+    - bbox (tuple): (x, y, width, height)
+    - scale (float): Size of the result as a multiple of the box, None for the whole frame
+    - frame_shape (tuple): (height, width, ...) of the frame
+    - margin (int): Pixels added on every side after scaling
+
+    Returns:
+    - tuple: (x, y, width, height) of the window, in whole pixels
+    """
+    frame_height, frame_width = frame_shape[:2]
+    if scale is None:
+        return 0, 0, frame_width, frame_height
+    x, y, width, height = bbox
+    center_x, center_y = x + width / 2, y + height / 2
+    half_width, half_height = width * scale / 2 + margin, height * scale / 2 + margin
+    left, top = max(0, int(center_x - half_width)), max(0, int(center_y - half_height))
+    right = min(frame_width, int(np.ceil(center_x + half_width)))
+    bottom = min(frame_height, int(np.ceil(center_y + half_height)))
+    return left, top, max(0, right - left), max(0, bottom - top)
+
+
+def features_in_window(points, descriptors, window):
+    """The keypoint positions and descriptors that lie inside an (x, y, width, height) window."""
+    if descriptors is None:
+        return points, None
+    x, y, width, height = window
+    inside = (points[:, 0] >= x) & (points[:, 0] < x + width) & (points[:, 1] >= y) & (points[:, 1] < y + height)
+    return points[inside], descriptors[inside]
+
+
+class OrbReacquisition:
+    """
+    Finds a lost target again by matching ORB features of the target against the frame.
+
+    The model is computed once per target, from the keypoints detected inside its box only, so matches
+    are not wasted on the background. When the target is lost, features are detected in windows of
+    growing size around its last known box, and the whole frame only comes last. The matcher is created
+    once, and only the top_k best matches are selected, with a partial sort, to fit the homography that
+    maps the model box to the frame.
+    """
+
+    def __init__(self, orb=None, top_k=10, window_scales=DEFAULT_WINDOW_SCALES):
+        # ORB (ORiented BRIEF: uses FAST for keypoints behind the scenes)
+        self.orb = orb if orb is not None else cv2.ORB_create()
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+        self.top_k = top_k  # Matches the homography is fitted to
+        self.window_scales = window_scales
+        self.model_bbox = None
+        self.model_points = None  # (num_keypoints, 2) pixel positions of the model keypoints
+        self.model_descriptors = None
+
+    def detect(self, frame, window, mask_box=None):
+        """
+        Keypoints and descriptors of a frame region.
+
+        Input:
+        - frame (np.array): The frame
+        - window (tuple): (x, y, width, height) of the region to detect in
+        - mask_box (tuple): (x, y, width, height) keypoints must lie in, the whole window if None
+
+        Returns:
+        - np.array: The (num_keypoints, 2) positions of the keypoints in frame pixels
+        - np.array: Their descriptors, None without keypoints
+        """
+        x, y, width, height = window
+        region = frame[y:y + height, x:x + width]
+        mask = None
+        if mask_box is not None:
+            mask = np.zeros(region.shape[:2], dtype=np.uint8)
+            left, top = int(mask_box[0]) - x, int(mask_box[1]) - y
+            right, bottom = left + int(mask_box[2]), top + int(mask_box[3])
+            mask[max(0, top):max(0, bottom), max(0, left):max(0, right)] = 255
+        keypoints, descriptors = self.orb.detectAndCompute(region, mask)
+        points = np.float32([keypoint.pt for keypoint in keypoints]).reshape(-1, 2) + (x, y)
+        return points, descriptors
+
+    def set_model(self, frame, bbox):
+        """
+        Compute the model of a target from its box.
+
+        ORB needs a border around every keypoint, so the region is grown by the detector's edge threshold and
+        masked back to the box: keypoints are the ones a mask on the whole frame gives, without detecting
+        anywhere else.
+
+        Returns:
+        - int: The number of model keypoints
+        """
+        self.model_bbox = tuple(bbox)
+        window = expanded_box(bbox, 1, frame.shape, margin=self.orb.getEdgeThreshold())
+        self.model_points, self.model_descriptors = self.detect(frame, window, mask_box=bbox)
+        return len(self.model_points)
+
+    def reacquire(self, frame, last_bbox, features=None):
+        """
+        Look for the target around its last known box, in growing windows.
+
+        Input:
+        - frame (np.array): The frame the target was lost in
+        - last_bbox (tuple): (x, y, width, height) of the target when it was last seen
+        - features (tuple): (points, descriptors) detect() gave for the whole frame, shared by several targets
+            lost in the same frame; every window then keeps the features inside it instead of detecting again
+
+        Returns:
+        - tuple: The (x, y, width, height) box of the target, None if it was not found
+        """
+        if self.model_descriptors is None or len(self.model_descriptors) < self.top_k:
+            return None
+        margin = self.orb.getEdgeThreshold()
+        searched = None
+        for scale in self.window_scales:
+            window = expanded_box(last_bbox, scale, frame.shape, margin=margin)
+            if window == searched:
+                continue  # A smaller window already covered the frame
+            searched = window
+            if features is None:
+                points, descriptors = self.detect(frame, window)
+            else:
+                points, descriptors = features_in_window(*features, window)
+            bbox = self.match(frame, points, descriptors)
+            if bbox is not None:
+                return bbox
+        return None
+
+    def match(self, frame, points, descriptors):
+        """Box of the target found among the features of a frame, None if there are not enough good matches."""
+        if descriptors is None or len(descriptors) < 2:
+            return None
+        matches = self.matcher.match(self.model_descriptors, descriptors)
+        if len(matches) < self.top_k:
+            return None
+
+        # The top_k shortest distances, without sorting every match
+        distances = np.fromiter((match.distance for match in matches), dtype=np.float32, count=len(matches))
+        best = np.argpartition(distances, self.top_k - 1)[:self.top_k]
+        src_points = self.model_points[[matches[i].queryIdx for i in best]].reshape(-1, 1, 2)
+        dst_points = points[[matches[i].trainIdx for i in best]].reshape(-1, 1, 2)
+
+        # Uses: RANdom SAmple Consensus, findHomography from Features2D:
+        # https://docs.opencv.org/4.x/d9/dab/tutorial_homography.html
+        matrix, _ = cv2.findHomography(src_points, dst_points, cv2.RANSAC, 5.0)
+        if matrix is None:
+            return None
+        x, y, width, height = self.model_bbox
+        corners = np.float32([[x, y], [x + width, y], [x + width, y + height], [x, y + height]]).reshape(-1, 1, 2)
+        found = cv2.boundingRect(cv2.perspectiveTransform(corners, matrix))
+
+        # A box that left the frame or collapsed is no target
+        frame_height, frame_width = frame.shape[:2]
+        left, top = max(0, found[0]), max(0, found[1])
+        right, bottom = min(frame_width, found[0] + found[2]), min(frame_height, found[1] + found[3])
+        if right - left < 2 or bottom - top < 2:
+            return None
+        return left, top, right - left, bottom - top
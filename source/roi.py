@@ -0,0 +1,95 @@
+﻿import numpy as np
+
+
+def roi_block_mask(rois, grid_shape, block_size):
+    """
+    Blocks of a grid that overlap any region of interest.
+
+    Input:
+    - rois (list): (x, y, width, height) rectangles in pixels
+    - grid_shape (tuple): (num_blocks_y, num_blocks_x)
+    - block_size (int): The size of the block
+
+    Returns:
+    - np.array: A boolean (num_blocks_y, num_blocks_x) array, or None without regions (every block counts)
+    """
+    if not rois:
+        return None
+    num_blocks_y, num_blocks_x = grid_shape
+    mask = np.zeros(grid_shape, dtype=bool)
+    for x, y, width, height in rois:
+        row_start, col_start = max(0, y // block_size), max(0, x // block_size)
+        row_end = min(num_blocks_y, -(-(y + height) // block_size))
+        col_end = min(num_blocks_x, -(-(x + width) // block_size))
+        mask[row_start:row_end, col_start:col_end] = True
+    return mask
+
+
+def mask_bounds(block_mask):
+    """(row_start, row_end, col_start, col_end) of the smallest block rectangle holding every True block, or None."""
+    rows = np.flatnonzero(block_mask.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(block_mask.any(axis=0))
+    return int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1
+
+
+def cropped_search(algorithm, current_frame, reference_frame, block_size=16, search_radius=8,
+                   similarity_metric='MAD', block_mask=None, initial_vectors=None, reach=None, **options):
+    """
+    Run a motion estimation algorithm on the part of the frames its searched blocks can reach.
+
+    The frames are cropped to the blocks of the mask's bounding rectangle plus a margin of whole blocks that
+    covers the search reach, so search windows still extend outside the masked blocks, and a crop edge only
+    differs from the frame edge where no candidate can get to. The block grid of the crop is aligned with
+    the frame's, so the result is the same as searching the whole frame with the mask, at a cost that
+    follows the masked area. Without a mask the whole frame is searched.
+
+    Input:
+    - algorithm (callable): Any motion estimation algorithm of the project
+    - current_frame (np.array): The current frame
+    - reference_frame (np.array): The reference frame
+    - block_size (int): The size of the block
+    - search_radius (int): The search radius
+    - similarity_metric (str): Name of a metric in similarity_metrics.METRICS
+    - block_mask (np.array): Boolean (num_blocks_y, num_blocks_x) array of the blocks to search
+    - initial_vectors (np.array): (num_blocks_y, num_blocks_x, 2) vectors the search starts from
+    - reach (int): Farthest displacement a candidate can have, search_radius if None; the largest initial
+        vector of the searched blocks is added to it
+    - options: Passed on to the algorithm
+
+    Returns:
+    - np.array: The (num_blocks_y, num_blocks_x, 2) motion vectors, zero outside the mask
+    - int: The number of block comparisons
+    """
+    bounds = mask_bounds(block_mask) if block_mask is not None else None
+    if bounds is None:
+        if block_mask is not None:
+            # Nothing to search
+            return np.zeros(block_mask.shape + (2,), dtype=int), 0
+        return algorithm(current_frame, reference_frame, block_size, search_radius, similarity_metric,
+                         return_evaluations=True, initial_vectors=initial_vectors, **options)
+
+    num_blocks_y, num_blocks_x = block_mask.shape
+    reach = search_radius if reach is None else reach
+    if initial_vectors is not None:
+        reach += int(np.abs(initial_vectors[block_mask]).max(initial=0))
+    margin = -(-reach // block_size)  # In whole blocks, so the crop keeps the frame's block grid
+    row_start, row_end, col_start, col_end = bounds
+    row_start, col_start = max(0, row_start - margin), max(0, col_start - margin)
+    row_end, col_end = min(num_blocks_y, row_end + margin), min(num_blocks_x, col_end + margin)
+
+    # At the bottom and right edges the crop keeps the pixels past the last whole block, as the frame does
+    y_start, x_start = row_start * block_size, col_start * block_size
+    y_end = current_frame.shape[0] if row_end == num_blocks_y else row_end * block_size
+    x_end = current_frame.shape[1] if col_end == num_blocks_x else col_end * block_size
+    crop_vectors = None if initial_vectors is None else initial_vectors[row_start:row_end, col_start:col_end]
+    vectors, evaluations = algorithm(current_frame[y_start:y_end, x_start:x_end],
+                                     reference_frame[y_start:y_end, x_start:x_end], block_size, search_radius,
+                                     similarity_metric, return_evaluations=True,
+                                     block_mask=block_mask[row_start:row_end, col_start:col_end],
+                                     initial_vectors=crop_vectors, **options)
+
+    motion_vectors = np.zeros((num_blocks_y, num_blocks_x, 2), dtype=np.asarray(vectors).dtype)
+    motion_vectors[row_start:row_end, col_start:col_end] = vectors
+    return motion_vectors, evaluations
@@ -0,0 +1,106 @@
+﻿from collections import namedtuple
+
+import numpy as np
+
+# Every kernel compares current blocks with reference blocks of the same shape (..., block_size, block_size)
+# and returns one distance per block, shape (...). Lower is more similar. Integer frames are widened before
+# subtracting, so uint8 differences do not wrap around.
+SimilarityMetric = namedtuple('SimilarityMetric', ['label', 'kernel'])
+
+# 4x4 Hadamard matrix used by SATD
+HADAMARD_4 = np.array([[1, 1, 1, 1],
+                       [1, -1, 1, -1],
+                       [1, 1, -1, -1],
+                       [1, -1, -1, 1]], dtype=np.int32)
+
+
+def _difference(current_blocks, reference_blocks):
+    # int32 holds the difference of any two 8 or 16 bit samples; floats are compared in float64
+    if np.issubdtype(current_blocks.dtype, np.integer) and np.issubdtype(reference_blocks.dtype, np.integer):
+        return current_blocks.astype(np.int32) - reference_blocks.astype(np.int32)
+    return current_blocks.astype(np.float64) - reference_blocks.astype(np.float64)
+
+
+def _accumulator(difference):
+    return np.int64 if np.issubdtype(difference.dtype, np.integer) else np.float64
+
+
+def sad(current_blocks, reference_blocks):
+    """Sum of Absolute Differences."""
+    difference = _difference(current_blocks, reference_blocks)
+    return np.abs(difference).sum(axis=(-2, -1), dtype=_accumulator(difference))
+
+
+def mad(current_blocks, reference_blocks):
+    """Mean Absolute Difference, the SAD divided by the number of pixels of a block."""
+    return sad(current_blocks, reference_blocks) / (current_blocks.shape[-2] * current_blocks.shape[-1])
+
+
+def ssd(current_blocks, reference_blocks):
+    """Sum of Squared Differences."""
+    difference = _difference(current_blocks, reference_blocks)
+    return np.square(difference).sum(axis=(-2, -1), dtype=_accumulator(difference))
+
+
+def satd(current_blocks, reference_blocks):
+    """
+    Sum of Absolute Transformed Differences.
+
+    The difference of every 4x4 sub-block goes through a 4x4 Hadamard transform before its absolute values are
+    summed, so the block size must be a multiple of 4.
+    """
+    height, width = current_blocks.shape[-2:]
+    if height % 4 or width % 4:
+        raise ValueError("SATD needs a block size that is a multiple of 4.")
+
+    difference = _difference(current_blocks, reference_blocks)
+    sub_blocks = difference.reshape(difference.shape[:-2] + (height // 4, 4, width // 4, 4))
+    transformed = np.einsum('ij,...ajbk,kl->...aibl', HADAMARD_4, sub_blocks, HADAMARD_4)
+    return np.abs(transformed).sum(axis=(-4, -3, -2, -1), dtype=_accumulator(difference))
+
+
+def ncc(current_blocks, reference_blocks):
+    """
+    Zero-mean Normalized Cross-Correlation, as the distance 1 - NCC.
+
+    Two flat blocks count as a perfect match, a flat block against a textured one as uncorrelated.
+    """
+    current_centered = current_blocks - current_blocks.mean(axis=(-2, -1), keepdims=True)
+    reference_centered = reference_blocks - reference_blocks.mean(axis=(-2, -1), keepdims=True)
+
+    correlation = (current_centered * reference_centered).sum(axis=(-2, -1))
+    current_energy = np.square(current_centered).sum(axis=(-2, -1))
+    reference_energy = np.square(reference_centered).sum(axis=(-2, -1))
+    energy = np.sqrt(current_energy * reference_energy)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distance = 1.0 - correlation / energy
+    flat = energy == 0
+    return np.where(flat, np.where((current_energy == 0) & (reference_energy == 0), 0.0, 1.0), distance)
+
+
+METRICS = {
+    'MAD': SimilarityMetric("Mean Absolute Difference (MAD)", mad),
+    'SAD': SimilarityMetric("Sum of Absolute Differences (SAD)", sad),
+    'SSD': SimilarityMetric("Sum of Squared Differences (SSD)", ssd),
+    'SATD': SimilarityMetric("Sum of Absolute Transformed Differences (SATD)", satd),
+    'NCC': SimilarityMetric("Zero-mean Normalized Cross-Correlation (NCC)", ncc),
+}
+
+
+def get_metric(name):
+    """
+    Resolve a similarity metric name to its kernel, once per search instead of once per candidate.
+
+    Input:
+    - name (str): The metric name, e.g. 'MAD' or 'SSD'
+
+    Returns:
+    - callable: The kernel, kernel(current_blocks, reference_blocks) -> distances
+
+    Raises:
+    - ValueError: If no metric is registered under that name
+    """
+    if name not in METRICS:
+        raise ValueError(f"Invalid similarity metric. Use one of: {', '.join(METRICS)}.")
+    return METRICS[name].kernel
@@ -0,0 +1,86 @@
+﻿import csv
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class StageTimer:
+    """
+    Rolling timing statistics of the stages of a frame pipeline.
+
+    Every stage keeps its last `window` durations for the rolling statistics, and the total over the whole run
+    for throughput figures. Stages may be timed from several threads (the decode thread, the processing thread
+    and the GUI thread). The last `trace_length` measurements are also kept as a trace that can be written to
+    a CSV or JSON file for offline profiling.
+    """
+
+    def __init__(self, window=120, trace_length=100000):
+        self.window = window
+        self.samples = {}  # stage -> deque of the last durations in seconds, in first-use order
+        self.total_seconds = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.trace = deque(maxlen=trace_length)  # (stage, frame_index, start, seconds), start from the timer's creation
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, stage, frame_index=None):
+        """Time the body of a with statement as one run of a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, start, frame_index)
+
+    def add(self, stage, seconds, start=None, frame_index=None):
+        """Record one run of a stage that took `seconds`."""
+        if start is None:
+            start = time.perf_counter() - seconds
+        with self._lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.window)
+            self.samples[stage].append(seconds)
+            self.total_seconds[stage] += seconds
+            self.counts[stage] += 1
+            self.trace.append((stage, frame_index, start - self.origin, seconds))
+
+    def statistics(self):
+        """
+        Rolling statistics of every stage.
+
+        Returns:
+        - dict: stage -> {'mean', 'p95', 'max'} in milliseconds over the window, and 'count', the number of
+            runs over the whole run
+        """
+        with self._lock:
+            samples = {stage: np.array(durations) for stage, durations in self.samples.items()}
+            counts = dict(self.counts)
+        return {stage: {'mean': 1000 * float(durations.mean()),
+                        'p95': 1000 * float(np.percentile(durations, 95)),
+                        'max': 1000 * float(durations.max()),
+                        'count': counts[stage]}
+                for stage, durations in samples.items() if len(durations)}
+
+    @staticmethod
+    def format(statistics):
+        """One line summary of statistics(), as 'stage mean/p95/max ms' per stage."""
+        return " | ".join(f"{stage} {values['mean']:.1f}/{values['p95']:.1f}/{values['max']:.1f}"
+                          for stage, values in statistics.items()) + " ms (mean/p95/max)"
+
+    def dump_trace(self, path):
+        """Write the trace to a .json file, or to a CSV file for any other extension."""
+        with self._lock:
+            trace = list(self.trace)
+        fields = ('stage', 'frame_index', 'start', 'seconds')
+        if path.lower().endswith('.json'):
+            with open(path, 'w') as trace_file:
+                json.dump([dict(zip(fields, record)) for record in trace], trace_file)
+        else:
+            with open(path, 'w', newline='') as trace_file:
+                writer = csv.writer(trace_file)
+                writer.writerow(fields)
+                writer.writerows(trace)
@@ -0,0 +1,190 @@
+﻿import cv2
+import numpy as np
+
+from source.similarity_metrics import get_metric
+from source.threestepsearch import tss_search_batched
+
+# Sub-pixel precisions the refinement supports: steps per pixel -> label
+PRECISIONS = {
+    1: "Integer pel",
+    2: "Half pel",
+    4: "Quarter pel",
+}
+
+# 6-tap half-pel interpolation filter of H.264, applied at the sample left of (or above) the half position
+HALF_PEL_TAPS = np.array([1, -5, 20, 20, -5, 1], dtype=np.float32) / 32
+
+
+def _half_pel(frame, axis):
+    # Unrounded half-pel samples between every pair of neighbours along an axis (0 = vertical)
+    kernel = HALF_PEL_TAPS.reshape(-1, 1) if axis == 0 else HALF_PEL_TAPS.reshape(1, -1)
+    anchor = (0, 2) if axis == 0 else (2, 0)
+    filtered = cv2.filter2D(frame, cv2.CV_32F, kernel, anchor=anchor, borderType=cv2.BORDER_REPLICATE)
+    return filtered[:-1] if axis == 0 else filtered[:, :-1]
+
+
+def _to_uint8(samples):
+    return np.clip(np.rint(samples), 0, 255).astype(np.uint8)
+
+
+def _bilinear_upsample(plane):
+    # Doubles the sampling of a plane; new samples are the rounded-up mean of their 2 or 4 neighbours
+    height, width = plane.shape
+    wide = plane.astype(np.uint16)
+    upsampled = np.empty((2 * height - 1, 2 * width - 1), dtype=np.uint8)
+    upsampled[::2, ::2] = plane
+    upsampled[1::2, ::2] = (wide[:-1] + wide[1:] + 1) >> 1
+    upsampled[::2, 1::2] = (wide[:, :-1] + wide[:, 1:] + 1) >> 1
+    upsampled[1::2, 1::2] = (wide[:-1, :-1] + wide[:-1, 1:] + wide[1:, :-1] + wide[1:, 1:] + 2) >> 2
+    return upsampled
+
+
+def interpolated_plane(reference_frame, precision=4):
+    """
+    Reference frame sampled every 1/precision pixel, computed once and shared by every block.
+
+    Half-pel samples come from the 6-tap filter of H.264 (the center one from the unrounded horizontal
+    samples), quarter-pel samples are the rounded mean of their integer and half-pel neighbours. Sample
+    [i, j] of the plane lies at (i / precision, j / precision) in the frame; the plane does not extend
+    past the last row and column.
+
+    Input:
+    - reference_frame (np.array): Grayscale frame, 8 bit range
+    - precision (int): 2 for half-pel, 4 for quarter-pel
+
+    Returns:
+    - np.array: The (precision * (height - 1) + 1, precision * (width - 1) + 1) uint8 plane
+    """
+    frame = np.asarray(reference_frame, dtype=np.float32)
+    horizontal = _half_pel(frame, axis=1)
+
+    height, width = frame.shape
+    half_plane = np.empty((2 * height - 1, 2 * width - 1), dtype=np.uint8)
+    half_plane[::2, ::2] = _to_uint8(frame)
+    half_plane[::2, 1::2] = _to_uint8(horizontal)
+    half_plane[1::2, ::2] = _to_uint8(_half_pel(frame, axis=0))
+    half_plane[1::2, 1::2] = _to_uint8(_half_pel(horizontal, axis=0))
+    if precision == 2:
+        return half_plane
+    if precision == 4:
+        return _bilinear_upsample(half_plane)
+    raise ValueError(f"Invalid sub-pixel precision. Use one of: {', '.join(str(p) for p in PRECISIONS if p > 1)}.")
+
+
+def refine_subpixel(current_frame, reference_frame, motion_vectors, block_size, precision=4, similarity_metric='MAD',
+                    block_mask=None, plane=None):
+    """
+    Refine integer motion vectors to half or quarter pixel accuracy.
+
+    Every block first tries the 8 half-pel positions around its vector, then, for quarter-pel, the 8
+    quarter-pel positions around the best one. The current vector is compared first and wins ties.
+    Candidate blocks are gathered for all blocks at once from the interpolated plane of the reference
+    frame, through a strided view that steps `precision` plane samples per pixel.
+
+    Input:
+    - current_frame (np.array): The current frame
+    - reference_frame (np.array): The reference frame
+    - motion_vectors (np.array): The (num_blocks_y, num_blocks_x, 2) integer vectors to refine
+    - block_size (int): The size of the block
+    - precision (int): 2 for half-pel, 4 for quarter-pel
+    - similarity_metric (str): Name of a metric in similarity_metrics.METRICS
+    - block_mask (np.array): Boolean (num_blocks_y, num_blocks_x) array; only blocks set to True are refined
+    - plane (np.array): interpolated_plane(reference_frame, precision), computed here if None
+
+    Returns:
+    - np.array: The refined (num_blocks_y, num_blocks_x, 2) float vectors
+    - int: The number of block comparisons
+    """
+    metric = get_metric(similarity_metric)
+    if plane is None:
+        plane = interpolated_plane(reference_frame, precision)
+
+    height, width = current_frame.shape
+    num_blocks_y, num_blocks_x, _ = motion_vectors.shape
+    refined_vectors = np.asarray(motion_vectors, dtype=np.float64).reshape(-1, 2).copy()
+    searched = np.ones(num_blocks_y * num_blocks_x, dtype=bool) if block_mask is None else block_mask.ravel()
+    if not searched.any():
+        return refined_vectors.reshape(num_blocks_y, num_blocks_x, 2), 0
+
+    current_blocks = current_frame[:num_blocks_y * block_size, :num_blocks_x * block_size] \
+        .reshape(num_blocks_y, block_size, num_blocks_x, block_size) \
+        .swapaxes(1, 2) \
+        .reshape(-1, block_size, block_size)[searched]
+
+    # Block at plane position (y, x) = view[y, x], its samples are precision plane samples apart
+    span = precision * (block_size - 1)
+    view = np.lib.stride_tricks.as_strided(
+        plane, shape=(plane.shape[0] - span, plane.shape[1] - span, block_size, block_size),
+        strides=(plane.strides[0], plane.strides[1], precision * plane.strides[0], precision * plane.strides[1]),
+        writeable=False)
+    limit_y, limit_x = precision * (height - block_size), precision * (width - block_size)
+
+    # Block positions in plane samples
+    start_y = np.repeat(np.arange(num_blocks_y) * block_size, num_blocks_x)[searched] * precision
+    start_x = np.tile(np.arange(num_blocks_x) * block_size, num_blocks_y)[searched] * precision
+    best_y = np.clip(start_y + precision * np.rint(refined_vectors[searched, 0]).astype(int), 0, limit_y)
+    best_x = np.clip(start_x + precision * np.rint(refined_vectors[searched, 1]).astype(int), 0, limit_x)
+    min_distance = metric(current_blocks, view[best_y, best_x])
+    evaluations = len(current_blocks)
+
+    step = precision // 2
+    while step >= 1:
+        center_y, center_x = best_y.copy(), best_x.copy()
+        for offset_y in (-step, 0, step):
+            for offset_x in (-step, 0, step):
+                if offset_y == 0 and offset_x == 0:
+                    continue
+                candidate_y, candidate_x = center_y + offset_y, center_x + offset_x
+                in_bounds = (candidate_y >= 0) & (candidate_y <= limit_y) & (candidate_x >= 0) & (candidate_x <= limit_x)
+                evaluations += int(in_bounds.sum())
+                distances = metric(current_blocks, view[np.clip(candidate_y, 0, limit_y),
+                                                        np.clip(candidate_x, 0, limit_x)])
+                improved = in_bounds & (distances < min_distance)
+                min_distance = np.where(improved, distances, min_distance)
+                best_y = np.where(improved, candidate_y, best_y)
+                best_x = np.where(improved, candidate_x, best_x)
+        step //= 2
+
+    refined_vectors[searched, 0] = (best_y - start_y) / precision
+    refined_vectors[searched, 1] = (best_x - start_x) / precision
+    return refined_vectors.reshape(num_blocks_y, num_blocks_x, 2), evaluations
+
+
+def subpixel_search(current_frame, reference_frame, block_size=16, search_radius=8, similarity_metric='MAD',
+                    precision=4, base_algorithm=tss_search_batched, workers=None, executor=None,
+                    return_evaluations=False, block_mask=None, initial_vectors=None):
+    """
+    Integer search with any algorithm of the project, followed by half or quarter pixel refinement.
+
+    Input:
+    - current_frame (np.array): The current frame
+    - reference_frame (np.array): The reference frame
+    - block_size (int): The size of the block
+    - search_radius (int): The search radius of the base algorithm
+    - similarity_metric (str): Name of a metric in similarity_metrics.METRICS
+    - precision (int): 1 for the base algorithm alone, 2 for half-pel, 4 for quarter-pel
+    - base_algorithm (callable): Any motion estimation algorithm of the project
+    - workers (int): Passed on to the base algorithm
+    - executor (concurrent.futures.Executor): Passed on to the base algorithm
+    - return_evaluations (bool): Also return the number of block comparisons
+    - block_mask (np.array): Boolean (num_blocks_y, num_blocks_x) array; only blocks set to True are searched
+    - initial_vectors (np.array): (num_blocks_y, num_blocks_x, 2) vectors, rounded to seed the base algorithm
+
+    Returns:
+    - np.array: A 3D float numpy array containing the motion vectors for each block.
+        The third dimension contains the y and x offsets.
+    - int: The number of block comparisons, only if return_evaluations is set
+    """
+    if initial_vectors is not None:
+        initial_vectors = np.rint(initial_vectors).astype(int)
+    motion_vectors, evaluations = base_algorithm(current_frame, reference_frame, block_size, search_radius,
+                                                 similarity_metric, workers=workers, executor=executor,
+                                                 return_evaluations=True, block_mask=block_mask,
+                                                 initial_vectors=initial_vectors)
+    if precision > 1:
+        motion_vectors, refine_evaluations = refine_subpixel(current_frame, reference_frame, motion_vectors,
+                                                             block_size, precision, similarity_metric, block_mask)
+        evaluations += refine_evaluations
+    if return_evaluations:
+        return motion_vectors, evaluations
+    return motion_vectors
@@ -0,0 +1,39 @@
+﻿import numpy as np
+
+from source.roi import mask_bounds
+
+
+def changed_blocks(current_frame, reference_frame, block_size, threshold, block_mask=None):
+    """
+    Change detection on the block grid, used to skip the search on static blocks.
+
+    Input:
+    - current_frame (np.array): The current frame
+    - reference_frame (np.array): The reference frame
+    - block_size (int): The size of the block
+    - threshold (float): Mean absolute frame difference at or below which a block counts as static
+    - block_mask (np.array): Boolean (num_blocks_y, num_blocks_x) array; only these blocks are checked, the
+        frame difference is computed over their bounding rectangle only
+
+    Returns:
+    - np.array: A boolean (num_blocks_y, num_blocks_x) array, True for the blocks that changed
+    """
+    height, width = current_frame.shape
+    num_blocks_y = height // block_size
+    num_blocks_x = width // block_size
+    row_start, row_end, col_start, col_end = 0, num_blocks_y, 0, num_blocks_x
+    if block_mask is not None:
+        bounds = mask_bounds(block_mask)
+        if bounds is None:
+            return np.zeros((num_blocks_y, num_blocks_x), dtype=bool)
+        row_start, row_end, col_start, col_end = bounds
+
+    # Widen before subtracting so uint8 frames do not wrap around
+    rows = slice(row_start * block_size, row_end * block_size)
+    cols = slice(col_start * block_size, col_end * block_size)
+    difference = np.abs(current_frame[rows, cols].astype(np.int32) - reference_frame[rows, cols])
+    block_difference = difference.reshape(row_end - row_start, block_size, col_end - col_start,
+                                          block_size).mean(axis=(1, 3))
+    changed = np.zeros((num_blocks_y, num_blocks_x), dtype=bool)
+    changed[row_start:row_end, col_start:col_end] = block_difference > threshold
+    return changed if block_mask is None else changed & block_mask
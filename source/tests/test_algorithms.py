@@ -0,0 +1,32 @@
+﻿import unittest
+from source.algorithms import check_search_settings, get_algorithm
+
+
+class TestSearchSettings(unittest.TestCase):
+
+    def test_supported_settings_pass(self):
+        check_search_settings(get_algorithm('ebma_pruned'), 'SAD', 16)
+        check_search_settings(get_algorithm('tss'), 'SATD', 16, pyramid_levels=3)
+        check_search_settings(get_algorithm('tss'), 'NCC', 10)
+
+    def test_unsupported_metric(self):
+        with self.assertRaisesRegex(ValueError, "MAD and SAD"):
+            check_search_settings(get_algorithm('ebma_pruned'), 'SSD', 16)
+
+    def test_satd_block_size(self):
+        with self.assertRaisesRegex(ValueError, "multiple of 4"):
+            check_search_settings(get_algorithm('ebma'), 'SATD', 10)
+        # The coarsest pyramid level searches blocks of 16 >> 2 = 4, and 16 >> 3 = 2 is too small
+        with self.assertRaisesRegex(ValueError, "multiple of 4"):
+            check_search_settings(get_algorithm('ds'), 'SATD', 16, pyramid_levels=4)
+
+    def test_pyramid_levels(self):
+        check_search_settings(get_algorithm('tss'), 'MAD', 24, pyramid_levels=4)
+        for block_size, pyramid_levels in ((16, 6), (16, 5), (20, 4)):
+            with self.subTest(block_size=block_size, pyramid_levels=pyramid_levels), \
+                    self.assertRaisesRegex(ValueError, "cannot be split over"):
+                check_search_settings(get_algorithm('tss'), 'MAD', block_size, pyramid_levels)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+﻿import unittest
+import numpy as np
+from source.benchmark import CASE_FIELDS, compare_results, run_benchmarks, synthetic_pair, vector_error
+from source.ebma import ebma_search_vectorized
+
+
+class TestSyntheticPair(unittest.TestCase):
+
+    def test_exhaustive_search_recovers_the_true_vectors(self):
+        current_frame, reference_frame, true_vectors = synthetic_pair((96, 128), 16, 4)
+        self.assertEqual(true_vectors.shape, (6, 8, 2))
+        self.assertLessEqual(np.abs(true_vectors).max(), 4)
+        motion_vectors = ebma_search_vectorized(current_frame, reference_frame, 16, 4)
+        np.testing.assert_array_equal(motion_vectors, true_vectors)
+
+    def test_vector_error(self):
+        true_vectors = np.zeros((2, 2, 2), dtype=int)
+        motion_vectors = true_vectors.copy()
+        motion_vectors[0, 0] = [3, 4]
+        mean_error, exact_fraction = vector_error(motion_vectors, true_vectors)
+        self.assertAlmostEqual(mean_error, 5 / 4)
+        self.assertAlmostEqual(exact_fraction, 3 / 4)
+
+
+class TestBenchmarkRuns(unittest.TestCase):
+
+    def test_results_and_comparison(self):
+        results = run_benchmarks(['ebma_vectorized'], ['360p'], [16], [4], ['MAD'], repeat=1, log=lambda line: None)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(tuple(results[0][field] for field in CASE_FIELDS),
+                         ('synthetic', '360p', 'ebma_vectorized', 16, 4, 'MAD'))
+        self.assertGreater(results[0]['seconds'], 0)
+        # 22 x 40 blocks of 16 pixels, (2 * 4 + 1) ** 2 candidates for each, fewer where they leave the frame
+        self.assertGreater(results[0]['evaluations'], 0)
+        self.assertLessEqual(results[0]['evaluations'], 22 * 40 * 81)
+        # The exhaustive search recovers every true vector of the synthetic pair
+        self.assertEqual(results[0]['mean_error'], 0.0)
+        self.assertEqual(results[0]['exact_fraction'], 1.0)
+
+        baseline = [dict(zip(CASE_FIELDS, ('synthetic', '360p', 'tss', 16, 8, 'MAD')),
+                         fps=100.0, evaluations=1000, mean_error=0.5)]
+        same = [dict(baseline[0])]
+        self.assertEqual(compare_results(same, baseline), [])
+
+        slower = [dict(baseline[0], fps=50.0, evaluations=1200)]
+        regressions = compare_results(slower, baseline)
+        self.assertEqual(len(regressions), 1)
+        self.assertEqual(len(regressions[0][1]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+﻿import contextlib
+import csv
+import io
+import os
+import tempfile
+import unittest
+import cv2
+import numpy as np
+from source.cli import main
+
+
+class TestCommandLine(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.video_path = os.path.join(cls.directory.name, 'moving_square.avi')
+        writer = cv2.VideoWriter(cls.video_path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (96, 64))
+        rng = np.random.default_rng(0)
+        background = cv2.GaussianBlur(rng.integers(0, 256, (64, 96, 3)).astype(np.uint8), (0, 0), 2)
+        for index in range(8):
+            frame = background.copy()
+            frame[20:40, 10 + 4 * index:30 + 4 * index] = (30, 200, 90)
+            writer.write(frame)
+        writer.release()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_motion_writes_fields_and_video(self):
+        vectors_path = os.path.join(self.directory.name, 'fields.npz')
+        video_path = os.path.join(self.directory.name, 'motion.mp4')
+        self.assertEqual(main(['motion', self.video_path, '--algorithm', 'ebma_vectorized', '--search-radius', '4',
+                               '--vectors', vectors_path, '--output-video', video_path]), 0)
+
+        fields = np.load(vectors_path)
+        np.testing.assert_array_equal(fields['frame_indices'], np.arange(1, 8))
+        self.assertEqual(fields['vectors'].shape, (7, 4, 6, 2))
+        self.assertTrue((fields['evaluations'] > 0).all())
+
+        videocapture = cv2.VideoCapture(video_path)
+        self.assertEqual(int(videocapture.get(cv2.CAP_PROP_FRAME_COUNT)), 8)
+        videocapture.release()
+
+    def test_motion_in_regions_of_interest(self):
+        vectors_path = os.path.join(self.directory.name, 'roi_fields.npz')
+        self.assertEqual(main(['motion', self.video_path, '--algorithm', 'ebma_vectorized', '--search-radius', '4',
+                               '--roi', '0', '16', '20', '20', '--vectors', vectors_path]), 0)
+
+        fields = np.load(vectors_path)
+        outside = np.ones((4, 6), dtype=bool)
+        outside[1:3, 0:2] = False
+        self.assertFalse(fields['vectors'][:, outside].any())
+        # 4 blocks with 9 x 9 candidates, but those of the first column cannot move left
+        self.assertEqual(fields['evaluations'][0], 2 * 81 + 2 * 9 * 5)
+
+    def test_motion_with_variable_block_sizes(self):
+        vectors_path = os.path.join(self.directory.name, 'leaves.npz')
+        video_path = os.path.join(self.directory.name, 'leaves.mp4')
+        self.assertEqual(main(['motion', self.video_path, '--search-radius', '4', '--min-block-size', '4',
+                               '--vectors', vectors_path, '--output-video', video_path]), 0)
+
+        leaves = np.load(vectors_path)
+        np.testing.assert_array_equal(leaves['frame_indices'], np.arange(1, 8))
+        self.assertEqual(len(leaves['sizes']), leaves['leaf_counts'].sum())
+        # The leaves of every frame tile its 4 x 6 blocks of 16 pixels
+        first = slice(0, leaves['leaf_counts'][0])
+        self.assertEqual((leaves['sizes'][first] ** 2).sum(), 64 * 96)
+        self.assertTrue(set(leaves['sizes']) <= {4, 8, 16})
+
+    def test_motion_rejects_invalid_settings(self):
+        for arguments in (['--min-block-size', '6'], ['--min-block-size', '0'],
+                          ['--min-block-size', '4', '--metric', 'NCC'], ['--algorithm', 'ebma_pruned', '--metric', 'SSD']):
+            with self.subTest(arguments=arguments), self.assertRaises(SystemExit), \
+                    contextlib.redirect_stderr(io.StringIO()):
+                main(['motion', self.video_path] + arguments)
+
+    def test_track_writes_boxes(self):
+        boxes_path = os.path.join(self.directory.name, 'boxes.csv')
+        self.assertEqual(main(['track', self.video_path, '--bbox', '10', '20', '20', '20', '--boxes', boxes_path]), 0)
+
+        with open(boxes_path, newline='') as boxes_file:
+            rows = list(csv.reader(boxes_file))
+        self.assertEqual(rows[0], ['frame', 'target', 'x', 'y', 'width', 'height', 'keyframe'])
+        self.assertEqual([int(row[0]) for row in rows[1:]], list(range(1, 8)))
+        self.assertEqual({row[6] for row in rows[1:]}, {'1'})
+
+    def test_track_several_targets(self):
+        boxes_path = os.path.join(self.directory.name, 'several_boxes.csv')
+        self.assertEqual(main(['track', self.video_path, '--bbox', '10', '20', '20', '20',
+                               '--bbox', '60', '30', '20', '20', '--boxes', boxes_path]), 0)
+
+        with open(boxes_path, newline='') as boxes_file:
+            rows = list(csv.reader(boxes_file))[1:]
+        self.assertEqual([(int(row[0]), int(row[1])) for row in rows],
+                         [(frame, target) for frame in range(1, 8) for target in range(2)])
+
+    def test_track_with_motion_vectors(self):
+        boxes_path = os.path.join(self.directory.name, 'motion_boxes.csv')
+        self.assertEqual(main(['track', self.video_path, '--bbox', '10', '20', '20', '20', '--tracker', 'motion_tss',
+                               '--boxes', boxes_path]), 0)
+
+        with open(boxes_path, newline='') as boxes_file:
+            rows = list(csv.reader(boxes_file))[1:]
+        # The square moves 4 pixels to the right every frame; its flat inside only shows the motion at its edges
+        errors = [int(row[2]) - (10 + 4 * frame) for frame, row in enumerate(rows, 1)]
+        self.assertLessEqual(max(abs(error) for error in errors), 1)
+
+    def test_track_every_second_frame(self):
+        boxes_path = os.path.join(self.directory.name, 'keyframe_boxes.csv')
+        self.assertEqual(main(['track', self.video_path, '--bbox', '10', '20', '20', '20', '--tracker', 'motion_ebma',
+                               '--keyframe-interval', '2', '--grab-skip', '--boxes', boxes_path]), 0)
+
+        with open(boxes_path, newline='') as boxes_file:
+            rows = list(csv.reader(boxes_file))[1:]
+        self.assertEqual([int(row[0]) for row in rows], list(range(1, 8)))
+        self.assertEqual([int(row[6]) for row in rows], [0, 1, 0, 1, 0, 1, 0])
+        # Boxes between keyframes are interpolated, the last one extrapolated
+        errors = [int(row[2]) - (10 + 4 * frame) for frame, row in enumerate(rows, 1)]
+        self.assertLessEqual(max(abs(error) for error in errors), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 ﻿import unittest
 import numpy as np
-from source.ebma import ebma_search
+from source.ebma import ebma_search, ebma_search_vectorized, ebma_search_pruned, ebma_cost_volume
 
 
 class TestEBMASearch(unittest.TestCase):
@@ -19,5 +19,76 @@ class TestEBMASearch(unittest.TestCase):
         expected = np.zeros((1, 1, 2), dtype=int)  # No motion between the same frames
         np.testing.assert_array_equal(result, expected)
 
+
+class TestEBMASearchVectorized(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_matches_loop_implementation(self):
+        # Frame sizes that are not multiples of the block size exercise the boundary rules
+        current_frame = self.rng.integers(0, 256, (50, 70), dtype=np.uint8)
+        reference_frame = np.roll(current_frame, (2, -3), axis=(0, 1))
+        for similarity_metric in ('MAD', 'SSD'):
+            expected = ebma_search(current_frame, reference_frame, 8, 4, similarity_metric)
+            result = ebma_search_vectorized(current_frame, reference_frame, 8, 4, similarity_metric)
+            np.testing.assert_array_equal(result, expected)
+
+    def test_matches_loop_implementation_on_noise(self):
+        current_frame = self.rng.integers(0, 256, (40, 40), dtype=np.uint8)
+        reference_frame = self.rng.integers(0, 256, (40, 40), dtype=np.uint8)
+        expected = ebma_search(current_frame, reference_frame, 8, 5)
+        result = ebma_search_vectorized(current_frame, reference_frame, 8, 5)
+        np.testing.assert_array_equal(result, expected)
+
+    def test_cost_volume_shape_and_boundaries(self):
+        frame = self.rng.integers(0, 256, (32, 48), dtype=np.uint8)
+        cost_volume = ebma_cost_volume(frame, frame, block_size=16, search_radius=2)
+        self.assertEqual(cost_volume.shape, (2, 3, 5, 5))
+        # The top-left block cannot move up or left
+        self.assertTrue(np.isinf(cost_volume[0, 0, 0, 2]))
+        self.assertTrue(np.isinf(cost_volume[0, 0, 2, 0]))
+        self.assertEqual(cost_volume[0, 0, 2, 2], 0)
+
+    def test_evaluation_counts_match_loop_implementation(self):
+        current_frame = self.rng.integers(0, 256, (40, 56), dtype=np.uint8)
+        _, expected = ebma_search(current_frame, current_frame, 8, 3, return_evaluations=True)
+        _, result = ebma_search_vectorized(current_frame, current_frame, 8, 3, return_evaluations=True)
+        self.assertEqual(result, expected)
+
+    def test_invalid_metric(self):
+        frame = self.rng.integers(0, 256, (16, 16), dtype=np.uint8)
+        with self.assertRaises(ValueError):
+            ebma_search_vectorized(frame, frame, similarity_metric='XYZ')
+
+
+class TestEBMASearchPruned(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # Widened frames, so the full search distortion is the true mean absolute difference
+        self.current_frame = rng.integers(0, 256, (48, 64)).astype(np.int32)
+        self.reference_frame = np.roll(self.current_frame, (2, -3), axis=(0, 1)) + rng.integers(0, 4, (48, 64))
+
+    def test_matches_exhaustive_search(self):
+        expected, full_evaluations = ebma_search(self.current_frame, self.reference_frame, 8, 4,
+                                                 return_evaluations=True)
+        result, evaluations = ebma_search_pruned(self.current_frame, self.reference_frame, 8, 4,
+                                                 return_evaluations=True)
+        np.testing.assert_array_equal(result, expected)
+        self.assertLess(evaluations, full_evaluations)
+
+    def test_ties_resolve_like_exhaustive_search(self):
+        # A flat frame makes every candidate of a block tie
+        flat_frame = np.full((32, 32), 7, dtype=np.int32)
+        expected = ebma_search(flat_frame, flat_frame + 1, 8, 3)
+        result = ebma_search_pruned(flat_frame, flat_frame + 1, 8, 3)
+        np.testing.assert_array_equal(result, expected)
+
+    def test_only_mad_is_supported(self):
+        with self.assertRaises(ValueError):
+            ebma_search_pruned(self.current_frame, self.reference_frame, similarity_metric='SSD')
+
+
 if __name__ == '__main__':
     unittest.main()
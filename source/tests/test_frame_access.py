@@ -0,0 +1,126 @@
+﻿import os
+import tempfile
+import unittest
+import cv2
+import numpy as np
+from source.frame_access import FrameAccess, build_frame_index
+from source.frame_source import FrameSource
+
+
+class TestFrameAccess(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.video_path = os.path.join(cls.directory.name, 'frames.mp4')
+        writer = cv2.VideoWriter(cls.video_path, cv2.VideoWriter_fourcc(*'mp4v'), 25, (64, 48))
+        rng = np.random.default_rng(0)
+        background = cv2.GaussianBlur(rng.integers(0, 256, (48, 64, 3)).astype(np.uint8), (0, 0), 2)
+        for index in range(40):
+            writer.write(np.roll(background, index, axis=1))
+        writer.release()
+
+        cls.expected = []
+        videocapture = cv2.VideoCapture(cls.video_path)
+        while True:
+            frame_read, frame = videocapture.read()
+            if not frame_read:
+                break
+            cls.expected.append(frame)
+        videocapture.release()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_index(self):
+        index = build_frame_index(self.video_path)
+        self.assertEqual(len(index.timestamps), len(self.expected))
+        self.assertEqual(index.keyframes[0], 0)
+        self.assertGreater(len(index.keyframes), 1)
+        self.assertTrue((np.diff(index.timestamps) > 0).all())
+
+    def test_random_access_matches_sequential_decoding(self):
+        access = FrameAccess(self.video_path)
+        for frame_index in (30, 2, 25, 39, 13, 0, 14):
+            np.testing.assert_array_equal(access.frame(frame_index), self.expected[frame_index])
+            np.testing.assert_array_equal(access.frame(frame_index, grayscale=True),
+                                          cv2.cvtColor(self.expected[frame_index], cv2.COLOR_BGR2GRAY))
+        self.assertIsNone(access.frame(len(self.expected)))
+
+    def test_cache_and_forward_decoding(self):
+        access = FrameAccess(self.video_path)
+        access.frame(20)
+        decoded, seeks = access.decoded, access.seeks
+
+        # Frames decoded on the way to frame 20 are cached, frames shortly after it are decoded forward
+        self.assertFalse(access.frame(18).flags.writeable)
+        access.frame(23)
+        self.assertEqual((access.decoded, access.seeks), (decoded + 3, seeks))
+
+    def test_cache_is_bounded(self):
+        frame_bytes = self.expected[0].nbytes
+        access = FrameAccess(self.video_path, max_bytes=5 * frame_bytes)
+        for frame_index in range(len(self.expected)):
+            access.frame(frame_index)
+        self.assertLessEqual(access.cache_bytes, 5 * frame_bytes)
+        self.assertEqual(sorted(index for index, _ in access.cache), list(range(35, 40)))
+
+    def test_frame_source_resumes_from_the_cache(self):
+        access = FrameAccess(self.video_path)
+        source = FrameSource(self.video_path, capacity=3, frame_access=access)
+        source.start()
+        for _ in range(10):
+            decoded = source.read()
+            np.testing.assert_array_equal(decoded.color, self.expected[decoded.index])
+            source.release(decoded)
+        source.stop()
+
+        # The frames the decoder ran ahead are cached, a resume neither seeks nor decodes them again
+        seeks = access.seeks
+        source.start(source.position)
+        frames = [(decoded.index, decoded.gray.copy()) for decoded in source]
+        source.stop()
+        self.assertEqual([index for index, _ in frames], list(range(10, len(self.expected))))
+        for index, gray in frames:
+            np.testing.assert_array_equal(gray, cv2.cvtColor(self.expected[index], cv2.COLOR_BGR2GRAY))
+        self.assertEqual(access.seeks, seeks)
+        self.assertEqual(access.decoded, len(self.expected))
+
+    def test_readers_decode_apart_and_share_the_cache(self):
+        access = FrameAccess(self.video_path)
+        access.frame(10)
+        first, second = access.reader(), access.reader()
+        self.assertIs(first.index, access.index)
+
+        # Frames the shared access decoded are served from its cache, the others by each reader's own decoder
+        np.testing.assert_array_equal(first.frame(5), self.expected[5])
+        self.assertEqual(first.decoded, 0)
+        for frame_index in range(12, 20):
+            np.testing.assert_array_equal(first.frame(frame_index), self.expected[frame_index])
+            np.testing.assert_array_equal(second.frame(30 + frame_index - 12), self.expected[30 + frame_index - 12])
+        self.assertEqual((first.seeks, second.seeks), (0, 1))
+        self.assertIn((12, False), access.cache)
+        self.assertEqual(len(first.cache), 0)
+
+        first.release()
+        np.testing.assert_array_equal(access.frame(11), self.expected[11])
+
+    def test_later_readers_hit_the_frames_of_released_ones(self):
+        access = FrameAccess(self.video_path)
+        first = access.reader()
+        for frame_index in range(len(self.expected)):
+            first.frame(frame_index, grayscale=True)
+        first.release()
+
+        # A new run on the video, like a re-run or a resume in the GUI, decodes nothing already decoded
+        second = access.reader()
+        for frame_index in (30, 31, 10):
+            np.testing.assert_array_equal(second.frame(frame_index), self.expected[frame_index])
+            np.testing.assert_array_equal(second.frame(frame_index, grayscale=True),
+                                          cv2.cvtColor(self.expected[frame_index], cv2.COLOR_BGR2GRAY))
+        self.assertEqual((second.hits, second.decoded, second.seeks), (6, 0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+﻿import threading
+import time
+import unittest
+import numpy as np
+from source.frame_pool import FramePool
+
+
+class TestFramePool(unittest.TestCase):
+
+    def test_buffers_are_reused(self):
+        pool = FramePool(capacity=2)
+        first = pool.acquire((4, 6, 3))
+        second = pool.acquire((4, 6, 3))
+        self.assertIsNot(first, second)
+        pool.release(first)
+        self.assertIs(pool.acquire((4, 6, 3)), first)
+
+    def test_acquire_waits_for_a_release(self):
+        pool = FramePool(capacity=1)
+        buffer = pool.acquire((2, 2))
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(pool.acquire((2, 2))))
+        thread.start()
+        time.sleep(0.05)
+        self.assertEqual(acquired, [])
+        pool.release(buffer)
+        thread.join(1)
+        self.assertIs(acquired[0], buffer)
+
+    def test_close_wakes_a_waiting_producer(self):
+        pool = FramePool(capacity=1)
+        pool.acquire((2, 2))
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(pool.acquire((2, 2))))
+        thread.start()
+        time.sleep(0.05)
+        pool.close()
+        thread.join(1)
+        self.assertEqual(acquired, [None])
+        pool.open()
+        self.assertEqual(pool.acquire((2, 2), np.float32).dtype, np.float32)
+
+    def test_size_change_drops_old_buffers(self):
+        pool = FramePool(capacity=1)
+        small = pool.acquire((2, 2))
+        large = pool.acquire((4, 4))
+        self.assertEqual(large.shape, (4, 4))
+        pool.release(small)  # Not a buffer of the pool anymore, ignored
+        pool.release(np.zeros((4, 4), dtype=np.uint8))
+        pool.release(large)
+        self.assertIs(pool.acquire((4, 4)), large)
+
+
+if __name__ == '__main__':
+    unittest.main()
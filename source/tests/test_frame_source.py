@@ -0,0 +1,90 @@
+﻿import os
+import tempfile
+import time
+import unittest
+import cv2
+import numpy as np
+from source.frame_source import FrameSource
+
+
+class TestFrameSource(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.video_path = os.path.join(cls.directory.name, 'frames.avi')
+        writer = cv2.VideoWriter(cls.video_path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (64, 48))
+        for index in range(12):
+            frame = np.zeros((48, 64, 3), dtype=np.uint8)
+            frame[:, index * 4:index * 4 + 8] = (40, 120, 220)
+            writer.write(frame)
+        writer.release()
+
+        cls.expected = []
+        videocapture = cv2.VideoCapture(cls.video_path)
+        while True:
+            frame_read, frame = videocapture.read()
+            if not frame_read:
+                break
+            cls.expected.append(frame)
+        videocapture.release()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_frames_match_direct_decoding(self):
+        source = FrameSource(self.video_path, capacity=3)
+        source.start()
+        frames = [(decoded.index, decoded.color.copy(), decoded.gray.copy()) for decoded in source]
+        source.stop()
+
+        self.assertEqual([index for index, _, _ in frames], list(range(len(self.expected))))
+        for (_, color, gray), expected in zip(frames, self.expected):
+            np.testing.assert_array_equal(color, expected)
+            np.testing.assert_array_equal(gray, cv2.cvtColor(expected, cv2.COLOR_BGR2GRAY))
+
+    def test_ring_buffers_are_reused(self):
+        source = FrameSource(self.video_path, capacity=2)
+        source.start()
+        buffers = {id(decoded.color) for decoded in source}
+        source.stop()
+        self.assertEqual(len(buffers), 2)
+
+    def test_full_ring_holds_back_the_decoder(self):
+        source = FrameSource(self.video_path, capacity=2)
+        source.start()
+        held = [source.read(), source.read()]
+        time.sleep(0.2)
+        self.assertGreater(source.stalls, 0)
+        self.assertEqual(source.position, 2)
+
+        # Giving a slot back lets the decoder continue
+        source.release(held[0])
+        self.assertEqual(source.read().index, 2)
+        source.stop()
+
+    def test_start_at_frame_and_restart(self):
+        source = FrameSource(self.video_path, capacity=2, grayscale=False)
+        source.start(5)
+        first = source.read()
+        self.assertEqual(first.index, 5)
+        self.assertIsNone(first.gray)
+        source.stop()
+        self.assertIsNone(source.read())
+
+        source.start(source.position)
+        self.assertEqual(source.read().index, 6)
+        source.stop()
+
+    def test_grab_only_frames_have_no_images(self):
+        source = FrameSource(self.video_path, capacity=2, grab_only=lambda index: index % 3 != 0)
+        source.start()
+        frames = [(decoded.index, decoded.color is None, decoded.slot is None) for decoded in source]
+        source.stop()
+        self.assertEqual([index for index, _, _ in frames], list(range(12)))
+        self.assertTrue(all(no_image == no_slot == (index % 3 != 0) for index, no_image, no_slot in frames))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+﻿import os
+import tempfile
+import unittest
+import numpy as np
+from source.motion_cache import MotionFieldCache
+
+
+class TestMotionFieldCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = MotionFieldCache(os.path.join(self.directory.name, 'cache'))
+        self.video_path = os.path.join(self.directory.name, 'video.avi')
+        with open(self.video_path, 'wb') as video_file:
+            video_file.write(b'not really a video')
+        self.parameters = {'algorithm': 'ebma', 'block_size': 16, 'search_radius': 8, 'similarity_metric': 'MAD'}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_fields_persist_across_opens(self):
+        entry = self.cache.open(self.video_path, self.parameters, 10, (3, 4))
+        self.assertIsNone(entry.get(2))
+        motion_vectors = np.arange(24).reshape(3, 4, 2) - 12
+        entry.put(2, motion_vectors, 123)
+        entry.flush()
+
+        reopened = self.cache.open(self.video_path, self.parameters, 10, (3, 4))
+        cached_vectors, evaluations = reopened.get(2)
+        np.testing.assert_array_equal(cached_vectors, motion_vectors)
+        self.assertEqual(evaluations, 123)
+        self.assertIsNone(reopened.get(3))
+        self.assertIsNone(reopened.get(10))
+
+    def test_subpixel_fields_are_stored_as_float(self):
+        entry = self.cache.open(self.video_path, self.parameters, 10, (3, 4), dtype=np.float32)
+        motion_vectors = (np.arange(24).reshape(3, 4, 2) - 12) / 4
+        entry.put(5, motion_vectors, 7)
+        cached_vectors, _ = entry.get(5)
+        np.testing.assert_array_equal(cached_vectors, motion_vectors)
+        # An integer entry of the same key does not keep the fractions, so it replaces the float one
+        entry = self.cache.open(self.video_path, self.parameters, 10, (3, 4))
+        self.assertIsNone(entry.get(5))
+
+    def test_key_depends_on_parameters_and_content(self):
+        key = MotionFieldCache.key(self.video_path, self.parameters)
+        self.assertNotEqual(key, MotionFieldCache.key(self.video_path, {**self.parameters, 'similarity_metric': 'SSD'}))
+
+        other_path = os.path.join(self.directory.name, 'copy.avi')
+        with open(other_path, 'wb') as video_file:
+            video_file.write(b'not really a video')
+        self.assertEqual(key, MotionFieldCache.key(other_path, self.parameters))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        first = self.cache.open(self.video_path, {**self.parameters, 'block_size': 8}, 100, (10, 10))
+        first_size = self.cache.size()
+        self.cache.max_bytes = int(first_size * 2.5)
+        self.cache.open(self.video_path, {**self.parameters, 'block_size': 4}, 100, (10, 10))
+        os.utime(os.path.dirname(first.vectors.filename), (0, 0))  # The first entry is the oldest
+        self.cache.open(self.video_path, {**self.parameters, 'block_size': 2}, 100, (10, 10))
+
+        self.assertLessEqual(self.cache.size(), self.cache.max_bytes)
+        self.assertEqual(len(os.listdir(self.cache.directory)), 2)
+        self.assertFalse(os.path.exists(first.vectors.filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
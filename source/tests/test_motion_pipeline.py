@@ -0,0 +1,91 @@
+﻿import os
+import tempfile
+import unittest
+import cv2
+import numpy as np
+from source.ebma import ebma_search_vectorized
+from source.motion_pipeline import MotionPipeline
+
+
+class TestMotionPipeline(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.video_path = os.path.join(cls.directory.name, 'moving_square.avi')
+        writer = cv2.VideoWriter(cls.video_path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (96, 64))
+        rng = np.random.default_rng(0)
+        background = cv2.GaussianBlur(rng.integers(0, 256, (64, 96, 3)).astype(np.uint8), (0, 0), 2)
+        for index in range(12):
+            frame = background.copy()
+            frame[20:40, 10 + 4 * index:30 + 4 * index] = (30, 200, 90)
+            writer.write(frame)
+        writer.release()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def run_pipeline(self, workers, stop_after=None):
+        emitted = []
+
+        def on_frame(frame, frame_index, motion_vectors, evaluations):
+            emitted.append((frame_index, None if motion_vectors is None else np.array(motion_vectors)))
+            if stop_after is not None and len(emitted) == stop_after:
+                pipeline.stop()
+
+        pipeline = MotionPipeline(self.video_path, ebma_search_vectorized, block_size=16, search_radius=4,
+                                  workers=workers, queue_depth=3, frame_callback=on_frame, draw_vectors=False)
+        pipeline.run()
+        if stop_after is not None:
+            # Resume like the GUI does, from right after the last emitted frame
+            pipeline.running = True
+            pipeline.run()
+        return emitted
+
+    def test_pipelined_stop_and_resume_skips_no_frame(self):
+        serial = self.run_pipeline(workers=1)
+        resumed = self.run_pipeline(workers=2, stop_after=5)
+
+        # The decoder and the pool ran ahead of the stop, yet every frame is emitted once, in order, and the
+        # first frame after the resume is searched against the last one emitted before the stop
+        self.assertEqual([index for index, _ in resumed], list(range(12)))
+        self.assertIsNone(resumed[0][1])
+        for (_, expected), (_, motion_vectors) in zip(serial[1:], resumed[1:]):
+            np.testing.assert_array_equal(motion_vectors, expected)
+
+    def test_pipelined_late_frames_are_dropped_with_progress(self):
+        progress = []
+        emitted = []
+        pipeline = MotionPipeline(self.video_path, ebma_search_vectorized, block_size=16, search_radius=4,
+                                  workers=2, queue_depth=3, draw_vectors=False,
+                                  frame_callback=lambda frame, frame_index, *_: emitted.append(frame_index),
+                                  progress_callback=lambda done, total: progress.append(done))
+        pipeline.clock = LateClock({0, 4, 5})
+        pipeline.run()
+
+        # The first frame is the reference of the next search and is never dropped
+        self.assertEqual(emitted, [0, 1, 2, 3] + list(range(6, 12)))
+        self.assertEqual(pipeline.frames_dropped, 2)
+        self.assertIn(6, progress)
+        self.assertEqual(progress[-1], 12)
+
+
+class LateClock:
+    """Playback clock on which some frames are late and the others due right away."""
+
+    def __init__(self, late_frames):
+        self.late_frames = late_frames
+
+    def start(self, frame_index=0):
+        pass
+
+    def is_late(self, frame_index):
+        return frame_index in self.late_frames
+
+    def wait(self, frame_index, keep_waiting=lambda: True):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+﻿import unittest
+import cv2
+import numpy as np
+from source.algorithms import ALGORITHMS
+from source.ebma import ebma_search_vectorized
+
+# Pattern searches of ALGORITHMS, which descend from the zero vector through their search patterns
+PATTERN_SEARCHES = ('ds', 'hexbs', 'arps')
+
+
+class TestPatternSearches(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # Smooth texture so the pattern search can descend towards the true displacement
+        noise = rng.integers(0, 256, (96, 96)).astype(np.uint8)
+        self.current_frame = cv2.GaussianBlur(noise, (0, 0), 4).astype(np.int32)
+        self.reference_frame = np.roll(self.current_frame, (2, -3), axis=(0, 1))
+
+    def test_identical_frames_return_zero_motion_vectors(self):
+        for name in PATTERN_SEARCHES:
+            with self.subTest(algorithm=name):
+                motion_vectors = ALGORITHMS[name].function(self.current_frame, self.current_frame, 16, 7)
+                self.assertEqual(motion_vectors.shape, (6, 6, 2))
+                self.assertTrue((motion_vectors == 0).all())
+
+    def test_global_shift(self):
+        for name in PATTERN_SEARCHES:
+            with self.subTest(algorithm=name):
+                motion_vectors = ALGORITHMS[name].function(self.current_frame, self.reference_frame, 16, 7)
+                interior = motion_vectors[1:-1, 1:-1].reshape(-1, 2)
+                np.testing.assert_array_equal(np.median(interior, axis=0), [2, -3])
+
+    def test_fewer_evaluations_than_ebma(self):
+        _, ebma_evaluations = ebma_search_vectorized(self.current_frame, self.reference_frame, 16, 7,
+                                                     return_evaluations=True)
+        for name in PATTERN_SEARCHES:
+            with self.subTest(algorithm=name):
+                _, evaluations = ALGORITHMS[name].function(self.current_frame, self.reference_frame, 16, 7,
+                                                           return_evaluations=True)
+                self.assertGreater(evaluations, 0)
+                self.assertLess(evaluations, ebma_evaluations)
+
+    def test_tiled_matches_serial(self):
+        for name in PATTERN_SEARCHES:
+            with self.subTest(algorithm=name):
+                search = ALGORITHMS[name].function
+                expected = search(self.current_frame, self.reference_frame, 16, 7, return_evaluations=True)
+                result = search(self.current_frame, self.reference_frame, 16, 7, workers=2, return_evaluations=True)
+                np.testing.assert_array_equal(result[0], expected[0])
+                self.assertEqual(result[1], expected[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+﻿import time
+import unittest
+from source.playback import PlaybackClock, QualityController, quality_levels
+
+
+class TestPlaybackClock(unittest.TestCase):
+
+    def test_frames_are_due_at_the_frame_rate(self):
+        clock = PlaybackClock(50)
+        clock.start(10)
+        self.assertAlmostEqual(clock.due(15) - clock.due(10), 0.1)
+        self.assertFalse(clock.is_late(10))
+        start = time.perf_counter()
+        clock.wait(13)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+
+    def test_late_frames(self):
+        clock = PlaybackClock(100)
+        clock.start()
+        time.sleep(0.05)
+        self.assertTrue(clock.is_late(0))
+        self.assertFalse(clock.is_late(10))
+
+    def test_wait_stops_early(self):
+        clock = PlaybackClock(1)
+        clock.start()
+        start = time.perf_counter()
+        clock.wait(100, keep_waiting=lambda: False)
+        self.assertLess(time.perf_counter() - start, 0.05)
+
+    def test_unknown_frame_rate_falls_back(self):
+        self.assertEqual(PlaybackClock(0).fps, 25.0)
+
+
+class TestQualityController(unittest.TestCase):
+
+    def test_levels_give_up_radius_then_block_size_then_resolution(self):
+        self.assertEqual(quality_levels(16, 8, max_block_size=32, max_scale=2),
+                         [(16, 8, 1), (16, 4, 1), (16, 2, 1), (32, 2, 1), (32, 4, 2)])
+
+    def test_degrades_over_budget_and_restores_with_headroom(self):
+        controller = QualityController(16, 8, frame_budget=0.04, degrade_patience=2, restore_patience=4, memory=0)
+        changes = [controller.observe(0.1) for _ in range(2)]
+        self.assertEqual(changes, [False, True])
+        self.assertEqual(controller.settings, (16, 4, 1))
+        for _ in range(3):
+            self.assertFalse(controller.observe(0.01))
+        self.assertTrue(controller.observe(0.01))
+        self.assertEqual(controller.settings, (16, 8, 1))
+
+    def test_remembers_levels_over_budget(self):
+        controller = QualityController(16, 8, frame_budget=0.04, degrade_patience=1, restore_patience=2,
+                                       memory=100)
+        controller.observe(0.1)  # Level 0 measured over budget
+        self.assertEqual(controller.level, 1)
+        for _ in range(10):
+            controller.observe(0.01)
+        self.assertEqual(controller.level, 1)
+
+    def test_stays_at_the_lowest_level(self):
+        controller = QualityController(16, 2, frame_budget=0.04, degrade_patience=1, max_block_size=16,
+                                       max_scale=1)
+        self.assertEqual(controller.levels, [(16, 2, 1)])
+        self.assertFalse(controller.observe(1.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
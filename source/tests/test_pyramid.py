@@ -0,0 +1,41 @@
+﻿import unittest
+import cv2
+import numpy as np
+from source.pyramid import pyramid_search, refine_vectors
+from source.ebma import ebma_search_vectorized
+
+
+class TestPyramidSearch(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        noise = rng.integers(0, 256, (256, 256)).astype(np.uint8)
+        self.current_frame = cv2.GaussianBlur(noise, (0, 0), 3).astype(np.int32)
+        self.reference_frame = np.roll(self.current_frame, (18, -13), axis=(0, 1))
+
+    def test_single_level_matches_base_algorithm(self):
+        expected = ebma_search_vectorized(self.current_frame, self.reference_frame, 16, 4)
+        result = pyramid_search(self.current_frame, self.reference_frame, 16, 4, levels=1,
+                                base_algorithm=ebma_search_vectorized)
+        np.testing.assert_array_equal(result, expected)
+
+    def test_large_motion_beyond_search_radius(self):
+        motion_vectors = pyramid_search(self.current_frame, self.reference_frame, 16, 4, levels=3,
+                                        base_algorithm=ebma_search_vectorized)
+        self.assertEqual(motion_vectors.shape, (16, 16, 2))
+        interior = motion_vectors[2:-2, 2:-2].reshape(-1, 2)
+        np.testing.assert_array_equal(np.median(interior, axis=0), [18, -13])
+
+    def test_too_many_levels(self):
+        with self.assertRaises(ValueError):
+            pyramid_search(self.current_frame, self.reference_frame, 4, 4, levels=3)
+
+    def test_refinement_keeps_exact_prediction(self):
+        predicted = np.tile([18, -13], (16, 16, 1))
+        refined, evaluations = refine_vectors(self.current_frame, self.reference_frame, predicted, 16, 1)
+        np.testing.assert_array_equal(refined[2:-2, 2:-2], predicted[2:-2, 2:-2])
+        self.assertGreater(evaluations, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+﻿import unittest
+import cv2
+import numpy as np
+from source.quadtree import leaf_centers, leaves_to_field, quadtree_search
+from source.ebma import ebma_search_vectorized
+
+
+class TestQuadtreeSearch(unittest.TestCase):
+
+    def setUp(self):
+        noise = np.random.default_rng(0).integers(0, 256, (128, 160)).astype(np.uint8)
+        self.current_frame = cv2.GaussianBlur(noise, (0, 0), 1.5)
+        self.reference_frame = np.roll(self.current_frame, (2, -3), axis=(0, 1))
+        # A 16 x 16 object moving on its own, off the 32 pixel grid
+        self.reference_frame[48:64, 80:96] = np.roll(self.current_frame, (-3, 1), axis=(0, 1))[48:64, 80:96]
+
+    def test_without_splits_matches_fixed_block_search(self):
+        for metric in ('SAD', 'SSD', 'SATD'):
+            with self.subTest(metric=metric):
+                leaves = quadtree_search(self.current_frame, self.reference_frame, 32, 4, metric, 8,
+                                         split_threshold=np.inf)
+                self.assertTrue((leaves.sizes == 32).all())
+                expected = ebma_search_vectorized(self.current_frame, self.reference_frame, 32, 4, metric)
+                field, covered = leaves_to_field(leaves, (4, 5), 32)
+                self.assertTrue(covered.all())
+                np.testing.assert_array_equal(field, expected)
+
+    def test_blocks_split_at_motion_boundaries(self):
+        leaves, evaluations = quadtree_search(self.current_frame, self.reference_frame, 32, 4, 'SAD', 4,
+                                              return_evaluations=True)
+        field, covered = leaves_to_field(leaves, (32, 40), 4)
+        self.assertTrue(covered.all())
+        self.assertEqual((leaves.sizes ** 2).sum(), 128 * 160)
+        # The object gets its own vector, the roots it does not touch stay whole
+        np.testing.assert_array_equal(field[13, 21], [-3, 1])
+        np.testing.assert_array_equal(field[4, 4], [2, -3])
+        self.assertEqual(leaves.sizes[(leaves.positions == [32, 32]).all(axis=1)], [32])
+        self.assertLess(leaves.sizes[(leaves.positions == [48, 80]).all(axis=1)], 32)
+        # One comparison per smallest block and candidate, never again for the larger sizes
+        self.assertLessEqual(evaluations, 32 * 40 * 81)
+
+    def test_block_mask(self):
+        block_mask = np.zeros((4, 5), dtype=bool)
+        block_mask[1, 2] = True
+        leaves = quadtree_search(self.current_frame, self.reference_frame, 32, 4, 'SAD', 4, block_mask=block_mask)
+        self.assertEqual((leaves.sizes ** 2).sum(), 32 * 32)
+        self.assertTrue(((leaves.positions >= [32, 64]) & (leaves.positions < [64, 96])).all())
+        centers = leaf_centers(leaves)
+        np.testing.assert_array_equal(centers, leaves.positions[:, ::-1] + leaves.sizes[:, None] // 2)
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            quadtree_search(self.current_frame, self.reference_frame, 32, 4, 'NCC', 4)
+        with self.assertRaises(ValueError):
+            quadtree_search(self.current_frame, self.reference_frame, 24, 4, 'SAD', 4)
+        with self.assertRaises(ValueError):
+            quadtree_search(self.current_frame, self.reference_frame, 32, 4, 'SAD', 0)
+        with self.assertRaises(ValueError):
+            quadtree_search(self.current_frame, self.reference_frame, 32, 4, 'SATD', 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
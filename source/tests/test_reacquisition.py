@@ -0,0 +1,55 @@
+﻿import unittest
+import cv2
+import numpy as np
+from source.reacquisition import OrbReacquisition, expanded_box
+
+
+class TestOrbReacquisition(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.background = cv2.GaussianBlur(rng.integers(0, 256, (360, 640, 3)).astype(np.uint8), (0, 0), 3)
+        self.target = cv2.resize(rng.integers(0, 256, (12, 12, 3)).astype(np.uint8), (96, 96),
+                                 interpolation=cv2.INTER_NEAREST)
+        self.bbox = (100, 80, 96, 96)
+        self.reacquisition = OrbReacquisition()
+        self.reacquisition.set_model(self.frame_with_target(100, 80), self.bbox)
+
+    def frame_with_target(self, x, y):
+        frame = self.background.copy()
+        frame[y:y + 96, x:x + 96] = self.target
+        return frame
+
+    def test_model_keypoints_lie_in_the_box(self):
+        points = self.reacquisition.model_points
+        self.assertGreaterEqual(len(points), self.reacquisition.top_k)
+        self.assertTrue(((points >= (100, 80)) & (points < (196, 176))).all())
+
+    def test_target_is_found_near_its_last_box(self):
+        bbox = self.reacquisition.reacquire(self.frame_with_target(130, 95), self.bbox)
+        self.assertIsNotNone(bbox)
+        np.testing.assert_allclose(bbox, (130, 95, 96, 96), atol=3)
+
+    def test_target_far_away_is_found_in_the_whole_frame(self):
+        bbox = self.reacquisition.reacquire(self.frame_with_target(500, 240), self.bbox)
+        self.assertIsNotNone(bbox)
+        np.testing.assert_allclose(bbox[:2], (500, 240), atol=4)
+
+    def test_shared_detection_of_the_frame(self):
+        frame = self.frame_with_target(130, 95)
+        features = self.reacquisition.detect(frame, (0, 0, 640, 360))
+        bbox = self.reacquisition.reacquire(frame, self.bbox, features)
+        self.assertIsNotNone(bbox)
+        np.testing.assert_allclose(bbox, (130, 95, 96, 96), atol=3)
+
+    def test_missing_target_is_not_found(self):
+        self.assertIsNone(self.reacquisition.reacquire(np.zeros_like(self.background), self.bbox))
+
+    def test_expanded_box(self):
+        self.assertEqual(expanded_box((100, 80, 20, 10), 2, (360, 640)), (90, 75, 40, 20))
+        self.assertEqual(expanded_box((0, 0, 20, 10), 3, (360, 640), margin=5), (0, 0, 45, 25))
+        self.assertEqual(expanded_box((0, 0, 20, 10), None, (360, 640)), (0, 0, 640, 360))
+
+
+if __name__ == '__main__':
+    unittest.main()
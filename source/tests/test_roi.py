@@ -0,0 +1,75 @@
+﻿import unittest
+import cv2
+import numpy as np
+from source.algorithms import ALGORITHMS
+from source.pyramid import pyramid_search
+from source.roi import cropped_search, mask_bounds, roi_block_mask
+from source.temporal import changed_blocks
+
+
+class TestRoiBlockMask(unittest.TestCase):
+
+    def test_blocks_overlapping_a_region(self):
+        mask = roi_block_mask([(20, 10, 20, 8), (90, 50, 50, 50)], (4, 6), 16)
+        expected = np.zeros((4, 6), dtype=bool)
+        expected[0:2, 1:3] = True  # x 20-40, y 10-18
+        expected[3:4, 5:6] = True  # Clipped to the grid
+        np.testing.assert_array_equal(mask, expected)
+        self.assertEqual(mask_bounds(mask), (0, 4, 1, 6))
+
+    def test_no_regions_means_every_block(self):
+        self.assertIsNone(roi_block_mask([], (4, 6), 16))
+
+
+class TestCroppedSearch(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # Not a whole number of blocks, so the crop has to keep the leftover pixels at the edges
+        noise = rng.integers(0, 256, (150, 173)).astype(np.uint8)
+        self.current_frame = cv2.GaussianBlur(noise, (0, 0), 3)
+        self.reference_frame = np.roll(self.current_frame, (3, -2), axis=(0, 1))
+        self.block_mask = roi_block_mask([(40, 30, 30, 20), (150, 120, 23, 30)], (9, 10), 16)
+
+    def test_same_result_as_a_masked_full_frame_search(self):
+        for name, algorithm in ALGORITHMS.items():
+            with self.subTest(algorithm=name):
+                expected = algorithm.function(self.current_frame, self.reference_frame, 16, 6, 'MAD',
+                                              return_evaluations=True, block_mask=self.block_mask)
+                motion_vectors, evaluations = cropped_search(algorithm.function, self.current_frame,
+                                                             self.reference_frame, 16, 6, 'MAD',
+                                                             block_mask=self.block_mask)
+                np.testing.assert_array_equal(motion_vectors, expected[0])
+                self.assertEqual(evaluations, expected[1])
+
+    def test_seeded_search_reaches_past_the_radius(self):
+        initial_vectors = np.zeros((9, 10, 2), dtype=int)
+        initial_vectors[...] = (4, -4)
+        algorithm = ALGORITHMS['tss_batched'].function
+        expected = algorithm(self.current_frame, self.reference_frame, 16, 2, 'MAD', block_mask=self.block_mask,
+                             initial_vectors=initial_vectors)
+        motion_vectors, _ = cropped_search(algorithm, self.current_frame, self.reference_frame, 16, 2, 'MAD',
+                                           block_mask=self.block_mask, initial_vectors=initial_vectors)
+        np.testing.assert_array_equal(motion_vectors, expected)
+
+    def test_pyramid_finds_the_motion_inside_the_regions(self):
+        motion_vectors, _ = cropped_search(pyramid_search, self.current_frame, self.reference_frame, 16, 2, 'MAD',
+                                           block_mask=self.block_mask, reach=12, levels=2)
+        np.testing.assert_array_equal(motion_vectors[1:3, 2:5], np.broadcast_to([3, -2], (2, 3, 2)))
+        self.assertFalse(motion_vectors[~self.block_mask].any())
+
+    def test_empty_mask_searches_nothing(self):
+        motion_vectors, evaluations = cropped_search(ALGORITHMS['ebma'].function, self.current_frame,
+                                                     self.reference_frame, 16, 4, 'MAD',
+                                                     block_mask=np.zeros((9, 10), dtype=bool))
+        self.assertFalse(motion_vectors.any())
+        self.assertEqual(evaluations, 0)
+
+    def test_changed_blocks_within_the_regions(self):
+        expected = changed_blocks(self.current_frame, self.reference_frame, 16, 1.0) & self.block_mask
+        np.testing.assert_array_equal(
+            changed_blocks(self.current_frame, self.reference_frame, 16, 1.0, self.block_mask), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
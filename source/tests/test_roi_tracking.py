@@ -0,0 +1,101 @@
+﻿import unittest
+import cv2
+import numpy as np
+from source.ROITracking import (TRACKERS, MotionVectorTracker, TrackedTarget, available_trackers, get_tracker,
+                                interpolated_track)
+
+
+class TestMotionVectorTracker(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.background = cv2.GaussianBlur(rng.integers(0, 256, (160, 240, 3)).astype(np.uint8), (0, 0), 2)
+        self.target = cv2.GaussianBlur(rng.integers(0, 256, (48, 48, 3)).astype(np.uint8), (0, 0), 1)
+
+    def frame_with_target(self, x, y):
+        frame = self.background.copy()
+        frame[y:y + 48, x:x + 48] = self.target
+        return frame
+
+    def test_box_follows_the_target(self):
+        tracker = MotionVectorTracker()
+        tracker.init(self.frame_with_target(40, 50), (40, 50, 48, 48))
+        for step in range(1, 6):
+            found, bbox = tracker.update(self.frame_with_target(40 + 3 * step, 50 - 2 * step))
+            self.assertTrue(found)
+            self.assertEqual(bbox, (40 + 3 * step, 50 - 2 * step, 48, 48))
+
+    def test_fractional_motion_adds_up(self):
+        # A median of half a pixel per frame moves the box by one pixel every second frame
+        tracker = MotionVectorTracker()
+        tracker.init(self.frame_with_target(40, 50), (40, 50, 48, 48))
+        tracker.position += (0.5, 0)
+        found, bbox = tracker.update(self.frame_with_target(41, 50))
+        self.assertEqual(bbox, (42, 50, 48, 48))
+
+    def test_box_outside_the_grid_is_lost(self):
+        tracker = MotionVectorTracker()
+        tracker.init(self.background, (300, 50, 48, 48))
+        found, _ = tracker.update(self.background)
+        self.assertFalse(found)
+
+
+class TestKeyframes(unittest.TestCase):
+
+    def test_interpolated_track(self):
+        keyframes = {0: (10, 20, 30, 30), 4: (18, 20, 30, 34)}
+        boxes = interpolated_track(keyframes, range(7))
+        self.assertEqual(boxes[2], (14, 20, 30, 32))
+        self.assertEqual(boxes[4], (18, 20, 30, 34))
+        # Past the last keyframe the box moves on at the same velocity, at a constant size
+        self.assertEqual(boxes[6], (22, 20, 30, 34))
+
+    def test_prediction_and_appearance_change(self):
+        rng = np.random.default_rng(1)
+        frame = cv2.GaussianBlur(rng.integers(0, 256, (120, 160, 3)).astype(np.uint8), (0, 0), 2)
+        target = TrackedTarget((40, 30, 32, 32), None, StillTracker)
+        target.init(frame, 0)
+        target.tracker.bbox = (44, 28, 32, 32)
+        self.assertTrue(target.update(frame, 2))
+        self.assertEqual(target.keyframes, {0: (40, 30, 32, 32), 2: (44, 28, 32, 32)})
+        target.predict(5)
+        self.assertEqual(target.bbox, (50, 25, 32, 32))
+
+        self.assertFalse(target.is_due(frame, 5, keyframe_interval=4))
+        self.assertTrue(target.is_due(frame, 6, keyframe_interval=4))
+        # The predicted box shows other pixels than on the last keyframe
+        self.assertTrue(target.is_due(frame, 5, keyframe_interval=4, appearance_threshold=5))
+        target.predict(2)
+        self.assertFalse(target.is_due(frame, 3, keyframe_interval=4, appearance_threshold=5))
+
+
+class StillTracker:
+    # Finds the box wherever it was put
+
+    def init(self, frame, bbox):
+        self.bbox = bbox
+
+    def update(self, frame):
+        return True, self.bbox
+
+
+class TestTrackerRegistry(unittest.TestCase):
+
+    def test_available_backends_create_trackers(self):
+        self.assertIn('mil', available_trackers())
+        self.assertIn('motion_tss', available_trackers())
+        for name in available_trackers():
+            tracker = get_tracker(name)()
+            self.assertTrue(hasattr(tracker, 'init') and hasattr(tracker, 'update'))
+
+    def test_unknown_or_missing_backend(self):
+        with self.assertRaises(ValueError):
+            get_tracker('unknown')
+        for name, backend in TRACKERS.items():
+            if backend.factory is None:
+                with self.assertRaisesRegex(ValueError, 'opencv-contrib-python'):
+                    get_tracker(name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+﻿import unittest
+import cv2
+import numpy as np
+from source.algorithms import ALGORITHMS
+from source.ebma import ebma_search, ebma_search_pruned, ebma_search_vectorized
+from source.similarity_metrics import METRICS, get_metric
+
+
+class TestSimilarityMetrics(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.current_blocks = rng.integers(0, 256, (5, 8, 8)).astype(np.uint8)
+        self.reference_blocks = rng.integers(0, 256, (5, 8, 8)).astype(np.uint8)
+
+    def test_uint8_differences_do_not_wrap(self):
+        current = np.full((4, 4), 10, dtype=np.uint8)
+        reference = np.full((4, 4), 200, dtype=np.uint8)
+        self.assertEqual(get_metric('SAD')(current, reference), 190 * 16)
+        self.assertEqual(get_metric('MAD')(current, reference), 190)
+        self.assertEqual(get_metric('SSD')(current, reference), 190 ** 2 * 16)
+
+    def test_kernels_match_reference_formulas(self):
+        difference = self.current_blocks.astype(np.int64) - self.reference_blocks.astype(np.int64)
+        np.testing.assert_array_equal(get_metric('SAD')(self.current_blocks, self.reference_blocks),
+                                      np.abs(difference).sum(axis=(1, 2)))
+        np.testing.assert_array_equal(get_metric('SSD')(self.current_blocks, self.reference_blocks),
+                                      (difference ** 2).sum(axis=(1, 2)))
+
+    def test_satd_of_a_constant_difference(self):
+        # A constant 4x4 difference only has a DC coefficient, 16 times the difference
+        current = np.full((8, 8), 5, dtype=np.uint8)
+        reference = np.full((8, 8), 2, dtype=np.uint8)
+        self.assertEqual(get_metric('SATD')(current, reference), 4 * 16 * 3)
+
+    def test_satd_needs_a_multiple_of_4(self):
+        with self.assertRaises(ValueError):
+            get_metric('SATD')(np.zeros((6, 6)), np.zeros((6, 6)))
+
+    def test_ncc(self):
+        block = self.current_blocks[0]
+        ncc = get_metric('NCC')
+        self.assertAlmostEqual(float(ncc(block, block)), 0.0)
+        self.assertAlmostEqual(float(ncc(block, block // 2 + 7)), 0.0, places=2)  # Invariant to gain and offset
+        self.assertAlmostEqual(float(ncc(block, 255 - block)), 2.0)
+        flat = np.full((8, 8), 3, dtype=np.uint8)
+        self.assertEqual(float(ncc(flat, flat + 4)), 0.0)
+        self.assertEqual(float(ncc(flat, block)), 1.0)
+
+    def test_batched_kernels_match_single_blocks(self):
+        for name in METRICS:
+            with self.subTest(metric=name):
+                metric = get_metric(name)
+                batched = metric(self.current_blocks, self.reference_blocks)
+                single = [metric(current, reference)
+                          for current, reference in zip(self.current_blocks, self.reference_blocks)]
+                np.testing.assert_allclose(batched, single)
+
+    def test_unknown_metric(self):
+        with self.assertRaises(ValueError):
+            get_metric('XYZ')
+
+
+class TestMetricsInSearches(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        noise = rng.integers(0, 256, (64, 64)).astype(np.uint8)
+        self.current_frame = cv2.GaussianBlur(noise, (0, 0), 3)
+        self.reference_frame = np.roll(self.current_frame, (2, -3), axis=(0, 1))
+
+    def test_vectorized_ebma_matches_loop_on_uint8(self):
+        for name in ('SAD', 'SSD', 'SATD'):
+            with self.subTest(metric=name):
+                expected = ebma_search(self.current_frame, self.reference_frame, 16, 4, name)
+                result = ebma_search_vectorized(self.current_frame, self.reference_frame, 16, 4, name)
+                np.testing.assert_array_equal(result, expected)
+
+    def test_pruned_ebma_accepts_sad(self):
+        expected = ebma_search(self.current_frame, self.reference_frame, 16, 4, 'SAD')
+        result = ebma_search_pruned(self.current_frame, self.reference_frame, 16, 4, 'SAD')
+        np.testing.assert_array_equal(result, expected)
+
+    def test_every_algorithm_runs_every_metric(self):
+        for algorithm_name, algorithm in ALGORITHMS.items():
+            for metric_name in METRICS:
+                if algorithm_name == 'ebma_pruned' and metric_name not in ('MAD', 'SAD'):
+                    continue
+                with self.subTest(algorithm=algorithm_name, metric=metric_name):
+                    motion_vectors = algorithm.function(self.current_frame, self.reference_frame, 16, 4, metric_name)
+                    self.assertEqual(motion_vectors.shape, (4, 4, 2))
+                    interior = motion_vectors[1:3, 1:3].reshape(-1, 2)
+                    np.testing.assert_array_equal(np.median(interior, axis=0), [2, -3])
+
+
+if __name__ == '__main__':
+    unittest.main()
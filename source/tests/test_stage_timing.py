@@ -0,0 +1,68 @@
+﻿import csv
+import json
+import os
+import tempfile
+import threading
+import unittest
+from source.stage_timing import StageTimer
+
+
+class TestStageTimer(unittest.TestCase):
+
+    def test_statistics_cover_the_window(self):
+        timer = StageTimer(window=10)
+        for milliseconds in range(1, 21):
+            timer.add('motion', milliseconds / 1000)
+        statistics = timer.statistics()['motion']
+        # Only the last 10 samples (11..20 ms) are kept for the rolling statistics
+        self.assertAlmostEqual(statistics['mean'], 15.5)
+        self.assertAlmostEqual(statistics['max'], 20.0)
+        self.assertTrue(19.0 <= statistics['p95'] <= 20.0)
+        self.assertEqual(statistics['count'], 20)
+        self.assertAlmostEqual(timer.total_seconds['motion'], 0.21)
+
+    def test_measure_records_the_stage_and_frame(self):
+        timer = StageTimer()
+        with timer.measure('draw', 7):
+            pass
+        self.assertEqual(list(timer.statistics()), ['draw'])
+        self.assertEqual(timer.trace[0][:2], ('draw', 7))
+        self.assertIn('draw', StageTimer.format(timer.statistics()))
+
+    def test_trace_dump(self):
+        timer = StageTimer()
+        timer.add('decode', 0.002, frame_index=0)
+        timer.add('grayscale', 0.001, frame_index=0)
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, 'trace.csv')
+            json_path = os.path.join(directory, 'trace.json')
+            timer.dump_trace(csv_path)
+            timer.dump_trace(json_path)
+            with open(csv_path, newline='') as csv_file:
+                rows = list(csv.reader(csv_file))
+            with open(json_path) as json_file:
+                records = json.load(json_file)
+        self.assertEqual(rows[0], ['stage', 'frame_index', 'start', 'seconds'])
+        self.assertEqual([row[0] for row in rows[1:]], ['decode', 'grayscale'])
+        self.assertEqual([record['stage'] for record in records], ['decode', 'grayscale'])
+        self.assertAlmostEqual(records[0]['seconds'], 0.002)
+
+    def test_threads_can_share_a_timer(self):
+        timer = StageTimer(trace_length=1000)
+
+        def record(stage):
+            for _ in range(1000):
+                timer.add(stage, 0.001)
+
+        threads = [threading.Thread(target=record, args=(stage,)) for stage in ('decode', 'motion', 'display')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual({stage: values['count'] for stage, values in timer.statistics().items()},
+                         {'decode': 1000, 'motion': 1000, 'display': 1000})
+        self.assertEqual(len(timer.trace), 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
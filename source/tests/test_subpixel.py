@@ -0,0 +1,74 @@
+﻿import unittest
+import cv2
+import numpy as np
+from source.subpixel import interpolated_plane, refine_subpixel, subpixel_search
+from source.ebma import ebma_search_vectorized
+
+
+def shifted(frame, dy, dx):
+    # Frame content moved by (dy, dx) pixels, with bicubic interpolation between pixels
+    transform = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(frame, transform, frame.shape[::-1], flags=cv2.INTER_CUBIC,
+                          borderMode=cv2.BORDER_REFLECT)
+
+
+class TestInterpolatedPlane(unittest.TestCase):
+
+    def test_integer_samples_are_the_frame(self):
+        frame = np.random.default_rng(0).integers(0, 256, (12, 20)).astype(np.uint8)
+        for precision in (2, 4):
+            plane = interpolated_plane(frame, precision)
+            self.assertEqual(plane.shape, (precision * 11 + 1, precision * 19 + 1))
+            np.testing.assert_array_equal(plane[::precision, ::precision], frame)
+
+    def test_ramp_is_interpolated_linearly(self):
+        frame = np.tile(np.arange(0, 160, 8, dtype=np.uint8), (10, 1))
+        plane = interpolated_plane(frame, 4)
+        np.testing.assert_array_equal(plane[5, 8:17], np.arange(16, 34, 2))
+
+    def test_invalid_precision(self):
+        with self.assertRaises(ValueError):
+            interpolated_plane(np.zeros((8, 8), dtype=np.uint8), 3)
+
+
+class TestSubpixelSearch(unittest.TestCase):
+
+    def setUp(self):
+        noise = np.random.default_rng(1).integers(0, 256, (160, 192)).astype(np.uint8)
+        self.current_frame = cv2.GaussianBlur(noise, (0, 0), 2)
+
+    def test_recovers_quarter_pel_motion(self):
+        reference_frame = shifted(self.current_frame, 1.75, -0.5)
+        motion_vectors = subpixel_search(self.current_frame, reference_frame, 16, 4, precision=4,
+                                         base_algorithm=ebma_search_vectorized)
+        self.assertTrue(np.issubdtype(motion_vectors.dtype, np.floating))
+        np.testing.assert_array_equal(np.median(motion_vectors[2:-2, 2:-2].reshape(-1, 2), axis=0), [1.75, -0.5])
+
+    def test_half_pel_rounds_to_half_pixels(self):
+        reference_frame = shifted(self.current_frame, 0.5, 1.5)
+        motion_vectors = subpixel_search(self.current_frame, reference_frame, 16, 4, precision=2,
+                                         base_algorithm=ebma_search_vectorized)
+        np.testing.assert_array_equal(motion_vectors * 2, np.rint(motion_vectors * 2))
+        np.testing.assert_array_equal(np.median(motion_vectors[2:-2, 2:-2].reshape(-1, 2), axis=0), [0.5, 1.5])
+
+    def test_integer_motion_is_kept(self):
+        reference_frame = np.roll(self.current_frame, (2, -3), axis=(0, 1))
+        integer_vectors = ebma_search_vectorized(self.current_frame, reference_frame, 16, 4)
+        refined, evaluations = refine_subpixel(self.current_frame, reference_frame, integer_vectors, 16)
+        np.testing.assert_array_equal(refined[2:-2, 2:-2], integer_vectors[2:-2, 2:-2])
+        self.assertGreater(evaluations, 0)
+
+    def test_block_mask(self):
+        reference_frame = shifted(self.current_frame, 0.25, 0.25)
+        block_mask = np.zeros((10, 12), dtype=bool)
+        block_mask[4:6, 5:7] = True
+        motion_vectors, evaluations = subpixel_search(self.current_frame, reference_frame, 16, 2,
+                                                      base_algorithm=ebma_search_vectorized,
+                                                      return_evaluations=True, block_mask=block_mask)
+        np.testing.assert_array_equal(motion_vectors[~block_mask], 0)
+        np.testing.assert_array_equal(motion_vectors[block_mask], np.full((4, 2), 0.25))
+        self.assertEqual(evaluations, 4 * 25 + 4 * 17)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+﻿import unittest
+import cv2
+import numpy as np
+from source.algorithms import ALGORITHMS
+from source.temporal import changed_blocks
+
+
+class TestChangedBlocks(unittest.TestCase):
+
+    def test_static_and_changed_blocks(self):
+        frame = np.full((32, 48), 200, dtype=np.uint8)
+        changed = frame.copy()
+        changed[16:32, 0:16] = 10  # Would wrap around without widening
+        mask = changed_blocks(frame, changed, 16, threshold=1.0)
+        expected = np.zeros((2, 3), dtype=bool)
+        expected[1, 0] = True
+        np.testing.assert_array_equal(mask, expected)
+
+
+class TestBlockMaskAndSeeding(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        noise = rng.integers(0, 256, (96, 96)).astype(np.uint8)
+        self.current_frame = cv2.GaussianBlur(noise, (0, 0), 4).astype(np.int32)
+        self.reference_frame = np.roll(self.current_frame, (2, -3), axis=(0, 1))
+        self.block_mask = np.zeros((6, 6), dtype=bool)
+        self.block_mask[2:4, 1:5] = True
+
+    def test_masked_blocks_are_skipped(self):
+        for name, algorithm in ALGORITHMS.items():
+            with self.subTest(algorithm=name):
+                full, full_evaluations = algorithm.function(self.current_frame, self.reference_frame, 16, 7,
+                                                            return_evaluations=True)
+                masked, evaluations = algorithm.function(self.current_frame, self.reference_frame, 16, 7,
+                                                         return_evaluations=True, block_mask=self.block_mask)
+                self.assertTrue((masked[~self.block_mask] == 0).all())
+                self.assertLess(evaluations, full_evaluations)
+                if name != 'arps':  # ARPS predicts from the left neighbour, which may be masked out
+                    np.testing.assert_array_equal(masked[self.block_mask], full[self.block_mask])
+
+    def test_exact_seed_is_kept(self):
+        initial_vectors = np.tile([2, -3], (6, 6, 1))
+        for name in ('tss_batched', 'ds', 'hexbs', 'arps'):
+            with self.subTest(algorithm=name):
+                function = ALGORITHMS[name].function
+                _, unseeded_evaluations = function(self.current_frame, self.reference_frame, 16, 7,
+                                                   return_evaluations=True)
+                seeded, evaluations = function(self.current_frame, self.reference_frame, 16, 7,
+                                               return_evaluations=True, initial_vectors=initial_vectors)
+                np.testing.assert_array_equal(seeded[1:-1, 1:-1], initial_vectors[1:-1, 1:-1])
+                if name != 'tss_batched':  # Three-Step Search always visits the same number of points
+                    self.assertLessEqual(evaluations, unseeded_evaluations)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+﻿import unittest
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+from source.ebma import ebma_search, ebma_search_vectorized
+from source.threestepsearch import tss_search, tss_search_batched
+from source.tiling import active_block_spans
+
+
+class TestTiledSearch(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.current_frame = rng.integers(0, 256, (80, 72), dtype=np.uint8)
+        self.reference_frame = np.roll(self.current_frame, (2, 3), axis=(0, 1))
+
+    def assert_tiled_matches_serial(self, algorithm, **tiling):
+        expected = algorithm(self.current_frame, self.reference_frame, 8, 4)
+        result = algorithm(self.current_frame, self.reference_frame, 8, 4, **tiling)
+        np.testing.assert_array_equal(result, expected)
+
+    def test_process_tiles_match_serial(self):
+        self.assert_tiled_matches_serial(ebma_search, workers=3)
+        self.assert_tiled_matches_serial(tss_search, workers=3)
+
+    def test_thread_tiles_match_serial(self):
+        self.assert_tiled_matches_serial(ebma_search_vectorized, workers=4)
+        self.assert_tiled_matches_serial(tss_search_batched, workers=4)
+
+    def test_explicit_executors(self):
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            self.assert_tiled_matches_serial(ebma_search, workers=3, executor=executor)
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            self.assert_tiled_matches_serial(tss_search_batched, workers=2, executor=executor)
+            self.assert_tiled_matches_serial(tss_search, executor=executor)
+
+    def test_more_workers_than_rows(self):
+        self.assert_tiled_matches_serial(ebma_search_vectorized, workers=64)
+
+
+class TestActiveBlockSpans(unittest.TestCase):
+
+    def test_without_mask(self):
+        self.assertEqual(active_block_spans(None, 2, 5, 7), [(2, 5, 0, 7)])
+
+    def test_runs_of_rows(self):
+        block_mask = np.zeros((6, 8), dtype=bool)
+        block_mask[1, 2] = block_mask[2, 5] = True
+        block_mask[4, 0:3] = True
+        self.assertEqual(active_block_spans(block_mask, 0, 6, 8), [(1, 3, 2, 6), (4, 5, 0, 3)])
+        self.assertEqual(active_block_spans(block_mask, 2, 4, 8), [(2, 3, 5, 6)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,14 @@
+﻿import unittest
+from source.tracker_benchmark import box_iou
+
+
+class TestTrackerBenchmark(unittest.TestCase):
+
+    def test_box_iou(self):
+        self.assertEqual(box_iou((0, 0, 10, 10), (0, 0, 10, 10)), 1.0)
+        self.assertAlmostEqual(box_iou((0, 0, 10, 10), (5, 0, 10, 10)), 50 / 150)
+        self.assertEqual(box_iou((0, 0, 10, 10), (20, 20, 5, 5)), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,7 @@
 import unittest
 import numpy as np
 import logging
-from source.threestepsearch import tss_search  # Assuming your function is saved in a file named tss_search.py
+from source.threestepsearch import tss_search, tss_search_batched  # Assuming your function is saved in a file named tss_search.py
 
 # Configure logging
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -88,5 +88,40 @@ class TestTSSSearch(unittest.TestCase):
         logger.info("test_boundary_conditions passed")
 
 
+class TestTSSSearchBatched(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_matches_per_block_implementation(self):
+        current_frame = self.rng.integers(0, 256, (72, 88), dtype=np.uint8)
+        reference_frame = np.roll(current_frame, (3, -5), axis=(0, 1))
+        for similarity_metric in ('MAD', 'SSD'):
+            for search_radius in (1, 3, 8):
+                expected = tss_search(current_frame, reference_frame, 16, search_radius, similarity_metric)
+                result = tss_search_batched(current_frame, reference_frame, 16, search_radius, similarity_metric)
+                np.testing.assert_array_equal(result, expected)
+
+    def test_matches_per_block_implementation_on_noise(self):
+        current_frame = self.rng.integers(0, 256, (64, 64), dtype=np.uint8)
+        reference_frame = self.rng.integers(0, 256, (64, 64), dtype=np.uint8)
+        expected = tss_search(current_frame, reference_frame, 8, 8)
+        result = tss_search_batched(current_frame, reference_frame, 8, 8)
+        np.testing.assert_array_equal(result, expected)
+
+    def test_evaluation_counts_match_per_block_implementation(self):
+        current_frame = self.rng.integers(0, 256, (64, 48), dtype=np.uint8)
+        reference_frame = np.roll(current_frame, (1, 2), axis=(0, 1))
+        _, expected = tss_search(current_frame, reference_frame, 16, 8, return_evaluations=True)
+        _, result = tss_search_batched(current_frame, reference_frame, 16, 8, return_evaluations=True)
+        self.assertEqual(result, expected)
+
+    def test_identical_frames_return_zero_motion_vectors(self):
+        frame = self.rng.integers(0, 256, (64, 64), dtype=np.uint8)
+        motion_vectors = tss_search_batched(frame, frame, 16, 8)
+        self.assertEqual(motion_vectors.shape, (4, 4, 2))
+        self.assertTrue((motion_vectors == 0).all())
+
+
 if __name__ == '__main__':
     unittest.main()
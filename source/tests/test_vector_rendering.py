@@ -0,0 +1,96 @@
+﻿import unittest
+import cv2
+import numpy as np
+from source.quadtree import QuadtreeLeaves
+from source.vector_rendering import HSV_LUT, draw_arrows, draw_dense, get_renderer
+
+
+class TestVectorRendering(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.motion_vectors = rng.integers(-8, 9, (6, 10, 2))
+        self.motion_vectors[rng.random((6, 10)) < 0.3] = 0
+        self.block_size = 16
+        self.frame = np.zeros((6 * self.block_size, 10 * self.block_size, 3), dtype=np.uint8)
+
+    def test_arrows_match_arrowed_line(self):
+        expected = self.frame.copy()
+        for block_y, block_x in np.ndindex(self.motion_vectors.shape[:2]):
+            dy, dx = self.motion_vectors[block_y, block_x]
+            if dy == 0 and dx == 0:
+                continue
+            start = (block_x * self.block_size + self.block_size // 2, block_y * self.block_size + self.block_size // 2)
+            cv2.arrowedLine(expected, start, (start[0] + int(dx), start[1] + int(dy)), (0, 0, 255), 1)
+        drawn = draw_arrows(self.frame.copy(), self.motion_vectors, self.block_size)
+        np.testing.assert_array_equal(drawn, expected)
+
+    def test_subpixel_arrows_end_between_pixels(self):
+        motion_vectors = np.zeros((1, 1, 2))
+        motion_vectors[0, 0] = (0, 5.75)
+        drawn = draw_arrows(np.zeros((16, 32, 3), dtype=np.uint8), motion_vectors, 16)
+        # Drawn from fixed point coordinates, the shaft reaches the pixel the end rounds to and no further
+        columns = np.flatnonzero(drawn[8].any(axis=-1))
+        self.assertEqual((columns.min(), columns.max()), (8, 14))
+        rounded = draw_arrows(np.zeros_like(drawn), motion_vectors.astype(int), 16)
+        self.assertFalse((drawn == rounded).all())
+
+    def test_quadtree_leaves_are_drawn_at_their_centers(self):
+        leaves = QuadtreeLeaves(np.array([[0, 0], [0, 32], [16, 32]]), np.array([32, 16, 16]),
+                                np.array([[0, 6], [0, 0], [4, 0]]))
+        expected = np.zeros((32, 64, 3), dtype=np.uint8)
+        cv2.arrowedLine(expected, (16, 16), (22, 16), (0, 0, 255), 1)
+        cv2.arrowedLine(expected, (40, 24), (40, 28), (0, 0, 255), 1)
+        drawn = draw_arrows(np.zeros_like(expected), leaves, 16)
+        np.testing.assert_array_equal(drawn, expected)
+
+        # The dense field covers the leaves only, on the grid of the smallest one
+        drawn = draw_dense(np.zeros((48, 64, 3), dtype=np.uint8), leaves, 16, 8)
+        self.assertTrue(drawn[:32].any(axis=-1)[:, :32].all())
+        self.assertFalse(drawn[32:].any())
+        self.assertFalse(drawn[:16, 32:].any())  # The leaf without motion stays black
+
+    def test_zero_vectors_are_not_drawn(self):
+        drawn = draw_arrows(self.frame.copy(), np.zeros((6, 10, 2), dtype=int), self.block_size)
+        self.assertFalse(drawn.any())
+
+    def test_dense_colors_follow_direction_and_magnitude(self):
+        motion_vectors = np.zeros((1, 3, 2), dtype=int)
+        motion_vectors[0, 1] = (0, 8)  # Right, full length
+        motion_vectors[0, 2] = (0, -4)  # Left, half length
+        frame = np.zeros((16, 48, 3), dtype=np.uint8)
+        drawn = draw_dense(frame, motion_vectors, 16, max_magnitude=8)
+        block_colors = drawn[8, 8::16]
+        self.assertFalse(block_colors[0].any())  # No motion is black
+        hsv = cv2.cvtColor(block_colors[None], cv2.COLOR_BGR2HSV)[0]
+        self.assertNotEqual(hsv[1, 0], hsv[2, 0])
+        self.assertGreater(hsv[1, 2], hsv[2, 2])
+        # Every pixel of a block has the block's color
+        self.assertTrue((drawn[:, 16:32] == block_colors[1]).all())
+
+    def test_only_masked_blocks_are_drawn(self):
+        block_mask = np.zeros((6, 10), dtype=bool)
+        block_mask[2:4, 3:6] = True
+        # Arrows of the last masked blocks may end a few pixels past them
+        near = np.zeros(self.frame.shape[:2], dtype=bool)
+        near[2 * 16:4 * 16 + 8, 3 * 16:6 * 16 + 8] = True
+        motion_vectors = np.full((6, 10, 2), 6)
+        for renderer in (draw_arrows, draw_dense):
+            with self.subTest(renderer=renderer.__name__):
+                drawn = renderer(self.frame + 50, motion_vectors, self.block_size, 8, block_mask=block_mask)
+                changed = (drawn != 50).any(axis=-1)
+                self.assertTrue(changed[near].any())
+                self.assertFalse(changed[~near].any())
+
+    def test_lut_matches_hsv_conversion(self):
+        hsv = np.array([[[90, 255, 200]]], dtype=np.uint8)
+        # Vectorized and scalar conversions may round differently by one level
+        np.testing.assert_allclose(HSV_LUT[90, 200], cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)[0, 0], atol=1)
+
+    def test_unknown_renderer_is_rejected(self):
+        with self.assertRaises(ValueError):
+            get_renderer('sparkles')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,11 @@
 ﻿import numpy as np
 
+from source.similarity_metrics import get_metric
+from source.tiling import run_tiled
 
-def tss_search(current_frame, reference_frame, block_size=16, search_radius=8, similarity_metric='MAD'):
+
+def tss_search(current_frame, reference_frame, block_size=16, search_radius=8, similarity_metric='MAD', workers=None,
+               executor=None, return_evaluations=False, block_mask=None, initial_vectors=None):
     """
     Three-Step Search Algorithm for Motion Estimation
 
@@ -10,29 +14,65 @@ def tss_search(current_frame, reference_frame, block_size=16, search_radius=8, s
     - reference_frame (np.array): The reference frame
     - block_size (int): The size of the block
     - search_radius (int): The maximum search radius
+    - similarity_metric (str): Name of a metric in similarity_metrics.METRICS
+    - workers (int): Split the block grid into row bands searched by this many worker processes
+    - executor (concurrent.futures.Executor): Executor to search the row bands on
+    - return_evaluations (bool): Also return the number of block comparisons
+    - block_mask (np.array): Boolean (num_blocks_y, num_blocks_x) array; only blocks set to True are searched,
+        the others keep a zero vector
+    - initial_vectors (np.array): (num_blocks_y, num_blocks_x, 2) vectors the first step is centered on,
+        instead of the zero vector
 
     Returns:
     - np.array: A 3D numpy array containing the motion vectors for each block.
         The third dimension contains the y and x offsets.
+    - int: The number of block comparisons, only if return_evaluations is set
     """
-    # Check if frames are identical
-    if np.array_equal(current_frame, reference_frame):
-        return np.zeros((current_frame.shape[0] // block_size, current_frame.shape[1] // block_size, 2), dtype=int)
-
+    metric = get_metric(similarity_metric)
     height, width = current_frame.shape
     num_blocks_y = height // block_size
     num_blocks_x = width // block_size
     motion_vectors = np.zeros((num_blocks_y, num_blocks_x, 2), dtype=int)
 
-    for block_y in range(num_blocks_y):
+    # Check if frames are identical
+    if np.array_equal(current_frame, reference_frame):
+        evaluations = 0
+    else:
+        # The per-block loop holds the GIL, so parallel row bands run in processes
+        evaluations = run_tiled(_tss_search_rows, current_frame, reference_frame, motion_vectors,
+                                (block_size, search_radius, metric, block_mask, initial_vectors),
+                                workers, executor)
+
+    if return_evaluations:
+        return motion_vectors, evaluations
+    return motion_vectors
+
+
+def _tss_search_rows(current_frame, reference_frame, motion_vectors, row_start, row_end, block_size, search_radius,
+                     metric, block_mask, initial_vectors):
+    height, width = current_frame.shape
+    num_blocks_x = motion_vectors.shape[1]
+    evaluations = 0
+
+    for block_y in range(row_start, row_end):
         for block_x in range(num_blocks_x):
-            # Initialize minimum distance and best offsets
-            min_distance = float('inf')
-            best_offset_y, best_offset_x = 0, 0
+            if block_mask is not None and not block_mask[block_y, block_x]:
+                continue
 
             # Calculate block position in the current frame
             start_y = block_y * block_size
             start_x = block_x * block_size
+
+            # Initialize minimum distance and best offsets
+            min_distance = float('inf')
+            best_offset_y, best_offset_x = 0, 0
+            if initial_vectors is not None:
+                # Start from the initial vector, moved back inside the frame if needed
+                best_offset_y = min(max(int(initial_vectors[block_y, block_x, 0]), -start_y),
+                                    height - block_size - start_y)
+                best_offset_x = min(max(int(initial_vectors[block_y, block_x, 1]), -start_x),
+                                    width - block_size - start_x)
+
             block_current = current_frame[start_y:start_y + block_size, start_x:start_x + block_size]
 
             # Initial step size for the search
@@ -60,12 +100,8 @@ def tss_search(current_frame, reference_frame, block_size=16, search_radius=8, s
                         block_reference = reference_frame[ref_y:ref_y + block_size, ref_x:ref_x + block_size]
 
                         # Calculate the distance between current block and reference block
-                        if similarity_metric == 'MAD':
-                            distance = np.mean(np.abs(block_current - block_reference))
-                        elif similarity_metric == 'SSD':
-                            distance = np.sum((block_current - block_reference) ** 2)
-                        else:
-                            raise ValueError("Invalid similarity metric. Use 'MAD' or 'SSD'.")
+                        distance = metric(block_current, block_reference)
+                        evaluations += 1
 
                         # Update minimum distance and best candidate offsets
                         if distance < min_distance:
@@ -82,4 +118,128 @@ def tss_search(current_frame, reference_frame, block_size=16, search_radius=8, s
             # Store the best offsets as the motion vector for the current block
             motion_vectors[block_y, block_x] = [best_offset_y, best_offset_x]
 
+    return evaluations
+
+
+def tss_search_batched(current_frame, reference_frame, block_size=16, search_radius=8, similarity_metric='MAD',
+                       workers=None, executor=None, return_evaluations=False, block_mask=None,
+                       initial_vectors=None):
+    """
+    Three-Step Search moving all blocks through each step together.
+
+    At every step the candidate blocks of the whole grid are gathered from the reference frame into one
+    array and compared against the current blocks at once. Candidates outside the frame are masked out
+    with the same bounds check as tss_search, and the running minimum is kept across steps, so the
+    result is identical to tss_search. Only the blocks selected by the block mask are gathered.
+
+    Input:
+    - current_frame (np.array): The current frame
+    - reference_frame (np.array): The reference frame
+    - block_size (int): The size of the block
+    - search_radius (int): The maximum search radius
+    - similarity_metric (str): Name of a metric in similarity_metrics.METRICS
+    - workers (int): Split the block grid into row bands searched by this many worker threads
+    - executor (concurrent.futures.Executor): Executor to search the row bands on
+    - return_evaluations (bool): Also return the number of block comparisons
+    - block_mask (np.array): Boolean (num_blocks_y, num_blocks_x) array; only blocks set to True are searched,
+        the others keep a zero vector
+    - initial_vectors (np.array): (num_blocks_y, num_blocks_x, 2) vectors the first step is centered on,
+        instead of the zero vector
+
+    Returns:
+    - np.array: A 3D numpy array containing the motion vectors for each block.
+        The third dimension contains the y and x offsets.
+    - int: The number of block comparisons, only if return_evaluations is set
+    """
+    metric = get_metric(similarity_metric)
+
+    height, width = current_frame.shape
+    num_blocks_y = height // block_size
+    num_blocks_x = width // block_size
+    motion_vectors = np.zeros((num_blocks_y, num_blocks_x, 2), dtype=int)
+
+    # Check if frames are identical, or if there is no block to search
+    if np.array_equal(current_frame, reference_frame) or num_blocks_y == 0 or num_blocks_x == 0:
+        evaluations = 0
+    else:
+        # NumPy releases the GIL while comparing the gathered blocks, so parallel row bands run in threads
+        evaluations = run_tiled(_tss_batched_rows, current_frame, reference_frame, motion_vectors,
+                                (block_size, search_radius, metric, block_mask, initial_vectors),
+                                workers, executor, releases_gil=True)
+
+    if return_evaluations:
+        return motion_vectors, evaluations
     return motion_vectors
+
+
+def _tss_batched_rows(current_frame, reference_frame, motion_vectors, row_start, row_end, block_size, search_radius,
+                      metric, block_mask, initial_vectors):
+    height, width = current_frame.shape
+    num_blocks_x = motion_vectors.shape[1]
+    num_rows = row_end - row_start
+
+    # Current blocks as a (num_blocks, block_size, block_size) array, in raster order
+    current_blocks = current_frame[row_start * block_size:row_end * block_size, :num_blocks_x * block_size] \
+        .reshape(num_rows, block_size, num_blocks_x, block_size) \
+        .swapaxes(1, 2) \
+        .reshape(-1, block_size, block_size)
+    # Every possible reference block, indexed by its top-left corner (a view, nothing is copied)
+    reference_windows = np.lib.stride_tricks.sliding_window_view(reference_frame, (block_size, block_size))
+
+    start_y = np.repeat(np.arange(row_start, row_end) * block_size, num_blocks_x)
+    start_x = np.tile(np.arange(num_blocks_x) * block_size, num_rows)
+
+    # Keep only the blocks to search
+    searched = np.ones(len(current_blocks), dtype=bool)
+    if block_mask is not None:
+        searched = block_mask[row_start:row_end].ravel()
+        current_blocks, start_y, start_x = current_blocks[searched], start_y[searched], start_x[searched]
+
+    min_distance = np.full(len(current_blocks), np.inf)
+    best_offsets = np.zeros((len(current_blocks), 2), dtype=int)
+    if initial_vectors is not None:
+        # Start from the initial vectors, moved back inside the frame if needed
+        initial_offsets = initial_vectors[row_start:row_end].reshape(-1, 2)[searched]
+        best_offsets[:, 0] = np.clip(initial_offsets[:, 0], -start_y, height - block_size - start_y)
+        best_offsets[:, 1] = np.clip(initial_offsets[:, 1], -start_x, width - block_size - start_x)
+    evaluations = 0
+
+    step_size = search_radius // 2
+    first_step = True
+    while step_size >= 1:
+        # Same candidate order as tss_search: the center point is included only in the first step
+        search_points = [(0, 0)] if first_step else []
+        for offset_y in range(-step_size, step_size + 1, step_size):
+            for offset_x in range(-step_size, step_size + 1, step_size):
+                if offset_y == 0 and offset_x == 0 and not first_step:
+                    continue
+                search_points.append((offset_y, offset_x))
+        search_points = np.array(search_points)
+
+        # Reference positions of every candidate of every block, shape (num_blocks, num_candidates)
+        ref_y = (start_y + best_offsets[:, 0])[:, None] + search_points[:, 0]
+        ref_x = (start_x + best_offsets[:, 1])[:, None] + search_points[:, 1]
+        in_bounds = (0 <= ref_y) & (ref_y < height - block_size + 1) & (0 <= ref_x) & (ref_x < width - block_size + 1)
+        evaluations += int(in_bounds.sum())
+
+        # Gather the candidate blocks; out-of-bounds candidates read a clipped block and are masked afterwards
+        candidate_blocks = reference_windows[np.clip(ref_y, 0, height - block_size),
+                                             np.clip(ref_x, 0, width - block_size)]
+        distances = metric(current_blocks[:, None], candidate_blocks)
+        distances = np.where(in_bounds, distances, np.inf)
+
+        # First candidate reaching the minimum wins, and only if it improves on the previous steps
+        best_candidate = distances.argmin(axis=1)
+        candidate_distance = distances[np.arange(len(distances)), best_candidate]
+        improved = candidate_distance < min_distance
+        min_distance = np.where(improved, candidate_distance, min_distance)
+        best_offsets += np.where(improved[:, None], search_points[best_candidate], 0)
+
+        step_size //= 2
+        first_step = False
+
+    band_vectors = np.zeros((num_rows * num_blocks_x, 2), dtype=int)
+    band_vectors[searched] = best_offsets
+    motion_vectors[row_start:row_end] = band_vectors.reshape(num_rows, num_blocks_x, 2)
+
+    return evaluations
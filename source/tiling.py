@@ -0,0 +1,146 @@
+﻿import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def run_tiled(row_kernel, current_frame, reference_frame, motion_vectors, kernel_args=(), workers=None,
+              executor=None, releases_gil=False):
+    """
+    Fill a preallocated motion vector array by running a block matching kernel on row-band tiles.
+
+    The block grid is split into bands of consecutive block rows. Every band reads the whole current and
+    reference frames (search windows may cross band borders) and writes only its own rows of
+    motion_vectors, so the result is identical to running the kernel once over every row.
+
+    Input:
+    - row_kernel (callable): Called as row_kernel(current_frame, reference_frame, motion_vectors,
+        row_start, row_end, *kernel_args) and returns its number of block comparisons. It must be a
+        module-level function when tiles run in processes.
+    - current_frame (np.array): The current frame
+    - reference_frame (np.array): The reference frame
+    - motion_vectors (np.array): The (num_blocks_y, num_blocks_x, 2) array to fill
+    - kernel_args (tuple): Extra positional arguments for the kernel
+    - workers (int): Number of tiles to run concurrently. None or 1 runs serially on the calling thread, unless
+        an executor is given; with an executor, None splits the grid into os.cpu_count() tiles
+    - executor (concurrent.futures.Executor): Executor to run the tiles on, instead of creating one. Pass its
+        number of workers as workers
+    - releases_gil (bool): Whether the kernel spends its time in code that releases the GIL (NumPy
+        vector operations). Such kernels run in threads, the others in processes over shared memory
+
+    Returns:
+    - int: The number of block comparisons of all tiles
+    """
+    num_rows = motion_vectors.shape[0]
+
+    if (executor is None and (workers is None or workers <= 1)) or num_rows <= 1:
+        return row_kernel(current_frame, reference_frame, motion_vectors, 0, num_rows, *kernel_args)
+
+    if executor is not None:
+        use_processes = isinstance(executor, ProcessPoolExecutor)
+        num_tiles = workers or os.cpu_count() or 1
+    else:
+        use_processes = not releases_gil
+        num_tiles = workers
+    bands = [(int(rows[0]), int(rows[-1]) + 1)
+             for rows in np.array_split(np.arange(num_rows), min(num_tiles, num_rows))]
+
+    owns_executor = executor is None
+    if owns_executor:
+        executor_type = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        executor = executor_type(max_workers=workers)
+
+    try:
+        if use_processes:
+            evaluations = _run_bands_in_processes(executor, row_kernel, current_frame, reference_frame, motion_vectors,
+                                                  bands, kernel_args)
+        else:
+            # Threads share the arrays directly, each band writes a disjoint slice of motion_vectors
+            futures = [executor.submit(row_kernel, current_frame, reference_frame, motion_vectors,
+                                       row_start, row_end, *kernel_args)
+                       for row_start, row_end in bands]
+            evaluations = sum(future.result() for future in futures)
+    finally:
+        if owns_executor:
+            executor.shutdown()
+
+    return evaluations
+
+
+def _run_bands_in_processes(executor, row_kernel, current_frame, reference_frame, motion_vectors, bands,
+                            kernel_args):
+    # Both frames and the output are placed in shared memory once, the workers only receive their names
+    arrays = (current_frame, reference_frame, motion_vectors)
+    segments = [shared_memory.SharedMemory(create=True, size=max(1, array.nbytes)) for array in arrays]
+    try:
+        descriptors = []
+        for segment, array in zip(segments, arrays):
+            shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)
+            shared_array[...] = array
+            descriptors.append((segment.name, array.shape, array.dtype.str))
+            del shared_array
+
+        futures = [executor.submit(_run_band_in_shared_memory, row_kernel, descriptors, row_start, row_end,
+                                   kernel_args)
+                   for row_start, row_end in bands]
+        evaluations = sum(future.result() for future in futures)
+
+        motion_vectors[...] = np.ndarray(motion_vectors.shape, dtype=motion_vectors.dtype, buffer=segments[2].buf)
+        return evaluations
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+
+def _run_band_in_shared_memory(row_kernel, descriptors, row_start, row_end, kernel_args):
+    segments = [shared_memory.SharedMemory(name=name) for name, _, _ in descriptors]
+    arrays = None
+    try:
+        arrays = [np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+                  for segment, (_, shape, dtype) in zip(segments, descriptors)]
+        return row_kernel(*arrays, row_start, row_end, *kernel_args)
+    except Exception as error:
+        # The traceback would keep the shared views alive and stop the segments from closing
+        error.with_traceback(None)
+        raise
+    finally:
+        arrays = None
+        for segment in segments:
+            segment.close()
+
+
+def active_block_spans(block_mask, row_start, row_end, num_blocks_x):
+    """
+    Rectangles of the block grid that cover the searched blocks of rows [row_start, row_end).
+
+    Consecutive rows holding searched blocks form one rectangle, spanning the columns from their leftmost to
+    their rightmost searched block. Without a mask the whole band is one rectangle.
+
+    Input:
+    - block_mask (np.array): Boolean (num_blocks_y, num_blocks_x) array, or None to search every block
+    - row_start (int): First block row of the band
+    - row_end (int): Block row after the last one of the band
+    - num_blocks_x (int): Number of block columns
+
+    Returns:
+    - list: (row_start, row_end, col_start, col_end) tuples
+    """
+    if block_mask is None:
+        return [(row_start, row_end, 0, num_blocks_x)] if row_end > row_start and num_blocks_x > 0 else []
+
+    spans = []
+    active_rows = block_mask[row_start:row_end].any(axis=1)
+    block_y = 0
+    while block_y < len(active_rows):
+        if not active_rows[block_y]:
+            block_y += 1
+            continue
+        run_end = block_y
+        while run_end < len(active_rows) and active_rows[run_end]:
+            run_end += 1
+        active_cols = np.flatnonzero(block_mask[row_start + block_y:row_start + run_end].any(axis=0))
+        spans.append((row_start + block_y, row_start + run_end, int(active_cols[0]), int(active_cols[-1]) + 1))
+        block_y = run_end
+    return spans
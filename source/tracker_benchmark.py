@@ -0,0 +1,140 @@
+﻿import argparse
+import csv
+import json
+import sys
+import time
+
+import numpy as np
+
+from source.benchmark import DEFAULT_VIDEO, environment
+from source.ROITracking import TRACKERS, TrackingPipeline, available_trackers
+
+# The bunny coming out of its burrow in the first frame of media/input1.mp4
+DEFAULT_BBOX = (240, 260, 280, 280)
+# Backends the others are scored against when there is no ground truth, the first one available
+REFERENCE_TRACKERS = ('csrt', 'kcf', 'mil')
+
+
+def box_iou(first, second):
+    """Intersection over union of two (x, y, width, height) boxes, 0 if they do not overlap."""
+    left, top = max(first[0], second[0]), max(first[1], second[1])
+    right = min(first[0] + first[2], second[0] + second[2])
+    bottom = min(first[1] + first[3], second[1] + second[3])
+    intersection = max(0, right - left) * max(0, bottom - top)
+    union = first[2] * first[3] + second[2] * second[3] - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def track_boxes(video_path, tracker, bbox, max_frames=None):
+    """
+    Track one box through a video with a tracker backend.
+
+    Input:
+    - video_path (str): The video
+    - tracker (str): A key of ROITracking.TRACKERS
+    - bbox (tuple): (x, y, width, height) of the target in the first frame
+    - max_frames (int): Frames to track after the first one, the whole video if None
+
+    Returns:
+    - dict: frame index -> (x, y, width, height) box of every tracked frame
+    - float: The seconds the run took, decoding included
+    - int: The number of re-acquisitions
+    """
+    boxes = {}
+
+    def on_frame(frame, frame_index, bboxes):
+        boxes[frame_index] = bboxes[0]
+        if max_frames is not None and len(boxes) >= max_frames:
+            pipeline.stop()
+
+    pipeline = TrackingPipeline(video_path, frame_callback=on_frame, tracker=tracker)
+    pipeline.set_bounding_box(bbox)
+    start = time.perf_counter()
+    pipeline.run()
+    return boxes, time.perf_counter() - start, pipeline.reacquisition_summary()['attempts']
+
+
+def read_boxes(path, target=0):
+    """frame index -> (x, y, width, height) box of one target, from a .csv file written by `vectorview track`."""
+    with open(path, newline='') as boxes_file:
+        return {int(row['frame']): tuple(int(row[field]) for field in ('x', 'y', 'width', 'height'))
+                for row in csv.DictReader(boxes_file) if int(row['target']) == target}
+
+
+def run_tracker_benchmarks(trackers, video_path=DEFAULT_VIDEO, bbox=DEFAULT_BBOX, reference=None, max_frames=None,
+                           log=print):
+    """
+    Frame rate and box overlap of every tracker backend on a video.
+
+    Videos have no ground truth, so boxes are scored against a reference: ground truth boxes, or the boxes
+    of the first backend of REFERENCE_TRACKERS this OpenCV build has, tracked with the same settings.
+
+    Input:
+    - trackers (list): Keys of ROITracking.TRACKERS; backends this OpenCV build lacks are skipped
+    - video_path (str): The video
+    - bbox (tuple): (x, y, width, height) of the target in the first frame
+    - reference (dict): frame index -> ground truth box, None to track the reference backend
+    - max_frames (int): Frames to track after the first one, the whole video if None
+
+    Returns:
+    - list: One dict per backend with tracker, frames, seconds, fps, mean_iou, min_iou and reacquisitions
+    - str: The backend or 'ground truth' the boxes were scored against
+    """
+    available = available_trackers()
+    reference_name = 'ground truth'
+    if reference is None:
+        reference_name = next(name for name in REFERENCE_TRACKERS if name in available)
+        reference = track_boxes(video_path, reference_name, bbox, max_frames)[0]
+
+    results = []
+    for name in trackers:
+        if name not in available:
+            log(f"{TRACKERS[name].label:>22}  not available in this OpenCV build")
+            continue
+        boxes, seconds, reacquisitions = track_boxes(video_path, name, bbox, max_frames)
+        overlaps = [box_iou(box, reference[index]) for index, box in boxes.items() if index in reference]
+        result = {
+            'tracker': name,
+            'frames': len(boxes),
+            'seconds': seconds,
+            'fps': len(boxes) / seconds if seconds > 0 else float('inf'),
+            'mean_iou': float(np.mean(overlaps)) if overlaps else 0.0,
+            'min_iou': float(np.min(overlaps)) if overlaps else 0.0,
+            'reacquisitions': reacquisitions,
+        }
+        results.append(result)
+        log(f"{TRACKERS[name].label:>22} {result['frames']:>5} frames {result['fps']:9.2f} fps "
+            f"IoU mean {result['mean_iou']:.3f} min {result['min_iou']:.3f} "
+            f"re-acquisitions {reacquisitions}")
+    return results, reference_name
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the tracker backends.")
+    parser.add_argument('--trackers', nargs='+', choices=list(TRACKERS), default=list(TRACKERS))
+    parser.add_argument('--video', default=DEFAULT_VIDEO, help="Video to track")
+    parser.add_argument('--bbox', type=int, nargs=4, default=list(DEFAULT_BBOX),
+                        metavar=('X', 'Y', 'WIDTH', 'HEIGHT'), help="Target in the first frame")
+    parser.add_argument('--reference', default=None,
+                        help="Ground truth boxes, a .csv file of `vectorview track`; the first available backend "
+                             f"of {', '.join(REFERENCE_TRACKERS)} if not given")
+    parser.add_argument('--max-frames', type=int, default=None, help="Frames to track, the whole video if not given")
+    parser.add_argument('--output', default=None, help="Write the results to this JSON file")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    reference = read_boxes(args.reference) if args.reference else None
+    results, reference_name = run_tracker_benchmarks(args.trackers, args.video, tuple(args.bbox), reference,
+                                                     args.max_frames)
+    print(f"IoU against {reference_name}")
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'environment': environment(), 'reference': reference_name, 'results': results}, output_file,
+                      indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,25 +1,23 @@
 ﻿import cv2
 
+from source.utils.utils_video import get_frame
+
 
 def display_frame(video, frame_index, window_name='Frame'):
     """
     Display a specific frame from a video using OpenCV.
 
     Input:
-    - video (cv2.VideoCapture): The video
+    - video (FrameAccess or cv2.VideoCapture): The video, a FrameAccess serves frames scrubbed to before
+        from its cache
     - frame_index (int): The index of the frame to display
     - window_name (str): The name of the window in which to display the frame
     """
-    # Set the video's position to the specified frame index
-    video.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
-
-    # Read the frame at the current position
-    ret, frame = video.read()
+    # Read the frame through the cache of a FrameAccess, or by seeking the capture
+    frame = get_frame(video, frame_index)
 
     # If the frame was read successfully, display it
-    if ret:
+    if frame is not None:
         cv2.imshow(window_name, frame)
         cv2.waitKey(0)
-        cv2.destroyAllWindows()
-    else:
-        print(f"Error retrieving frame {frame_index}")
\ No newline at end of file
+        cv2.destroyAllWindows()
\ No newline at end of file
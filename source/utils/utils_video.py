@@ -1,5 +1,7 @@
 ﻿import cv2
 
+from source.frame_access import FrameAccess
+
 
 def open_video(file_path):
     """
@@ -22,15 +24,22 @@ def get_frame(video, index):
     """
     Get a specific frame from a video.
 
+    A FrameAccess serves it from its cache or decodes forward from the nearest keyframe; a cv2.VideoCapture
+    seeks to it.
+
     Input:
-    - video (cv2.VideoCapture): The video
+    - video (FrameAccess or cv2.VideoCapture): The video
     - index (int): The index of the frame to retrieve
 
     Returns:
-    np.array: The frame as a numpy array, or None if the frame could not be retrieved
+    np.array: The frame as a numpy array (read-only from a FrameAccess), or None if the frame could not be retrieved
     """
-    video.set(cv2.CAP_PROP_POS_FRAMES, index)
-    ret, frame = video.read()
+    if isinstance(video, FrameAccess):
+        frame = video.frame(index)
+        ret = frame is not None
+    else:
+        video.set(cv2.CAP_PROP_POS_FRAMES, index)
+        ret, frame = video.read()
     if not ret:
         print(f"Error retrieving frame {index}")
         return None
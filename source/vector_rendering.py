@@ -0,0 +1,170 @@
+﻿from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from source.quadtree import QuadtreeLeaves, leaf_centers, leaves_to_field
+from source.roi import mask_bounds
+
+# Every renderer draws a (num_blocks_y, num_blocks_x, 2) field of (dy, dx) motion vectors, or the QuadtreeLeaves
+# of a variable block size search, onto a BGR frame in place:
+# renderer(frame, motion_vectors, block_size, max_magnitude, block_mask=None) -> frame. max_magnitude is the
+# vector length shown at full strength by renderers that scale with it, usually the search radius. With a
+# block_mask, only the blocks set to True are drawn; leaves only exist where the search ran, so they ignore it.
+VectorRenderer = namedtuple('VectorRenderer', ['label', 'function'])
+
+ARROW_COLOR = (0, 0, 255)
+TIP_LENGTH = 0.1  # Length of the arrow head as a fraction of the arrow, as in cv2.arrowedLine
+SUBPIXEL_SHIFT = 4  # Fractional bits of the points of arrows drawn from sub-pixel vectors
+DENSE_OPACITY = 0.6  # Weight of the colour field over the frame in dense mode
+
+
+def block_centers(grid_shape, block_size):
+    """(x, y) pixel center of every block of a grid, shape (num_blocks_y, num_blocks_x, 2)."""
+    num_blocks_y, num_blocks_x = grid_shape
+    centers_x = np.arange(num_blocks_x) * block_size + block_size // 2
+    centers_y = np.arange(num_blocks_y) * block_size + block_size // 2
+    return np.stack(np.meshgrid(centers_x, centers_y), axis=-1)
+
+
+def draw_arrows(frame, motion_vectors, block_size, max_magnitude=None, block_mask=None, color=ARROW_COLOR,
+                thickness=1):
+    """
+    Draw one arrow per moving block, or per moving quadtree leaf, from its center along its motion vector.
+
+    Blocks without motion are skipped. The shafts of all arrows are drawn with one cv2.polylines call and
+    their heads with another, with the same geometry as cv2.arrowedLine. Sub-pixel (float) vectors are drawn
+    from fixed point coordinates with SUBPIXEL_SHIFT fractional bits instead of being rounded to pixels.
+
+    Input:
+    - frame (np.array): BGR frame, drawn on in place
+    - motion_vectors (np.array): (num_blocks_y, num_blocks_x, 2) field of (dy, dx) vectors, integer or float,
+        or QuadtreeLeaves
+    - block_size (int): The size of the block, unused for leaves
+    - max_magnitude (float): Unused, every arrow has the length of its vector
+    - block_mask (np.array): Boolean (num_blocks_y, num_blocks_x) array of the blocks to draw, None for all
+    - color (tuple): BGR color of the arrows
+    - thickness (int): Line thickness
+
+    Returns:
+    - np.array: The frame
+    """
+    if isinstance(motion_vectors, QuadtreeLeaves):
+        centers, motion_vectors = leaf_centers(motion_vectors), motion_vectors.vectors
+    else:
+        motion_vectors = np.asarray(motion_vectors)
+        centers = block_centers(motion_vectors.shape[:2], block_size)
+    moving = (motion_vectors != 0).any(axis=-1)
+    if block_mask is not None and centers.ndim == 3:
+        moving &= block_mask
+    if not moving.any():
+        return frame
+
+    starts = centers[moving].astype(np.float64)
+    ends = starts + motion_vectors[moving][:, ::-1]  # (dy, dx) -> (dx, dy)
+
+    # Both wings of a head leave the tip at 45 degrees from the shaft, TIP_LENGTH of its length long
+    backwards = starts - ends
+    angles = np.arctan2(backwards[:, 1], backwards[:, 0])
+    tip_sizes = np.hypot(backwards[:, 0], backwards[:, 1]) * TIP_LENGTH
+    wings = [ends + tip_sizes[:, None] * np.stack([np.cos(angles + turn), np.sin(angles + turn)], axis=-1)
+             for turn in (np.pi / 4, -np.pi / 4)]
+
+    shift = 0 if np.issubdtype(motion_vectors.dtype, np.integer) else SUBPIXEL_SHIFT
+    shafts = np.rint(np.stack([starts, ends], axis=1) * (1 << shift)).astype(np.int32)
+    heads = np.rint(np.stack([wings[0], ends, wings[1]], axis=1) * (1 << shift)).astype(np.int32)
+    cv2.polylines(frame, list(shafts), False, color, thickness, shift=shift)
+    cv2.polylines(frame, list(heads), False, color, thickness, shift=shift)
+    return frame
+
+
+def _hsv_lut():
+    # BGR color of every (angle, magnitude) pair: hue follows the direction in OpenCV's 0-179 range, the
+    # value the magnitude in 0-255, at full saturation
+    hue, value = np.meshgrid(np.arange(180, dtype=np.uint8), np.arange(256, dtype=np.uint8), indexing='ij')
+    hsv = np.stack([hue, np.full_like(hue, 255), value], axis=-1)
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+
+HSV_LUT = _hsv_lut()  # (180, 256, 3) uint8, indexed by [hue, value]
+
+
+def draw_dense(frame, motion_vectors, block_size, max_magnitude=None, block_mask=None):
+    """
+    Blend a colour-coded motion field over the frame: the hue shows the direction of every block's vector,
+    the brightness its length.
+
+    Colors are looked up in the precomputed HSV_LUT at block resolution, then scaled to pixels with a
+    single nearest-neighbour resize. With a block mask, only the bounding rectangle of its blocks is
+    colored, and within it only the masked blocks. Quadtree leaves are colored on the grid of the smallest
+    leaf, where they cover it.
+
+    Input:
+    - frame (np.array): BGR frame, drawn on in place
+    - motion_vectors (np.array): (num_blocks_y, num_blocks_x, 2) field of (dy, dx) vectors, or QuadtreeLeaves
+    - block_size (int): The size of the block, unused for leaves
+    - max_magnitude (float): Length shown at full brightness, the longest vector of the field if None
+    - block_mask (np.array): Boolean (num_blocks_y, num_blocks_x) array of the blocks to draw, None for all
+
+    Returns:
+    - np.array: The frame
+    """
+    if isinstance(motion_vectors, QuadtreeLeaves):
+        if not len(motion_vectors.sizes):
+            return frame
+        block_size = int(motion_vectors.sizes.min())
+        grid_shape = (frame.shape[0] // block_size, frame.shape[1] // block_size)
+        motion_vectors, block_mask = leaves_to_field(motion_vectors, grid_shape, block_size)
+    motion_vectors = np.asarray(motion_vectors, dtype=np.float32)
+    row_start, col_start = 0, 0
+    if block_mask is not None:
+        bounds = mask_bounds(block_mask)
+        if bounds is None:
+            return frame
+        row_start, row_end, col_start, col_end = bounds
+        motion_vectors = motion_vectors[row_start:row_end, col_start:col_end]
+        block_mask = block_mask[row_start:row_end, col_start:col_end]
+    num_blocks_y, num_blocks_x = motion_vectors.shape[:2]
+    magnitudes, angles = cv2.cartToPolar(motion_vectors[..., 1], motion_vectors[..., 0], angleInDegrees=True)
+    if not max_magnitude:
+        max_magnitude = max(float(magnitudes.max()), 1.0)
+
+    hues = (angles * 0.5).astype(np.int32) % 180
+    values = np.minimum(magnitudes * (255.0 / max_magnitude), 255).astype(np.int32)
+    colors = HSV_LUT[hues, values]
+
+    height, width = num_blocks_y * block_size, num_blocks_x * block_size
+    colors = cv2.resize(colors, (width, height), interpolation=cv2.INTER_NEAREST)
+    y, x = row_start * block_size, col_start * block_size
+    region = frame[y:y + height, x:x + width]
+    if block_mask is None:
+        cv2.addWeighted(colors, DENSE_OPACITY, region, 1 - DENSE_OPACITY, 0, dst=region)
+    else:
+        blended = cv2.addWeighted(colors, DENSE_OPACITY, region, 1 - DENSE_OPACITY, 0)
+        pixel_mask = cv2.resize(block_mask.astype(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST)
+        cv2.copyTo(blended, pixel_mask, region)
+    return frame
+
+
+RENDERERS = {
+    'arrows': VectorRenderer("Arrows", draw_arrows),
+    'dense': VectorRenderer("Colour-coded field", draw_dense),
+}
+
+
+def get_renderer(name):
+    """
+    Resolve a renderer name to its function.
+
+    Input:
+    - name (str): The renderer name, a key of RENDERERS
+
+    Returns:
+    - callable: The renderer, renderer(frame, motion_vectors, block_size, max_magnitude, block_mask) -> frame
+
+    Raises:
+    - ValueError: If no renderer is registered under that name
+    """
+    if name not in RENDERERS:
+        raise ValueError(f"Invalid vector renderer. Use one of: {', '.join(RENDERERS)}.")
+    return RENDERERS[name].function